@@ -4,12 +4,13 @@ Analyze all widgets in the downloads folder to identify their data sources.
 """
 
 import os
-import glob
 import re
 import json
 from collections import defaultdict
 from pathlib import Path
 
+from widget_corpus import open_corpus, parallel_map
+
 # Data source patterns to identify
 DATA_SOURCE_PATTERNS = {
     'weather': [
@@ -181,17 +182,101 @@ DATA_SOURCE_PATTERNS = {
     'none': [],  # For widgets with no external data source
 }
 
-def analyze_widget_file(file_path):
-    """Analyze a widget file (JSX or CoffeeScript) to identify data sources."""
-    try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read().lower()
-    except Exception as e:
-        return {'error': str(e)}
+# Characters that re.IGNORECASE matches against ASCII letters in the patterns
+# even after str.lower() (dotless i, long s). Content containing them is
+# matched with the original IGNORECASE regexes so results never change.
+CASEFOLD_SPECIAL_CHARS = ('\u0131', '\u017f')
+
+def _pattern_alternatives(pattern):
+    """
+    Split a simple pattern into alternatives of literal pieces.
     
-    detected_sources = []
+    'exec\\(|run\\(' -> [['exec('], ['run(']], 'crypto.*price' -> [['crypto', 'price']].
+    Returns None if the pattern uses anything beyond escapes, '|' and '.*'.
+    """
+    alternatives = [[]]
+    piece = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            piece.append(pattern[i + 1])
+            i += 2
+            continue
+        if char == '|':
+            alternatives[-1].append(''.join(piece))
+            alternatives.append([])
+            piece = []
+        elif pattern.startswith('.*', i):
+            alternatives[-1].append(''.join(piece))
+            piece = []
+            i += 1
+        elif char in '\\.^$*+?{}[]()':
+            return None
+        else:
+            piece.append(char)
+        i += 1
+    alternatives[-1].append(''.join(piece))
+    if any(not all(pieces) for pieces in alternatives):
+        return None
+    return alternatives
+
+def compile_data_source_patterns(patterns=DATA_SOURCE_PATTERNS):
+    """
+    Precompile DATA_SOURCE_PATTERNS into per-category probes.
     
-    # Check each data source category
+    Plain keywords become substring checks (`keyword in content`), which run
+    at memchr speed instead of going through the regex engine. Patterns such
+    as 'crypto.*price' are only handed to their compiled regex when every
+    literal piece is present. Anything the simple parser does not understand
+    keeps its compiled regex. Each category also keeps one IGNORECASE regex
+    for content containing CASEFOLD_SPECIAL_CHARS.
+    """
+    compiled = []
+    for source_type, source_patterns in patterns.items():
+        if source_type == 'none' or not source_patterns:
+            continue
+        keywords = []
+        guarded = []
+        regexes = []
+        for pattern in source_patterns:
+            alternatives = _pattern_alternatives(pattern)
+            if alternatives is None:
+                regexes.append(pattern)
+                continue
+            for pieces in alternatives:
+                if len(pieces) == 1:
+                    keywords.append(pieces[0])
+                else:
+                    guarded.append((tuple(pieces), re.compile('.*'.join(re.escape(p) for p in pieces))))
+        compiled.append({
+            'source_type': source_type,
+            'keywords': tuple(keywords),
+            'guarded': tuple(guarded),
+            'regex': re.compile('|'.join(regexes)) if regexes else None,
+            'fallback': re.compile('|'.join(f'(?:{p})' for p in source_patterns), re.IGNORECASE),
+        })
+    return compiled
+
+DATA_SOURCE_MATCHER = compile_data_source_patterns()
+
+def match_data_sources(content, matcher=DATA_SOURCE_MATCHER):
+    """Return the categories whose patterns occur in lowercased content, in DATA_SOURCE_PATTERNS order."""
+    if any(char in content for char in CASEFOLD_SPECIAL_CHARS):
+        return [c['source_type'] for c in matcher if c['fallback'].search(content)]
+    
+    detected_sources = []
+    for category in matcher:
+        if (any(keyword in content for keyword in category['keywords'])
+                or any(all(piece in content for piece in pieces) and regex.search(content)
+                       for pieces, regex in category['guarded'])
+                or (category['regex'] is not None and category['regex'].search(content))):
+            detected_sources.append(category['source_type'])
+    return detected_sources
+
+def match_data_sources_legacy(content):
+    """Original matcher: one uncompiled IGNORECASE search per pattern (kept for --benchmark)."""
+    detected_sources = []
     for source_type, patterns in DATA_SOURCE_PATTERNS.items():
         if source_type == 'none':
             continue
@@ -200,6 +285,24 @@ def analyze_widget_file(file_path):
             if re.search(pattern, content, re.IGNORECASE):
                 detected_sources.append(source_type)
                 break  # Only need one match per category
+    return detected_sources
+
+def analyze_widget_file(file_path):
+    """Analyze a widget file (JSX or CoffeeScript) to identify data sources."""
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            content = f.read()
+    except Exception as e:
+        return {'error': str(e)}
+    
+    return analyze_widget_content(content, file_path)
+
+def analyze_widget_content(content, file_path):
+    """Identify data sources in already-read widget source text."""
+    content = content.lower()
+    
+    # Check each data source category
+    detected_sources = match_data_sources(content)
     
     # Special case: if no sources detected and content is very simple, mark as 'none'
     if not detected_sources:
@@ -231,29 +334,29 @@ def get_widget_id_from_path(file_path):
         return widget_id
     return 'unknown'
 
-def main():
-    downloads_dir = 'downloads'
-    
-    if not os.path.exists(downloads_dir):
-        print(f"Error: {downloads_dir} directory not found")
-        return
-    
-    # Find all widget files (JSX and CoffeeScript)
-    jsx_files = glob.glob(os.path.join(downloads_dir, '**/*.jsx'), recursive=True)
-    coffee_files = glob.glob(os.path.join(downloads_dir, '**/*.coffee'), recursive=True)
-    all_files = jsx_files + coffee_files
-    
-    print(f"Found {len(jsx_files)} JSX files")
-    print(f"Found {len(coffee_files)} CoffeeScript files")
-    print(f"Total: {len(all_files)} widget files")
+def analyze_corpus_file(corpus, widget_file_key):
+    """Analyze one (folder, relpath) from a corpus; returns (widget_id, widget_file, result)."""
+    folder, relpath = widget_file_key
+    widget_file = corpus.display_path(folder, relpath)
+    # Remove .widget suffix if present
+    widget_id = folder.replace('.widget', '')
+    try:
+        result = analyze_widget_content(corpus.read_text(folder, relpath, errors='ignore'), widget_file)
+    except Exception as e:
+        result = {'error': str(e)}
+    return widget_id, widget_file, result
+
+def summarize_data_sources(file_results):
+    """
+    Merge per-file results into per-widget results.
     
-    # Analyze each widget
+    file_results is an iterable of (widget_id, widget_file, result) in scan
+    order (all JSX files, then all CoffeeScript files); results with an
+    'error' key are reported and skipped.
+    """
     widget_sources = defaultdict(lambda: {'sources': set(), 'files': [], 'jsx_count': 0, 'coffee_count': 0})
     
-    for widget_file in all_files:
-        widget_id = get_widget_id_from_path(widget_file)
-        result = analyze_widget_file(widget_file)
-        
+    for widget_id, widget_file, result in file_results:
         if 'error' in result:
             print(f"Error analyzing {widget_file}: {result['error']}")
             continue
@@ -277,6 +380,76 @@ def main():
             'jsx_count': data['jsx_count'],
             'coffee_count': data['coffee_count']
         }
+    return results
+
+def save_data_sources(results, output_file='widget_data_sources.json'):
+    """Write widget_data_sources.json."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    return output_file
+
+def benchmark_matchers(corpus, files):
+    """Run both matchers over the same files, check they agree and print timings."""
+    import time
+    
+    contents = [corpus.read_text(folder, relpath, errors='ignore').lower() for folder, relpath in files]
+    total_chars = sum(len(content) for content in contents)
+    
+    timings = {}
+    results = {}
+    for name, matcher in (('legacy', match_data_sources_legacy), ('compiled', match_data_sources)):
+        start = time.perf_counter()
+        results[name] = [matcher(content) for content in contents]
+        timings[name] = time.perf_counter() - start
+    
+    mismatches = sum(1 for a, b in zip(results['legacy'], results['compiled']) if a != b)
+    print(f"\nBenchmark over {len(contents)} files ({total_chars:,} chars):")
+    for name, seconds in timings.items():
+        print(f"  {name:10s}: {seconds:.3f}s ({total_chars / max(seconds, 1e-9) / 1e6:.1f} MB/s)")
+    print(f"  speedup   : {timings['legacy'] / max(timings['compiled'], 1e-9):.1f}x")
+    print(f"  mismatches: {mismatches}")
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Identify the data sources used by each widget')
+    parser.add_argument('--downloads', default='downloads',
+                       help='Directory containing widget files')
+    parser.add_argument('--index', default=None,
+                       help='Read widget files through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                       help='Read widget files straight from downloads/*.zip instead of extracted folders')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of worker processes (default: 1)')
+    parser.add_argument('--benchmark', action='store_true',
+                       help='Time the compiled matcher against the original per-pattern matcher and exit')
+    args = parser.parse_args()
+    
+    downloads_dir = args.downloads
+    
+    if not os.path.exists(downloads_dir):
+        print(f"Error: {downloads_dir} directory not found")
+        return
+    
+    corpus = open_corpus(downloads_dir, args.index, from_zips=args.from_zips)
+    
+    # Find all widget files (JSX and CoffeeScript)
+    jsx_files = list(corpus.iter_files(('.jsx',)))
+    coffee_files = list(corpus.iter_files(('.coffee',)))
+    all_files = jsx_files + coffee_files
+    
+    print(f"Found {len(jsx_files)} JSX files")
+    print(f"Found {len(coffee_files)} CoffeeScript files")
+    print(f"Total: {len(all_files)} widget files")
+    
+    if args.benchmark:
+        benchmark_matchers(corpus, all_files)
+        return
+    
+    # Analyze each widget
+    file_results = parallel_map(analyze_corpus_file, all_files, args.jobs, context=corpus)
+    
+    results = summarize_data_sources(file_results)
     
     # Print summary by data source type
     print("\n" + "="*80)
@@ -301,9 +474,7 @@ def main():
         print(f"  {widget_id:40s}: {', '.join(data['sources'])}")
     
     # Save detailed results to JSON
-    output_file = 'widget_data_sources.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    output_file = save_data_sources(results)
     print(f"\nDetailed results saved to: {output_file}")
     
     # Print sample widgets for each category
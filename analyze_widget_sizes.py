@@ -4,14 +4,16 @@ Analyze widget files to assess training data strategy.
 Determines which widgets are too large for max_sequence_length and recommends chunking/exclusion strategies.
 """
 
-import os
 import json
 import csv
-import glob
 from pathlib import Path
 from collections import defaultdict
+from functools import partial
 
-# Rough token estimation: ~4 chars per token for code (conservative)
+from token_counter import DEFAULT_CACHE_FILE, DEFAULT_TOKENIZER, CachedTokenCounter, CharEstimateCounter, open_token_counter
+from widget_corpus import DirectoryCorpus, open_corpus, parallel_map
+
+# Rough token estimation: ~4 chars per token for code (conservative; default, see --tokenizer)
 CHARS_PER_TOKEN = 4
 DEFAULT_MAX_SEQUENCE_LENGTH = 4095
 
@@ -19,16 +21,8 @@ def estimate_tokens(text_length, chars_per_token=CHARS_PER_TOKEN):
     """Estimate token count from character length"""
     return int(text_length / chars_per_token)
 
-def analyze_widget_files(csv_file_path, downloads_dir='downloads'):
-    """
-    Analyze widget JSX files to determine sizes and provide chunking recommendations.
-    
-    Args:
-        csv_file_path: Path to widget_processing_results.csv
-        downloads_dir: Directory containing widget files
-    """
-    
-    # Load CSV to get widget info
+def load_jsx_widgets(csv_file_path):
+    """Return [{'id', 'folder'}] for the JSX widgets listed in widget_processing_results.csv."""
     widgets = []
     with open(csv_file_path, 'r', encoding='utf-8') as f:
         reader = csv.DictReader(f)
@@ -38,55 +32,144 @@ def analyze_widget_files(csv_file_path, downloads_dir='downloads'):
                     'id': row['OS_widget_id'],
                     'folder': row['PS_widgetfoldername']
                 })
+    return widgets
+
+def widget_size_entry(widget, num_files, file_sizes, estimated_tokens=None):
+    """
+    Build the per-widget result from the sizes of the JSX files that could be read.
+    
+    `estimated_tokens` defaults to the chars / 4 estimate of the total size.
+    """
+    total_chars = sum(f['chars'] for f in file_sizes)
+    total_lines = sum(f['lines'] for f in file_sizes)
+    if estimated_tokens is None:
+        estimated_tokens = estimate_tokens(total_chars)
+    
+    return {
+        'widget_id': widget['id'],
+        'widget_folder': widget['folder'],
+        'total_chars': total_chars,
+        'total_lines': total_lines,
+        'estimated_tokens': estimated_tokens,
+        'num_files': num_files,
+        'file_sizes': file_sizes,
+        'exceeds_limit': estimated_tokens > DEFAULT_MAX_SEQUENCE_LENGTH
+    }
+
+def measure_widget(corpus, widget, keep_text=False):
+    """
+    Measure one widget's JSX files.
+    
+    Returns (result, warnings); result is None if the widget folder is missing.
+    Warnings are returned rather than printed so parallel runs log in order.
+    With keep_text, each file size entry also carries its 'text' so the
+    caller can count tokens with a real tokenizer; without it, a CorpusIndex
+    answers from the counts it stored instead of decoding the files.
+    """
+    if not corpus.has_widget(widget['folder']):
+        return None, []
+    
+    file_sizes = []
+    warnings = []
+    
+    if not keep_text and hasattr(corpus, 'file_metrics'):
+        # A CorpusIndex stored each file's counts when it was indexed
+        metrics = corpus.file_metrics(widget['folder'], ('.jsx',))
+        for jsx_file, chars, lines, decode_error in metrics:
+            if decode_error is not None:
+                warnings.append(f"Warning: Could not read {corpus.display_path(widget['folder'], jsx_file)}: {decode_error}")
+                continue
+            file_sizes.append({'file': jsx_file, 'chars': chars, 'lines': lines})
+        return widget_size_entry(widget, len(metrics), file_sizes), warnings
+    
+    # Find all JSX files
+    jsx_files = corpus.source_files(widget['folder'], ('.jsx',))
+    
+    for jsx_file in jsx_files:
+        try:
+            content = corpus.read_text(widget['folder'], jsx_file)
+            chars = len(content)
+            lines = content.count('\n')
+            file_sizes.append({
+                'file': jsx_file,
+                'chars': chars,
+                'lines': lines
+            })
+            if keep_text:
+                file_sizes[-1]['text'] = content
+        except Exception as e:
+            warnings.append(f"Warning: Could not read {corpus.display_path(widget['folder'], jsx_file)}: {e}")
+    
+    return widget_size_entry(widget, len(jsx_files), file_sizes), warnings
+
+def count_widget_tokens(results, token_counter):
+    """
+    Replace the chars / 4 estimates in `results` with `token_counter` counts.
+    
+    Expects file size entries measured with keep_text; every file is counted
+    in one batch and the texts are dropped afterwards.
+    """
+    counts = iter(token_counter.count_batch([f.pop('text') for r in results for f in r['file_sizes']]))
+    for r in results:
+        r['estimated_tokens'] = sum(next(counts) for _ in r['file_sizes'])
+        r['exceeds_limit'] = r['estimated_tokens'] > DEFAULT_MAX_SEQUENCE_LENGTH
+
+def analyze_widget_files(csv_file_path, downloads_dir='downloads', corpus=None, jobs=1, token_counter=None):
+    """
+    Analyze widget JSX files to determine sizes and provide chunking recommendations.
+    
+    Args:
+        csv_file_path: Path to widget_processing_results.csv
+        downloads_dir: Directory containing widget files
+        corpus: Widget source corpus (default: DirectoryCorpus over downloads_dir)
+        jobs: Number of worker processes (results are identical for any value)
+        token_counter: Token counter from token_counter.py (default: chars / 4)
+    """
+    if corpus is None:
+        corpus = DirectoryCorpus(downloads_dir)
+    
+    # Load CSV to get widget info
+    widgets = load_jsx_widgets(csv_file_path)
     
     print(f"Analyzing {len(widgets)} JSX widgets...\n")
     
     # Analyze each widget
+    # The chars estimate needs only sizes; real tokenizers need the text
+    use_estimate = token_counter is None or isinstance(token_counter, CharEstimateCounter) and \
+        token_counter.chars_per_token == CHARS_PER_TOKEN
+    measure = measure_widget if use_estimate else partial(measure_widget, keep_text=True)
+    
     results = []
-    for widget in widgets:
-        widget_path = os.path.join(downloads_dir, widget['folder'])
-        
-        if not os.path.exists(widget_path):
-            continue
-        
-        # Find all JSX files
-        jsx_files = glob.glob(os.path.join(widget_path, '**/*.jsx'), recursive=True)
-        
-        total_chars = 0
-        total_lines = 0
-        file_sizes = []
-        
-        for jsx_file in sorted(jsx_files):
-            try:
-                with open(jsx_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    chars = len(content)
-                    lines = content.count('\n')
-                    total_chars += chars
-                    total_lines += lines
-                    file_sizes.append({
-                        'file': os.path.relpath(jsx_file, widget_path),
-                        'chars': chars,
-                        'lines': lines
-                    })
-            except Exception as e:
-                print(f"Warning: Could not read {jsx_file}: {e}")
-        
-        estimated_tokens = estimate_tokens(total_chars)
-        
-        results.append({
-            'widget_id': widget['id'],
-            'widget_folder': widget['folder'],
-            'total_chars': total_chars,
-            'total_lines': total_lines,
-            'estimated_tokens': estimated_tokens,
-            'num_files': len(jsx_files),
-            'file_sizes': file_sizes,
-            'exceeds_limit': estimated_tokens > DEFAULT_MAX_SEQUENCE_LENGTH
-        })
+    for result, warnings in parallel_map(measure, widgets, jobs, context=corpus):
+        for warning in warnings:
+            print(warning)
+        if result is not None:
+            results.append(result)
+    
+    if not use_estimate:
+        count_widget_tokens(results, token_counter)
+        if isinstance(token_counter, CachedTokenCounter):
+            token_counter.save()
+            print(f"Tokenizer {token_counter.name}: {token_counter.hits} counts from {token_counter.cache_file}, "
+                  f"{token_counter.misses} texts tokenized\n")
     
     return results
 
+def save_size_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH,
+                       output_file='widget_size_analysis.json'):
+    """Write widget_size_analysis.json (results sorted by token count, largest first)."""
+    results.sort(key=lambda x: x['estimated_tokens'], reverse=True)
+    exceeding_limit = sum(1 for r in results if r['exceeds_limit'])
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'max_sequence_length': max_sequence_length,
+            'total_widgets': len(results),
+            'exceeding_limit': exceeding_limit,
+            'within_limit': len(results) - exceeding_limit,
+            'widgets': results
+        }, f, indent=2)
+    return output_file
+
 def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
     """Print detailed analysis and recommendations"""
     
@@ -178,15 +261,7 @@ def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
         print(f"   - Cons: Complex, may require manual chunking logic\n")
     
     # Export detailed results
-    output_file = 'widget_size_analysis.json'
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'max_sequence_length': max_sequence_length,
-            'total_widgets': total_widgets,
-            'exceeding_limit': exceeding_limit,
-            'within_limit': within_limit,
-            'widgets': results
-        }, f, indent=2)
+    output_file = save_size_analysis(results, max_sequence_length)
     
     print(f"\n✓ Detailed results saved to: {output_file}")
 
@@ -198,12 +273,26 @@ def main():
                        help='Path to widget_processing_results.csv')
     parser.add_argument('--downloads', default='downloads', 
                        help='Directory containing widget files')
+    parser.add_argument('--index', default=None,
+                       help='Read widget files through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                       help='Read widget files straight from downloads/*.zip instead of extracted folders')
     parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_SEQUENCE_LENGTH,
                        help='Maximum sequence length in tokens (default: 4095)')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of worker processes (default: 1)')
+    parser.add_argument('--tokenizer', default=DEFAULT_TOKENIZER,
+                       help='Token counter: chars[:N], sentencepiece:<model>, hf:<name-or-path> or tiktoken:<encoding> '
+                            '(default: chars, i.e. chars / 4)')
+    parser.add_argument('--token-cache', default=DEFAULT_CACHE_FILE,
+                       help=f'Token count cache for real tokenizers (default: {DEFAULT_CACHE_FILE}; empty to disable)')
     
     args = parser.parse_args()
     
-    results = analyze_widget_files(args.csv, args.downloads)
+    corpus = open_corpus(args.downloads, args.index, from_zips=args.from_zips)
+    token_counter = open_token_counter(args.tokenizer, args.token_cache)
+    results = analyze_widget_files(args.csv, args.downloads, corpus=corpus, jobs=args.jobs,
+                                   token_counter=token_counter)
     print_analysis(results, args.max_tokens)
 
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+"""
+Incremental dataset builds for create_dataset.py --incremental.
+
+The cache lives next to the dataset (datasets/<set>/build_cache.sqlite) and
+remembers, per widget:
+
+- fingerprint: (size, mtime) of its prompt file and the corpus signature of
+  each JSX file, so unchanged widgets are not read again
+- key: sha256 of (system message, prompt text, widget code)
+- line: the serialized JSONL line for that example
+
+and, per output file, a digest of the example keys it holds in order plus
+the file's (size, mtime_ns) when it was written, so a shard whose examples
+did not change, and which nothing else has rewritten since, is not rewritten.
+
+Use a fixed --seed or --split hash with --incremental: an unseeded shuffle
+reorders every split on each run and forces every shard to be rewritten.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+DEFAULT_CACHE_NAME = 'build_cache.sqlite'
+
+
+def system_key(system_message):
+    """sha256 of the serialized system message (system prompt and tools)."""
+    return hashlib.sha256(json.dumps(system_message, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def example_key(system_hash, prompt, code):
+    """sha256 of everything a serialized example depends on."""
+    digest = hashlib.sha256(system_hash.encode('ascii'))
+    for part in (prompt, code):
+        data = part.encode('utf-8')
+        digest.update(len(data).to_bytes(8, 'little'))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def widget_fingerprint(corpus, folder, prompt_file, jsx_files, system_hash):
+    """
+    Cheap signature of a widget's inputs, or None if the corpus cannot provide one.
+
+    Combines the system message hash, the prompt file's (size, mtime_ns) and
+    corpus.file_signature() of each JSX file; reads no file contents.
+    """
+    if not hasattr(corpus, 'file_signature'):
+        return None
+    stat = os.stat(prompt_file)
+    signature = [system_hash, prompt_file, stat.st_size, stat.st_mtime_ns]
+    for relpath in jsx_files:
+        signature.append([relpath, *corpus.file_signature(folder, relpath)])
+    return json.dumps(signature, ensure_ascii=False)
+
+
+def shard_digest(keys):
+    """Digest of the example keys of one output file, in order."""
+    return hashlib.sha256('\n'.join(keys).encode('ascii')).hexdigest()
+
+
+class BuildCache:
+    """SQLite store of serialized examples and shard digests for one dataset folder."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS examples (
+            widget_id TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            key TEXT NOT NULL,
+            line TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS shards (
+            name TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL
+        );
+    """
+    # Bumped whenever the shards table changes; older caches rewrite every shard once.
+    SCHEMA_VERSION = 2
+
+    def __init__(self, dataset_dir, cache_name=DEFAULT_CACHE_NAME):
+        self.cache_file = os.path.join(dataset_dir, cache_name)
+        self.conn = sqlite3.connect(self.cache_file)
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < self.SCHEMA_VERSION:
+            self.conn.execute('DROP TABLE IF EXISTS shards')
+            self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def fingerprints(self):
+        """{widget_id: (fingerprint, key)} for every cached example."""
+        return {
+            widget_id: (fingerprint, key)
+            for widget_id, fingerprint, key in self.conn.execute('SELECT widget_id, fingerprint, key FROM examples')
+        }
+
+    def lines(self, widget_ids):
+        """{widget_id: line} for the requested cached examples."""
+        lines = {}
+        ids = list(widget_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            lines.update(self.conn.execute(
+                f'SELECT widget_id, line FROM examples WHERE widget_id IN ({placeholders})', chunk
+            ))
+        return lines
+
+    def store(self, examples):
+        """Insert or replace (widget_id, fingerprint, key, line) rows."""
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO examples (widget_id, fingerprint, key, line) VALUES (?, ?, ?, ?)', examples
+            )
+
+    def prune(self, widget_ids):
+        """Drop cached examples for widgets that are no longer in the dataset."""
+        keep = set(widget_ids)
+        stale = [(w,) for (w,) in self.conn.execute('SELECT widget_id FROM examples') if w not in keep]
+        with self.conn:
+            self.conn.executemany('DELETE FROM examples WHERE widget_id = ?', stale)
+        return len(stale)
+
+    def shard_unchanged(self, name, output_file, digest):
+        """
+        True if `output_file` was last written by this cache with the same example keys
+        and still has the (size, mtime_ns) it had then.
+        """
+        row = self.conn.execute('SELECT digest, size, mtime_ns FROM shards WHERE name = ?', (name,)).fetchone()
+        if row is None or row[0] != digest:
+            return False
+        try:
+            stat = os.stat(output_file)
+        except FileNotFoundError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (row[1], row[2])
+
+    def record_shard(self, name, output_file, digest):
+        """Remember the example keys and (size, mtime_ns) of a freshly written `output_file`."""
+        stat = os.stat(output_file)
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO shards (name, digest, size, mtime_ns) VALUES (?, ?, ?, ?)',
+                (name, digest, stat.st_size, stat.st_mtime_ns),
+            )
+
+    def clear_shards(self):
+        """Forget every shard digest, e.g. after the split files were written without the cache."""
+        with self.conn:
+            self.conn.execute('DELETE FROM shards')
+
+
+def clear_shard_digests(dataset_dir, cache_name=DEFAULT_CACHE_NAME):
+    """BuildCache.clear_shards() for `dataset_dir`, if it has a build cache."""
+    if not os.path.exists(os.path.join(dataset_dir, cache_name)):
+        return
+    cache = BuildCache(dataset_dir, cache_name)
+    try:
+        cache.clear_shards()
+    finally:
+        cache.close()
@@ -1,15 +1,39 @@
+import bisect
+import hashlib
 import json
 import os
 import random
 import csv
-import glob
 import argparse
 import sys
+from collections import defaultdict
 import training_config
 from training_config import TOOL_DEFINITION
+from build_cache import BuildCache, clear_shard_digests, example_key, shard_digest, system_key, widget_fingerprint
+from dedupe_widgets import load_clusters
+from dataset_format import (ConversationWriter, CompactWriter, build_example_turns, build_system_message,
+                            compact_path, write_compact_meta)
+from packed_corpus import PackedCorpus
+from token_counter import DEFAULT_CACHE_FILE, DEFAULT_TOKENIZER, CachedTokenCounter, open_token_counter
+from widget_corpus import open_corpus, parallel_imap, parallel_map
 
 # Rough token estimation: ~4 chars per token for code/text (matches evaluate_training_data_size.py)
 CHARS_PER_TOKEN = 4
+DEFAULT_MAX_SEQUENCE_LENGTH = 4095
+DEFAULT_BUCKET_BOUNDARIES = (512, 1024, 2048, 4095)
+# AdapterTrainingConfiguration batch size used in the training notebook
+DEFAULT_BATCH_SIZE = 2
+# Hash split positions below 0.8 are train, below 0.9 valid, the rest test
+HASH_SPLIT_BOUNDARIES = (0.8, 0.9)
+SPLIT_NAMES = ('train', 'valid', 'test')
+# Target share of each split, from the boundaries above (0.8 / 0.1 / 0.1)
+SPLIT_RATIOS = tuple(b - a for a, b in zip((0.0, *HASH_SPLIT_BOUNDARIES), (*HASH_SPLIT_BOUNDARIES, 1.0)))
+# Split of every widget placed by --stratify, kept in the dataset folder
+SPLIT_ASSIGNMENTS_FILE = 'split_assignments.json'
+# Widgets in flight between the CSV reader and the writers with --stream
+STREAM_BUFFER_SIZE = 256
+# Archived system prompts, kept next to training_config.py
+SYSTEM_PROMPTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'system_prompts.json')
 
 def estimate_tokens(text_length, chars_per_token=CHARS_PER_TOKEN):
     """Estimate token count from character length"""
@@ -37,31 +61,71 @@ def truncate_code_to_tokens(code, max_tokens):
     
     return truncated
 
-def load_strategy(strategy_file='training_data_strategy.json'):
+def load_strategy(strategy_file='training_data_strategy.json', max_seq_len=None):
     """
     Load strategy recommendations from JSON file.
     Returns dict mapping widget_id to strategy entry, or empty dict if file doesn't exist.
+    
+    With `max_seq_len`, the strategy for that length is taken from the file's
+    'strategies' (written by evaluate_training_data_size.py --seq-lens);
+    raises ValueError if the file is missing, unreadable or has none for it,
+    rather than silently building an unfiltered dataset.
     """
     if not os.path.exists(strategy_file):
+        if max_seq_len is not None:
+            raise ValueError(
+                f"Strategy file {strategy_file} not found; "
+                f"run evaluate_training_data_size.py --seq-lens {max_seq_len} first"
+            )
         return {}
     
     try:
         with open(strategy_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            return data.get('strategy', {})
     except Exception as e:
+        if max_seq_len is not None:
+            raise ValueError(f"Could not load strategy file {strategy_file}: {e}") from e
         print(f"Warning: Could not load strategy file {strategy_file}: {e}")
         return {}
+    if max_seq_len is None or (max_seq_len == data.get('max_sequence_length') and 'strategy' in data):
+        return data.get('strategy', {})
+    strategies = data.get('strategies', {})
+    if str(max_seq_len) not in strategies:
+        available = sorted(set(map(int, strategies)) | ({data['max_sequence_length']} if 'max_sequence_length' in data else set()))
+        raise ValueError(
+            f"No strategy for max_sequence_length {max_seq_len} in {strategy_file}. "
+            f"Available: {', '.join(map(str, available)) or '(none)'}; "
+            f"rerun evaluate_training_data_size.py --seq-lens to add it"
+        )
+    return strategies[str(max_seq_len)]['strategy']
         
 # Extraction functions removed - now using complete widget code as jsxContent
 
+def load_system_prompts(prompts_file=SYSTEM_PROMPTS_FILE):
+    """Archived system prompts by name from system_prompts.json ({} if the file is missing)."""
+    if not os.path.exists(prompts_file):
+        return {}
+    with open(prompts_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
 def resolve_system_prompt(prompt_name):
-    """Resolve a system prompt string by name from training_config."""
+    """
+    Resolve a system prompt by name to (content, tools).
+    
+    Prompts defined in training_config are paired with [TOOL_DEFINITION].
+    Other names are looked up in system_prompts.json, so archived system
+    messages are rebuilt as they were: their own 'content' and 'tools', or
+    no tools for prompts archived without any.
+    """
     if not hasattr(training_config, prompt_name):
+        archived = load_system_prompts()
+        if isinstance(archived.get(prompt_name, {}).get('content'), str):
+            return archived[prompt_name]['content'], archived[prompt_name].get('tools') or []
         available = [
             name for name in dir(training_config)
             if name.startswith('systemPrompt')
-        ]
+        ] + [name for name in archived if not hasattr(training_config, name)]
         available_display = ', '.join(sorted(available)) or '(none)'
         raise ValueError(
             f"Unknown system prompt '{prompt_name}'. "
@@ -72,7 +136,714 @@ def resolve_system_prompt(prompt_name):
         raise ValueError(
             f"System prompt '{prompt_name}' is not a string."
         )
-    return prompt_value
+    return prompt_value, [TOOL_DEFINITION]
+
+
+def strategy_exclusion(strategy, widget_id):
+    """Reason the strategy excludes a widget, or None if it is kept."""
+    if widget_id in strategy:
+        widget_strategy = strategy[widget_id]
+        action = widget_strategy.get('action', 'keep')
+        
+        if action == 'exclude':
+            return widget_strategy.get('reason', 'Strategy recommends exclusion')
+    return None
+
+
+def cached_example(context, row):
+    """
+    Entry for a widget whose inputs are unchanged since the last incremental build.
+    
+    Compares the widget's fingerprint (prompt file and JSX file signatures)
+    with the one in context['cached'] without reading any file contents.
+    Returns {'widget_id', 'key', 'fingerprint', 'cached': True} or None if
+    the widget has to be loaded again.
+    """
+    corpus = context['corpus']
+    widget_id = row['OS_widget_id']
+    widget_folder = row['PS_widgetfoldername']
+    fingerprint, key = context['cached'].get(widget_id, (None, None))
+    prompt_file = f'prompts/{widget_id}.prompt'
+    if fingerprint is None or not os.path.exists(prompt_file) or not corpus.has_widget(widget_folder):
+        return None
+    try:
+        current = widget_fingerprint(corpus, widget_folder, prompt_file,
+                                     corpus.source_files(widget_folder, ('.jsx',)), context['system_hash'])
+    except OSError:
+        return None
+    if current != fingerprint:
+        return None
+    return {'widget_id': widget_id, 'key': key, 'fingerprint': fingerprint, 'cached': True}
+
+
+def load_widget_example(context, row):
+    """
+    Load the prompt and widget code for one CSV row.
+    
+    `context` holds the corpus, the strategy mapping and optionally a
+    PackedCorpus to read prompts from. Returns
+    (entry, message, excluded): entry is None when the widget is skipped and
+    message explains why, so parallel runs can print it in CSV order.
+    
+    For incremental builds context['cached'] maps widget IDs to their cached
+    (fingerprint, key); unchanged widgets come back as cached entries
+    without prompt or code, and loaded entries carry their 'fingerprint'.
+    """
+    corpus = context['corpus']
+    strategy = context['strategy']
+    pack = context.get('pack')
+    cached = context.get('cached')
+    widget_id = row['OS_widget_id']
+    widget_folder = row['PS_widgetfoldername']
+    
+    if cached is not None and pack is None:
+        entry = cached_example(context, row)
+        if entry is not None:
+            reason = strategy_exclusion(strategy, widget_id)
+            if reason:
+                return None, f"Skipping {widget_id}: {reason}", True
+            return entry, None, False
+    
+    # Read prompt from the pack or the prompts folder
+    prompt_file = f'prompts/{widget_id}.prompt'
+    if pack is None and not os.path.exists(prompt_file):
+        return None, f"Skipping {widget_id}: No prompt file found at {prompt_file}", False
+    
+    try:
+        if pack is not None:
+            prompt = pack.prompt(widget_id)
+        else:
+            with open(prompt_file, 'r', encoding='utf-8') as f:
+                prompt = f.read().strip()
+    except Exception as e:
+        return None, f"Skipping {widget_id}: Could not read prompt file: {e}", False
+    
+    if prompt is None:
+        return None, f"Skipping {widget_id}: No prompt file found at {prompt_file}", False
+    
+    # Skip if no prompt content
+    if not prompt:
+        return None, f"Skipping {widget_id}: Empty prompt file", False
+    
+    # Get widget code from the corpus
+    if not corpus.has_widget(widget_folder):
+        widget_path = os.path.join(corpus.downloads_dir, widget_folder)
+        return None, f"Skipping {widget_id}: Widget folder not found at {widget_path}", False
+    
+    jsx_files = corpus.source_files(widget_folder, ('.jsx',))
+    if not jsx_files:
+        return None, f"Skipping {widget_id}: No JSX files found", False
+    
+    # Fingerprint before reading, so a file changed mid-build is re-read next time
+    fingerprint = None
+    if cached is not None and pack is None:
+        fingerprint = widget_fingerprint(corpus, widget_folder, prompt_file, jsx_files, context['system_hash'])
+    
+    # All JSX files concatenated, each prefixed with its filename as a comment
+    code = corpus.widget_code(widget_folder)
+    if code is None:
+        return None, f"Skipping {widget_id}: No readable JSX content", False
+    
+    # Apply strategy if available
+    reason = strategy_exclusion(strategy, widget_id)
+    if reason:
+        return None, f"Skipping {widget_id}: {reason}", True
+    
+    entry = {
+        'prompt': prompt,
+        'code': code,
+        'widget_id': widget_id
+    }
+    if cached is not None:
+        entry['fingerprint'] = fingerprint
+    return entry, None, False
+
+
+def limit_per_cluster(data, clusters, max_per_cluster=1):
+    """
+    Keep at most `max_per_cluster` entries from each near-duplicate cluster.
+    
+    `clusters` maps widget_id to its widget_clusters.json entry (see
+    dedupe_widgets.py). Entries are taken in CSV order, so the cluster
+    representative is kept first when it is present. Widgets missing from
+    `clusters` are kept. Returns (kept, skipped) where skipped is a list of
+    (entry, representative_id).
+    """
+    kept = []
+    skipped = []
+    for entry, cluster in iter_cluster_limited(data, clusters, max_per_cluster):
+        if cluster is None:
+            kept.append(entry)
+        else:
+            skipped.append((entry, cluster))
+    return kept, skipped
+
+
+def iter_cluster_limited(entries, clusters, max_per_cluster=1):
+    """Yield (entry, None) for kept entries and (entry, representative_id) for skipped ones, in order."""
+    counts = defaultdict(int)
+    for entry in entries:
+        cluster = clusters.get(entry['widget_id'], {}).get('cluster', entry['widget_id'])
+        if counts[cluster] < max_per_cluster:
+            counts[cluster] += 1
+            yield entry, None
+        else:
+            yield entry, cluster
+
+
+def split_position(salt, widget_id):
+    """Position of a widget in [0, 1) from a salted sha256 of its ID; the same on every run."""
+    digest = hashlib.sha256(f'{salt}:{widget_id}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / 2 ** 64
+
+
+def hash_split(data, salt=''):
+    """
+    Deterministic 80/10/10 split of entries by a salted hash of their widget ID.
+    
+    An entry goes to train below position 0.8, valid below 0.9 and test
+    above, so adding or removing widgets never moves the others. Each split
+    is ordered by position. Returns (train, valid, test).
+    """
+    keyed = sorted(((split_position(salt, entry['widget_id']), entry['widget_id'], entry) for entry in data),
+                   key=lambda k: (k[0], k[1]))
+    
+    splits = ([], [], [])
+    for position, _, entry in keyed:
+        splits[bisect.bisect_right(HASH_SPLIT_BOUNDARIES, position)].append(entry)
+    return splits
+
+
+def stratified_hash_split(data, salt, categories, assignments):
+    """
+    Split stratified by AI_category that never moves a widget once placed.
+    
+    `assignments` (widget_id -> split name, see load_split_assignments) holds
+    the widgets placed by earlier builds; they stay where they are, even if
+    their category changed. The other widgets are placed in salted hash
+    order, each into the split of its category (widget_id -> AI_category in
+    `categories`) that is furthest below its 80/10/10 share, and are added
+    to `assignments`. A category's valid and test splits therefore fill as
+    soon as it has enough widgets. Each split is ordered by hash position.
+    Returns (train, valid, test).
+    """
+    keyed = sorted(((split_position(salt, entry['widget_id']), entry['widget_id'], entry) for entry in data),
+                   key=lambda k: (k[0], k[1]))
+    counts = defaultdict(lambda: [0, 0, 0])
+    placed = {}
+    for _, widget_id, _ in keyed:
+        if assignments.get(widget_id) in SPLIT_NAMES:
+            placed[widget_id] = SPLIT_NAMES.index(assignments[widget_id])
+            counts[categories.get(widget_id, '')][placed[widget_id]] += 1
+    
+    for _, widget_id, _ in keyed:
+        if widget_id in placed:
+            continue
+        category_counts = counts[categories.get(widget_id, '')]
+        total = sum(category_counts) + 1
+        # Largest shortfall against the target share; ties go to the earlier split
+        index = max(range(len(SPLIT_NAMES)), key=lambda i: (SPLIT_RATIOS[i] * total - category_counts[i], -i))
+        category_counts[index] += 1
+        placed[widget_id] = index
+        assignments[widget_id] = SPLIT_NAMES[index]
+    
+    splits = ([], [], [])
+    for _, widget_id, entry in keyed:
+        splits[placed[widget_id]].append(entry)
+    return splits
+
+
+def load_split_assignments(dataset_dir, salt):
+    """
+    {widget_id: split name} recorded by the last --stratify build of dataset_dir.
+    
+    Empty if there is none or it was made with a different salt.
+    """
+    assignments_file = os.path.join(dataset_dir, SPLIT_ASSIGNMENTS_FILE)
+    if not os.path.exists(assignments_file):
+        return {}
+    with open(assignments_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('salt') != salt:
+        print(f"Split salt changed ({data.get('salt')!r} -> {salt!r}); placing every widget again")
+        return {}
+    return data.get('assignments', {})
+
+
+def save_split_assignments(dataset_dir, salt, assignments):
+    assignments_file = os.path.join(dataset_dir, SPLIT_ASSIGNMENTS_FILE)
+    with open(assignments_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'salt': salt, 'assignments': dict(sorted(assignments.items()))}, f, indent=2)
+    os.replace(assignments_file + '.tmp', assignments_file)
+    return assignments_file
+
+
+def category_split_counts(splits, categories):
+    """{AI_category: [train, valid, test]} example counts of a split."""
+    counts = defaultdict(lambda: [0, 0, 0])
+    for index, split_data in enumerate(splits):
+        for entry in split_data:
+            counts[categories.get(entry['widget_id'], '')][index] += 1
+    return dict(counts)
+
+
+def first_fit_decreasing(lengths, capacity):
+    """
+    Pack items into bins of `capacity` with first-fit-decreasing.
+    
+    Returns a list of bins, each a list of item indices. Items are placed
+    longest first (ties in input order) into the first bin with room; an
+    item longer than `capacity` gets a bin of its own.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    bins = []
+    remaining = []
+    for i in order:
+        length = lengths[i]
+        for b, room in enumerate(remaining):
+            if length <= room:
+                bins[b].append(i)
+                remaining[b] -= length
+                break
+        else:
+            bins.append([i])
+            remaining.append(capacity - length)
+    return bins
+
+
+def pack_examples(dataset, example_tokens, system_tokens, max_tokens):
+    """
+    Pack a split into sequences of at most `max_tokens` tokens.
+    
+    `example_tokens` are the lengths of each entry's turns and `system_tokens`
+    the length of the shared system message, which every sequence pays once.
+    Returns (sequences, sequence_tokens, stats); sequences are lists of
+    entries in random order and sequence_tokens their lengths.
+    """
+    capacity = max_tokens - system_tokens
+    bins = first_fit_decreasing(example_tokens, capacity)
+    random.shuffle(bins)
+    sequences = [[dataset[i] for i in b] for b in bins]
+    sequence_tokens = [system_tokens + sum(example_tokens[i] for i in b) for b in bins]
+    
+    useful = sum(example_tokens)
+    unpacked_tokens = useful + system_tokens * len(dataset)
+    packed_tokens = useful + system_tokens * len(bins)
+    stats = {
+        'examples': len(dataset),
+        'sequences': len(bins),
+        'oversized_examples': sum(1 for t in example_tokens if t > capacity),
+        'max_examples_per_sequence': max((len(b) for b in bins), default=0),
+        'example_tokens': useful,
+        'unpacked_total_tokens': unpacked_tokens,
+        'packed_total_tokens': packed_tokens,
+        'unpacked_fill': round(unpacked_tokens / (len(dataset) * max_tokens), 4) if dataset else 0.0,
+        'packed_fill': round(packed_tokens / (len(bins) * max_tokens), 4) if bins else 0.0,
+    }
+    return sequences, sequence_tokens, stats
+
+
+def bucket_label(boundaries, index):
+    """Name of bucket `index`: le0512 ... for each boundary, gtNNNN for the overflow bucket."""
+    if index < len(boundaries):
+        return f'le{boundaries[index]:04d}'
+    return f'gt{boundaries[-1]:04d}'
+
+
+def bucket_sequences(sequences, sequence_tokens, boundaries):
+    """
+    Group sequences into token-length buckets, shuffling within each bucket.
+    
+    A sequence goes into the first bucket whose boundary is >= its length;
+    longer ones go into a final overflow bucket. Returns a list of
+    (label, sequences, sequence_tokens) per non-empty bucket, shortest first.
+    """
+    buckets = [[] for _ in range(len(boundaries) + 1)]
+    for sequence, tokens in zip(sequences, sequence_tokens):
+        index = bisect.bisect_left(boundaries, tokens)
+        buckets[index].append((sequence, tokens))
+    
+    result = []
+    for index, bucket in enumerate(buckets):
+        if not bucket:
+            continue
+        random.shuffle(bucket)
+        result.append((bucket_label(boundaries, index), [b[0] for b in bucket], [b[1] for b in bucket]))
+    return result
+
+
+def padding_fraction(sequence_tokens, batch_size):
+    """
+    Fraction of padding tokens when consecutive sequences are batched.
+    
+    Each batch is padded to its longest sequence, so this is
+    1 - real tokens / (batch size * longest length) summed over batches.
+    """
+    padded = 0
+    for start in range(0, len(sequence_tokens), batch_size):
+        batch = sequence_tokens[start:start + batch_size]
+        padded += max(batch) * len(batch)
+    return round(1 - sum(sequence_tokens) / padded, 4) if padded else 0.0
+
+
+def write_incremental_splits(cache, writer, system_hash, split_files):
+    """
+    Write single-example splits through the build cache.
+    
+    `split_files` is a list of (name, entries, output_file). Loaded entries
+    are serialized only if their key (system message, prompt, code) is new;
+    cached entries reuse their stored line. A file is rewritten only if the
+    keys of its examples, in order, differ from the last build.
+    Returns (reused, serialized, unchanged_files).
+    """
+    entries = [entry for _, split_data, _ in split_files for entry in split_data]
+    cached_keys = {widget_id: key for widget_id, (_, key) in cache.fingerprints().items()}
+    keys = {}
+    for entry in entries:
+        if entry.get('cached'):
+            keys[entry['widget_id']] = entry['key']
+        else:
+            keys[entry['widget_id']] = example_key(system_hash, entry['prompt'], entry['code'])
+    lines = cache.lines([w for w, key in keys.items() if cached_keys.get(w) == key])
+    
+    rows = []
+    serialized = 0
+    for entry in entries:
+        widget_id = entry['widget_id']
+        if entry.get('cached'):
+            continue
+        if widget_id not in lines:
+            try:
+                lines[widget_id] = writer.validated_line([entry])
+            except ValueError as e:
+                print(f'Error in {widget_id}: {e}')
+                sys.exit(1)
+            serialized += 1
+        rows.append((widget_id, entry['fingerprint'], keys[widget_id], lines[widget_id]))
+    cache.store(rows)
+    
+    unchanged = 0
+    for name, split_data, output_file in split_files:
+        split_keys = [keys[e['widget_id']] for e in split_data]
+        digest = shard_digest(split_keys)
+        if cache.shard_unchanged(name, output_file, digest):
+            unchanged += 1
+            continue
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for entry in split_data:
+                f.write(lines[entry['widget_id']] + '\n')
+        cache.record_shard(name, output_file, digest)
+    
+    cache.prune(keys)
+    return len(entries) - serialized, serialized, unchanged
+
+
+def iter_jsx_rows(csv_file_path, counts):
+    """CSV source: yield the JSX rows of the CSV one at a time."""
+    with open(csv_file_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            counts['rows'] += 1
+            if row.get('PS_isJSX') != 'Y':
+                continue
+            counts['jsx'] += 1
+            yield row
+
+
+def filter_strategy_rows(rows, strategy, counts):
+    """Strategy filter: drop rows the strategy excludes before their code is read."""
+    for row in rows:
+        reason = strategy_exclusion(strategy, row['OS_widget_id'])
+        if reason:
+            print(f"Skipping {row['OS_widget_id']}: {reason}")
+            counts['excluded'] += 1
+            continue
+        yield row
+
+
+def iter_loaded_examples(rows, context, jobs, counts, buffer_size=STREAM_BUFFER_SIZE):
+    """Code loader: yield entries with prompt and code, in CSV order, at most buffer_size in flight."""
+    for entry, message, excluded in parallel_imap(load_widget_example, rows, jobs, context, buffer_size):
+        if message:
+            print(message)
+        if excluded:
+            counts['excluded'] += 1
+        if entry is not None:
+            counts['loaded'] += 1
+            yield entry
+
+
+def filter_cluster_entries(entries, clusters, max_per_cluster, counts):
+    """Near-duplicate filter: keep max_per_cluster entries per cluster."""
+    for entry, cluster in iter_cluster_limited(entries, clusters, max_per_cluster):
+        if cluster is not None:
+            print(f"Skipping {entry['widget_id']}: Near-duplicate of {cluster}")
+            counts['near_duplicates'] += 1
+            continue
+        yield entry
+
+
+def iter_serialized(entries, writers):
+    """Serializer: yield (entry, validated line per writer); entries are dropped after this stage."""
+    for entry in entries:
+        try:
+            lines = [writer.validated_line([entry]) for writer in writers]
+        except ValueError as e:
+            print(f"Error in {entry['widget_id']}: {e}")
+            sys.exit(1)
+        yield entry['widget_id'], lines
+
+
+def clear_shards(dataset_dir):
+    """
+    Delete the bucket shards of an earlier build from dataset_dir/shards/ and return its path.
+    
+    Shards from a previous --bucket-shards run would not match newly written splits.
+    """
+    shards_dir = os.path.join(dataset_dir, 'shards')
+    if os.path.isdir(shards_dir):
+        for name in os.listdir(shards_dir):
+            if name.endswith('.jsonl'):
+                os.remove(os.path.join(shards_dir, name))
+    return shards_dir
+
+
+def write_split_stream(serialized, dataset_dirs, split_salt):
+    """
+    Split sink: append each line to train/valid/test of every dataset by hash position.
+    
+    Lines go to .tmp files that replace the split files only once the stream
+    is exhausted, so a failed or empty run leaves the previous files in place;
+    raises ValueError if no example was written.
+    
+    Returns the number of examples written per split.
+    """
+    written = dict.fromkeys(SPLIT_NAMES, 0)
+    paths = [
+        {name: os.path.join(dataset_dir, f'{name}.jsonl') for name in SPLIT_NAMES}
+        for dataset_dir in dataset_dirs
+    ]
+    files = [{name: open(path + '.tmp', 'w', encoding='utf-8') for name, path in split_paths.items()}
+             for split_paths in paths]
+    try:
+        for widget_id, lines in serialized:
+            split_name = SPLIT_NAMES[bisect.bisect_right(HASH_SPLIT_BOUNDARIES, split_position(split_salt, widget_id))]
+            for split_files, line in zip(files, lines):
+                split_files[split_name].write(line + '\n')
+            written[split_name] += 1
+        for split_files in files:
+            for f in split_files.values():
+                f.close()
+        if not any(written.values()):
+            raise ValueError("No valid data to process; existing split files were left unchanged")
+        for dataset_dir, split_paths in zip(dataset_dirs, paths):
+            for path in split_paths.values():
+                os.replace(path + '.tmp', path)
+            clear_shards(dataset_dir)
+            clear_shard_digests(dataset_dir)
+    finally:
+        for split_files, split_paths in zip(files, paths):
+            for f in split_files.values():
+                f.close()
+            for path in split_paths.values():
+                if os.path.exists(path + '.tmp'):
+                    os.remove(path + '.tmp')
+    return written
+
+
+def stream_dataset(csv_file_path, dataset_dirs, system_messages, strategy_file, corpus, pack, jobs,
+                   clusters_file, max_per_cluster, split_salt, max_seq_len=None):
+    """
+    Build datasets as a chain of generators, holding a bounded number of widgets in memory.
+    
+    CSV source -> strategy filter -> code loader -> near-duplicate filter ->
+    serializer -> split sink. Each widget goes to the split its hash position
+    picks (see hash_split), so nothing has to be collected before writing;
+    splits keep CSV order instead of hash order. Only the strategy and
+    cluster lookups are held in full.
+    """
+    strategy = load_strategy(strategy_file, max_seq_len)
+    if strategy:
+        print(f"Loaded strategy file: {len(strategy)} widgets have strategy recommendations"
+              + (f" for max_sequence_length {max_seq_len}" if max_seq_len else ""))
+    else:
+        print("No strategy file found - processing all widgets without exclusions/truncations")
+    
+    # Check the CSV before any output file is touched
+    try:
+        with open(csv_file_path, 'r', encoding='utf-8') as f:
+            header = next(csv.reader(f), [])
+    except FileNotFoundError:
+        print(f"Error: The file {csv_file_path} was not found.")
+        return
+    for column in ('AI_prompt', 'PS_widgetfoldername'):
+        if column not in header:
+            print(f"Error: '{column}' column not found in CSV")
+            return
+    
+    counts = defaultdict(int)
+    writers = [ConversationWriter(message) for message in system_messages]
+    context = {'corpus': corpus, 'strategy': strategy, 'pack': pack}
+    
+    rows = iter_jsx_rows(csv_file_path, counts)
+    rows = filter_strategy_rows(rows, strategy, counts)
+    entries = iter_loaded_examples(rows, context, jobs, counts)
+    if clusters_file:
+        entries = filter_cluster_entries(entries, load_clusters(clusters_file), max_per_cluster, counts)
+    print(f"Streaming widgets into {', '.join(dataset_dirs)} (salt {split_salt!r})...")
+    try:
+        written = write_split_stream(iter_serialized(entries, writers), dataset_dirs, split_salt)
+    except ValueError:
+        print(f"Read {counts['rows']} CSV rows, {counts['jsx']} JSX widgets")
+        raise
+    
+    print(f"Read {counts['rows']} CSV rows, {counts['jsx']} JSX widgets")
+    print(f"Processed {counts['loaded']} widgets with valid prompts and code")
+    if counts['excluded'] > 0:
+        print(f"  Excluded: {counts['excluded']} widgets (exceeded token limit per strategy recommendations)")
+    if clusters_file:
+        print(f"  Near-duplicates skipped: {counts['near_duplicates']} widgets "
+              f"(max {max_per_cluster} per cluster in {clusters_file})")
+    print('All lines valid!')
+    print(f"Dataset created: {written['train']} train, {written['valid']} valid, {written['test']} test")
+    for dataset_dir in dataset_dirs:
+        print(f'Files written to: {dataset_dir}')
+
+
+def write_dataset(
+    dataset_dir,
+    system_prompt_name,
+    system_message,
+    train_data,
+    valid_data,
+    test_data,
+    pack_sequences=False,
+    max_tokens=DEFAULT_MAX_SEQUENCE_LENGTH,
+    token_counter=None,
+    bucket_boundaries=None,
+    bucket_shards=False,
+    batch_size=DEFAULT_BATCH_SIZE,
+    compact=False,
+    cache=None,
+):
+    """
+    Write the train/valid/test files of one dataset to `dataset_dir`.
+    
+    The splits are lists of loaded entries; `system_message` is shared by
+    every line. Packing, buckets, the compact format and the build cache
+    behave as described in create_dataset_from_csv; token_counter must be
+    set when packing or bucketing.
+    """
+    train_file = os.path.join(dataset_dir, 'train.jsonl')
+    valid_file = os.path.join(dataset_dir, 'valid.jsonl')
+    test_file = os.path.join(dataset_dir, 'test.jsonl')
+    
+    # Writes chat format with tools; every line is validated in memory before it is written
+    if compact:
+        # System message stored once in compact.json; lines reference it by prompt name
+        writer = CompactWriter(system_prompt_name, system_message)
+        
+        def write_jsonl(sequences, output_file):
+            writer.write(sequences, compact_path(output_file))
+    else:
+        conversation_writer = ConversationWriter(system_message)
+        write_jsonl = conversation_writer.write
+    
+    splits = {'train': train_data, 'valid': valid_data, 'test': test_data}
+    split_tokens = {}
+    if pack_sequences or bucket_boundaries:
+        # Sizes of the JSON pieces of a line: '[' + system + (', ' + turns)* + ']'
+        system_tokens = token_counter.count(json.dumps([system_message], ensure_ascii=False))
+        for split_name, split_data in splits.items():
+            split_tokens[split_name] = token_counter.count_batch(
+                [json.dumps(build_example_turns(entry), ensure_ascii=False) for entry in split_data]
+            )
+        if isinstance(token_counter, CachedTokenCounter):
+            token_counter.save()
+    
+    if pack_sequences:
+        packing_stats = {'max_tokens': max_tokens, 'tokenizer': token_counter.name,
+                         'system_tokens': system_tokens, 'splits': {}}
+        for split_name, split_data in splits.items():
+            sequences, sequence_tokens, stats = pack_examples(
+                split_data, split_tokens[split_name], system_tokens, max_tokens
+            )
+            splits[split_name] = sequences
+            split_tokens[split_name] = sequence_tokens
+            packing_stats['splits'][split_name] = stats
+            print(f"Packed {stats['examples']} {split_name} examples into {stats['sequences']} sequences "
+                  f"(fill {stats['unpacked_fill']:.1%} -> {stats['packed_fill']:.1%})")
+            if stats['oversized_examples']:
+                print(f"  {stats['oversized_examples']} {split_name} examples exceed {max_tokens} tokens on their own")
+        
+        stats_file = os.path.join(dataset_dir, 'packing_stats.json')
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(packing_stats, f, indent=2)
+        print(f"Packing stats written to: {stats_file}")
+    else:
+        splits = {name: [[entry] for entry in split_data] for name, split_data in splits.items()}
+        if split_tokens:
+            split_tokens = {name: [system_tokens + t for t in tokens] for name, tokens in split_tokens.items()}
+    
+    shards_dir = clear_shards(dataset_dir)
+    if cache is None:
+        # The split files are about to change behind a --incremental cache's back
+        clear_shard_digests(dataset_dir)
+    
+    if bucket_boundaries:
+        boundaries = sorted(bucket_boundaries)
+        bucket_stats = {'boundaries': boundaries, 'batch_size': batch_size, 'tokenizer': token_counter.name,
+                        'splits': {}}
+        if bucket_shards:
+            os.makedirs(shards_dir, exist_ok=True)
+        for split_name, sequences in splits.items():
+            before = padding_fraction(split_tokens[split_name], batch_size)
+            buckets = bucket_sequences(sequences, split_tokens[split_name], boundaries)
+            splits[split_name] = [sequence for _, bucket, _ in buckets for sequence in bucket]
+            split_tokens[split_name] = [tokens for _, _, bucket_tokens in buckets for tokens in bucket_tokens]
+            after = padding_fraction(split_tokens[split_name], batch_size)
+            bucket_stats['splits'][split_name] = {
+                'sequences': len(sequences),
+                'buckets': {label: len(bucket) for label, bucket, _ in buckets},
+                'padding_fraction_before': before,
+                'padding_fraction_after': after,
+            }
+            print(f"Bucketed {len(sequences)} {split_name} sequences into {len(buckets)} buckets "
+                  f"(padding at batch size {batch_size}: {before:.1%} -> {after:.1%})")
+            if bucket_shards:
+                for label, bucket, _ in buckets:
+                    write_jsonl(bucket, os.path.join(shards_dir, f'{split_name}_{label}.jsonl'))
+        
+        stats_file = os.path.join(dataset_dir, 'bucket_stats.json')
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(bucket_stats, f, indent=2)
+        print(f"Bucket stats written to: {stats_file}")
+    
+    # Write and validate datasets
+    if compact:
+        write_jsonl(splits['train'], train_file)
+        write_jsonl(splits['valid'], valid_file)
+        write_jsonl(splits['test'], test_file)
+        meta_file = write_compact_meta(dataset_dir, [writer])
+        print(f'Compact dataset index written to: {meta_file} (expand with dataset_format.py)')
+    elif cache is not None:
+        print('Writing and validating JSONL files (incremental)...')
+        reused, serialized, unchanged = write_incremental_splits(
+            cache, conversation_writer, system_key(system_message),
+            [(name, [sequence[0] for sequence in splits[name]], output_file)
+             for name, output_file in (('train', train_file), ('valid', valid_file), ('test', test_file))]
+        )
+        cache.close()
+        print(f'All lines valid! Reused {reused} cached examples, serialized {serialized}, '
+              f'{unchanged} of 3 files unchanged')
+    else:
+        print('Writing and validating JSONL files...')
+        write_jsonl(splits['train'], train_file)
+        write_jsonl(splits['valid'], valid_file)
+        write_jsonl(splits['test'], test_file)
+        print('All lines valid!')
+    
+    print(f'Dataset created: {len(train_data)} train, {len(valid_data)} valid, {len(test_data)} test')
+    print(f'Files written to: {dataset_dir}')
 
 
 def create_dataset_from_csv(
@@ -80,6 +851,25 @@ def create_dataset_from_csv(
     set_name,
     strategy_file='training_data_strategy.json',
     system_prompt_name='systemPrompt_v6',
+    corpus=None,
+    jobs=1,
+    pack=None,
+    pack_sequences=False,
+    max_tokens=DEFAULT_MAX_SEQUENCE_LENGTH,
+    token_counter=None,
+    bucket_boundaries=None,
+    bucket_shards=False,
+    batch_size=DEFAULT_BATCH_SIZE,
+    compact=False,
+    clusters_file=None,
+    max_per_cluster=1,
+    incremental=False,
+    seed=None,
+    split='random',
+    split_salt='',
+    stratify=False,
+    stream=False,
+    max_seq_len=None,
 ):
     """
     Create JSONL dataset files from CSV and widget code files.
@@ -87,20 +877,80 @@ def create_dataset_from_csv(
     Args:
         csv_file_path: Path to the widget_processing_results.csv file
         set_name: Name of the dataset folder to create under datasets/
+        system_prompt_name: Name of the system prompt (training_config or system_prompts.json),
+            or a list of names: the corpus is then loaded, filtered and split once and one
+            dataset per prompt is written to datasets/{set_name}_{name}, all with the same splits
         strategy_file: Path to strategy JSON file (default: training_data_strategy.json)
+        corpus: Widget source corpus (default: DirectoryCorpus over downloads/)
+        jobs: Number of worker processes used to load widgets (output does not depend on it)
+        pack: PackedCorpus to read prompts and widget code from (replaces corpus)
+        pack_sequences: Bin-pack several examples into each line of up to max_tokens tokens
+            (first-fit-decreasing, counted with token_counter) and write packing_stats.json
+        max_tokens: Token budget per packed sequence
+        token_counter: Token counter from token_counter.py (default: chars / 4)
+        bucket_boundaries: Token-length bucket upper bounds; when set, each split is
+            written in bucket order (shuffled within buckets) and bucket_stats.json
+            reports the padding fraction for batch_size before and after
+        bucket_shards: Also write one file per bucket under shards/
+        batch_size: Batch size assumed by the padding report
+        compact: Write the compact format (train.compact.jsonl etc. plus compact.json, see
+            dataset_format.py) instead of chat-format JSONL
+        clusters_file: widget_clusters.json from dedupe_widgets.py; near-duplicates
+            beyond max_per_cluster per cluster are skipped
+        max_per_cluster: Widgets kept per near-duplicate cluster (default: 1, the representative)
+        incremental: Reuse unchanged widgets and serialized lines from datasets/{set}/build_cache.sqlite
+            and skip rewriting unchanged split files (see build_cache.py)
+        seed: Seed for the shuffles, so repeated builds split and order examples the same way
+        split: 'random' (shuffle, then 80/10/10) or 'hash' (each widget placed by a salted hash
+            of its OS_widget_id, so adding widgets does not move existing ones; see hash_split)
+        split_salt: Salt for the hash split; a different salt gives a different split
+        stratify: With the hash split, place new widgets into the split their AI_category is
+            short of and keep placed widgets where they are (see stratified_hash_split);
+            placements are kept in datasets/{set}/split_assignments.json
+        stream: Build with the constant-memory streaming pipeline (see stream_dataset);
+            requires the unstratified hash split and plain chat-format output
+        max_seq_len: Training max_sequence_length; picks the matching strategy from the
+            strategy file's 'strategies' instead of the one for its max_sequence_length
     """
+    if incremental and (pack_sequences or bucket_boundaries or compact):
+        print("Error: --incremental works with plain chat-format datasets only (not --pack, --buckets or --compact)")
+        return
+    if stratify and split != 'hash':
+        print("Error: --stratify requires --split hash")
+        return
+    if stream and (split != 'hash' or stratify or pack_sequences or bucket_boundaries or compact or incremental):
+        print("Error: --stream requires --split hash without --stratify, and plain chat-format output "
+              "(not --pack, --buckets, --compact or --incremental)")
+        return
+    if seed is not None:
+        random.seed(seed)
     
-    # Resolve system prompt once
-    system_prompt = resolve_system_prompt(system_prompt_name)
-
-    # Create dataset directory in current project
-    dataset_dir = f'datasets/{set_name}'
-    os.makedirs(dataset_dir, exist_ok=True)
+    if pack is not None:
+        corpus = pack
+    elif corpus is None:
+        corpus = open_corpus()
     
-    # Output file paths
-    train_file = os.path.join(dataset_dir, 'train.jsonl')
-    valid_file = os.path.join(dataset_dir, 'valid.jsonl')
-    test_file = os.path.join(dataset_dir, 'test.jsonl')
+    # Resolve system prompts once; with several, each gets datasets/{set}_{name}
+    variants = [system_prompt_name] if isinstance(system_prompt_name, str) else list(system_prompt_name)
+    if incremental and len(variants) > 1:
+        print("Error: --incremental builds one dataset at a time (give a single --system-prompt)")
+        return
+    system_messages = {
+        name: build_system_message(*resolve_system_prompt(name)) for name in variants
+    }
+    
+    # Create dataset directories in current project
+    if len(variants) == 1:
+        dataset_dirs = [f'datasets/{set_name}']
+    else:
+        dataset_dirs = [f'datasets/{set_name}_{name}' for name in variants]
+    for dataset_dir in dataset_dirs:
+        os.makedirs(dataset_dir, exist_ok=True)
+    
+    if stream:
+        stream_dataset(csv_file_path, dataset_dirs, [system_messages[name] for name in variants], strategy_file,
+                       corpus, pack, jobs, clusters_file, max_per_cluster, split_salt, max_seq_len)
+        return
     
     # Load CSV data
     try:
@@ -131,164 +981,90 @@ def create_dataset_from_csv(
         return
     
     # Load strategy file if it exists
-    strategy = load_strategy(strategy_file)
+    strategy = load_strategy(strategy_file, max_seq_len)
     if strategy:
-        print(f"Loaded strategy file: {len(strategy)} widgets have strategy recommendations")
+        print(f"Loaded strategy file: {len(strategy)} widgets have strategy recommendations"
+              + (f" for max_sequence_length {max_seq_len}" if max_seq_len else ""))
     else:
         print("No strategy file found - processing all widgets without exclusions/truncations")
     
     # Process each widget
     data = []
     excluded_count = 0
-    for row in jsx_widgets:
-        widget_id = row['OS_widget_id']
-        widget_folder = row['PS_widgetfoldername']
-        
-        # Read prompt from prompts folder
-        prompt_file = f'prompts/{widget_id}.prompt'
-        if not os.path.exists(prompt_file):
-            print(f"Skipping {widget_id}: No prompt file found at {prompt_file}")
-            continue
-        
-        try:
-            with open(prompt_file, 'r', encoding='utf-8') as f:
-                prompt = f.read().strip()
-        except Exception as e:
-            print(f"Skipping {widget_id}: Could not read prompt file: {e}")
-            continue
-        
-        # Skip if no prompt content
-        if not prompt:
-            print(f"Skipping {widget_id}: Empty prompt file")
-            continue
-        
-        # Get widget code from filesystem
-        widget_path = os.path.join('downloads', widget_folder)
-        if not os.path.exists(widget_path):
-            print(f"Skipping {widget_id}: Widget folder not found at {widget_path}")
-            continue
-        
-        # Find and concatenate all JSX files
-        jsx_files = glob.glob(os.path.join(widget_path, '**/*.jsx'), recursive=True)
-        if not jsx_files:
-            print(f"Skipping {widget_id}: No JSX files found")
-            continue
-        
-        # Concatenate JSX files
-        code_parts = []
-        for jsx_file in sorted(jsx_files):
-            try:
-                with open(jsx_file, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                    if content:
-                        # Add filename as comment for context
-                        relative_path = os.path.relpath(jsx_file, widget_path)
-                        code_parts.append(f"// {relative_path}\n{content}")
-            except Exception as e:
-                print(f"Warning: Could not read {jsx_file}: {e}")
-        
-        if not code_parts:
-            print(f"Skipping {widget_id}: No readable JSX content")
-            continue
-        
-        # Join all JSX files with line breaks
-        code = '\n\n'.join(code_parts)
-        
-        # Apply strategy if available
-        if widget_id in strategy:
-            widget_strategy = strategy[widget_id]
-            action = widget_strategy.get('action', 'keep')
-            
-            if action == 'exclude':
-                excluded_count += 1
-                reason = widget_strategy.get('reason', 'Strategy recommends exclusion')
-                print(f"Skipping {widget_id}: {reason}")
-                continue
-        
-        data.append({
-            'prompt': prompt,
-            'code': code,
-            'widget_id': widget_id
-        })
+    context = {'corpus': corpus, 'strategy': strategy, 'pack': pack}
+    cache = None
+    if incremental:
+        cache = BuildCache(dataset_dirs[0])
+        context['cached'] = cache.fingerprints()
+        context['system_hash'] = system_key(system_messages[variants[0]])
+    for entry, message, excluded in parallel_map(load_widget_example, jsx_widgets, jobs, context=context):
+        if message:
+            print(message)
+        if excluded:
+            excluded_count += 1
+        if entry is not None:
+            data.append(entry)
     
     print(f"Processed {len(data)} widgets with valid prompts and code")
     if excluded_count > 0:
         print(f"  Excluded: {excluded_count} widgets (exceeded token limit per strategy recommendations)")
     
+    if clusters_file:
+        data, skipped = limit_per_cluster(data, load_clusters(clusters_file), max_per_cluster)
+        for entry, cluster in skipped:
+            print(f"Skipping {entry['widget_id']}: Near-duplicate of {cluster}")
+        print(f"  Near-duplicates skipped: {len(skipped)} widgets (max {max_per_cluster} per cluster in {clusters_file})")
+    
     if len(data) == 0:
         print("No valid data to process")
         return
     
-    # Shuffle and split data
-    random.shuffle(data)
-    train_size = int(0.8 * len(data))
-    valid_size = int(0.1 * len(data))
-    
-    train_data = data[:train_size]
-    valid_data = data[train_size:train_size + valid_size]
-    test_data = data[train_size + valid_size:]
-    
-    def validate_jsonl_file(file_path):
-        """Validate that all lines in a JSONL file contain valid JSON"""
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f, 1):
-                try:
-                    json.loads(line)
-                except json.JSONDecodeError as e:
-                    print(f'Error in {file_path}, line {i}: {e}')
-                    sys.exit(1)
-    
-    def write_jsonl(dataset, output_file):
-        """Write dataset to JSONL file in chat format with tools"""
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for entry in dataset:
-                # Generate a tool call ID
-#                tool_call_id = f"call_{uuid.uuid4().hex[:16]}"
-                
-                # Create the arguments JSON object, then stringify it for the tool call
-                arguments_obj = {
-                    'jsxContent': entry['code']
-                }
-                arguments_json = json.dumps(arguments_obj, ensure_ascii=False)
-                
-                json_entry = [
-                    {
-                        'role': 'system', 
-                        'content': system_prompt,
-                        'tools': [TOOL_DEFINITION]
-                    },
-                    {'role': 'user', 'content': entry['prompt']},
-                    {
-                        'role': 'assistant',
-                        'content': '',
-                        'tool_calls': [
-                            {
-#                                'id': tool_call_id,
-                                'type': 'function',
-                                'function': {
-                                    'name': 'WriteUbersichtWidgetToFileSystem',
-                                    'arguments': arguments_json
-                                }
-                            }
-                        ]
-                    }
-                ]
-                f.write(json.dumps(json_entry, ensure_ascii=False) + '\n')
-    
-    # Write datasets
-    write_jsonl(train_data, train_file)
-    write_jsonl(valid_data, valid_file)
-    write_jsonl(test_data, test_file)
-    
-    # Validate generated JSONL files
-    print('Validating generated JSONL files...')
-    validate_jsonl_file(train_file)
-    validate_jsonl_file(valid_file)
-    validate_jsonl_file(test_file)
-    print('All lines valid!')
+    if split == 'hash':
+        if stratify:
+            # Placed widgets keep their split; new ones fill their category's shortfall
+            categories = {row['OS_widget_id']: row.get('AI_category', '') for row in jsx_widgets}
+            assignments = load_split_assignments(dataset_dirs[0], split_salt)
+            known = len(assignments)
+            train_data, valid_data, test_data = stratified_hash_split(data, split_salt, categories, assignments)
+            assignments_file = save_split_assignments(dataset_dirs[0], split_salt, assignments)
+            print(f"Hash split (salt {split_salt!r}, stratified by AI_category): "
+                  f"{len(assignments) - known} new widgets placed, assignments in {assignments_file}")
+        else:
+            # Each widget's split depends only on its ID, not on the other widgets
+            train_data, valid_data, test_data = hash_split(data, split_salt)
+            print(f"Hash split (salt {split_salt!r})")
+        if stratify:
+            print("  Realized split per AI_category (train/valid/test):")
+            for category, counts in sorted(category_split_counts((train_data, valid_data, test_data), categories).items()):
+                total = sum(counts)
+                print(f"  {category or '(none)':<30} {counts[0]}/{counts[1]}/{counts[2]} "
+                      f"({counts[0] / total:.0%} / {counts[1] / total:.0%} / {counts[2] / total:.0%})")
+    else:
+        # Shuffle and split data
+        random.shuffle(data)
+        train_size = int(0.8 * len(data))
+        valid_size = int(0.1 * len(data))
+        
+        train_data = data[:train_size]
+        valid_data = data[train_size:train_size + valid_size]
+        test_data = data[train_size + valid_size:]
     
-    print(f'Dataset created: {len(train_data)} train, {len(valid_data)} valid, {len(test_data)} test')
-    print(f'Files written to: {dataset_dir}')
+    if len(variants) > 1:
+        print(f"Writing {len(variants)} dataset variants with the same splits: {', '.join(variants)}")
+    if (pack_sequences or bucket_boundaries) and token_counter is None:
+        token_counter = open_token_counter()
+    for prompt_name, dataset_dir in zip(variants, dataset_dirs):
+        write_dataset(
+            dataset_dir, prompt_name, system_messages[prompt_name], train_data, valid_data, test_data,
+            pack_sequences=pack_sequences,
+            max_tokens=max_tokens,
+            token_counter=token_counter,
+            bucket_boundaries=bucket_boundaries,
+            bucket_shards=bucket_shards,
+            batch_size=batch_size,
+            compact=compact,
+            cache=cache,
+        )
 
 def main():
     parser = argparse.ArgumentParser(description='Create JSONL dataset from widget CSV and code files')
@@ -302,17 +1078,163 @@ def main():
     parser.add_argument(
         '--system-prompt',
         default='systemPrompt_v6',
-        help='Name of the system prompt string in training_config.py (default: systemPrompt_v6)',
+        help='Name of the system prompt string in training_config.py or system_prompts.json; '
+             'comma-separated names build one dataset per prompt (datasets/{set}_{name}) '
+             'from a single load with identical splits (default: systemPrompt_v6)',
+    )
+    parser.add_argument('--downloads', default='downloads', help='Directory containing widget files')
+    parser.add_argument(
+        '--index',
+        default=None,
+        help='Read widget code through a persistent corpus index (e.g. corpus_index.sqlite), refreshed incrementally',
+    )
+    parser.add_argument(
+        '--from-zips',
+        action='store_true',
+        help='Read widget code straight from downloads/*.zip instead of extracted folders',
+    )
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes (default: 1)')
+    parser.add_argument(
+        '--packed',
+        default=None,
+        help='Read prompts and widget code from a pack built by packed_corpus.py (e.g. widget_pack.bin)',
+    )
+    parser.add_argument(
+        '--pack',
+        action='store_true',
+        help='Bin-pack several examples into each sequence (one shared system message) and write packing_stats.json',
+    )
+    parser.add_argument(
+        '--max-tokens',
+        type=int,
+        default=None,
+        help='Token budget per packed sequence, i.e. max_sequence_length (default: --max-seq-len, else 4095)',
+    )
+    parser.add_argument(
+        '--max-seq-len',
+        type=int,
+        default=None,
+        help='max_sequence_length the dataset is trained with: applies the strategy for that length '
+             'from the strategy file (see evaluate_training_data_size.py --seq-lens)',
+    )
+    parser.add_argument(
+        '--tokenizer',
+        default=DEFAULT_TOKENIZER,
+        help='Token counter used for packing: chars[:N], sentencepiece:<model>, hf:<name-or-path> or tiktoken:<encoding>',
+    )
+    parser.add_argument(
+        '--token-cache',
+        default=DEFAULT_CACHE_FILE,
+        help=f'Token count cache for real tokenizers (default: {DEFAULT_CACHE_FILE}; empty to disable)',
+    )
+    parser.add_argument(
+        '--buckets',
+        default=None,
+        help='Write each split in token-length bucket order, shuffled within buckets; '
+             f'comma-separated upper bounds, or "default" for {",".join(map(str, DEFAULT_BUCKET_BOUNDARIES))}',
+    )
+    parser.add_argument(
+        '--bucket-shards',
+        action='store_true',
+        help='With --buckets, also write one file per bucket to datasets/{set}/shards/',
+    )
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='Write the compact format that stores the system prompt and tools once (expand with dataset_format.py)',
+    )
+    parser.add_argument(
+        '--clusters',
+        default=None,
+        help='widget_clusters.json from dedupe_widgets.py; keep only --max-per-cluster widgets per near-duplicate cluster',
+    )
+    parser.add_argument(
+        '--max-per-cluster',
+        type=int,
+        default=1,
+        help='Widgets kept per near-duplicate cluster with --clusters (default: 1, the representative)',
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Reuse unchanged widgets and serialized lines from the previous build of this set '
+             '(datasets/{set}/build_cache.sqlite); use with --seed or --split hash',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed for shuffling and splitting (default: unseeded)',
+    )
+    parser.add_argument(
+        '--split',
+        choices=('random', 'hash'),
+        default='random',
+        help='How widgets are assigned to train/valid/test: random shuffle, or a salted hash of '
+             'OS_widget_id that keeps existing widgets in place when new ones are added (default: random)',
+    )
+    parser.add_argument(
+        '--split-salt',
+        default='',
+        help='Salt for --split hash; change it to draw a different split (default: empty)',
+    )
+    parser.add_argument(
+        '--stratify',
+        action='store_true',
+        help='With --split hash, place new widgets into the split their AI_category is short of '
+             '(80/10/10), keep earlier placements (datasets/{set}/split_assignments.json) '
+             'and print the realized split per category',
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='With --split hash, stream widgets from the CSV to the split files with bounded memory '
+             '(splits keep CSV order)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f'Batch size used for the padding report in bucket_stats.json (default: {DEFAULT_BATCH_SIZE})',
     )
     
     args = parser.parse_args()
     
-    create_dataset_from_csv(
-        args.csv,
-        args.set,
-        args.strategy,
-        system_prompt_name=args.system_prompt,
-    )
+    bucket_boundaries = None
+    if args.buckets == 'default':
+        bucket_boundaries = list(DEFAULT_BUCKET_BOUNDARIES)
+    elif args.buckets:
+        bucket_boundaries = [int(b) for b in args.buckets.split(',')]
+    
+    try:
+        create_dataset_from_csv(
+            args.csv,
+            args.set,
+            args.strategy,
+            system_prompt_name=args.system_prompt.split(',') if ',' in args.system_prompt else args.system_prompt,
+            corpus=None if args.packed else open_corpus(args.downloads, args.index, from_zips=args.from_zips),
+            jobs=args.jobs,
+            pack=PackedCorpus(args.packed) if args.packed else None,
+            pack_sequences=args.pack,
+            max_tokens=args.max_tokens or args.max_seq_len or DEFAULT_MAX_SEQUENCE_LENGTH,
+            token_counter=open_token_counter(args.tokenizer, args.token_cache) if args.pack or bucket_boundaries else None,
+            bucket_boundaries=bucket_boundaries,
+            bucket_shards=args.bucket_shards,
+            batch_size=args.batch_size,
+            compact=args.compact,
+            clusters_file=args.clusters,
+            max_per_cluster=args.max_per_cluster,
+            incremental=args.incremental,
+            seed=args.seed,
+            split=args.split,
+            split_salt=args.split_salt,
+            stratify=args.stratify,
+            stream=args.stream,
+            max_seq_len=args.max_seq_len,
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
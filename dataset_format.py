@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Chat-format training records and the compact dataset format.
+
+create_dataset.py writes one JSON array per line: the system message (system
+prompt plus TOOL_DEFINITION), the user prompt and the assistant tool call
+with the JSON-stringified widget code. The system message is repeated on
+every line, which for the longer system prompts is kilobytes per example.
+
+The compact format stores each system message once, by id, in compact.json
+and writes one small record per line:
+
+    {"system": "systemPrompt_v6", "examples": [[user_prompt, widget_code], ...]}
+
+This module has no dependencies beyond the standard library, so it can be
+copied next to a notebook. It expands compact datasets back to the exact
+lines create_dataset.py writes, either as a stream or as files:
+
+    python dataset_format.py datasets/v1_compact
+    python dataset_format.py datasets/v1_compact --output /content/datasets/v1
+
+    from dataset_format import iter_compact_records
+    for messages in iter_compact_records('datasets/v1_compact', 'train'):
+        ...
+"""
+
+import argparse
+import json
+import os
+import sys
+
+COMPACT_FORMAT = 'compact-chat'
+COMPACT_VERSION = 1
+COMPACT_META_FILE = 'compact.json'
+COMPACT_SUFFIX = '.compact.jsonl'
+
+
+def build_example_turns(entry):
+    """User and assistant messages for one training example."""
+    # Generate a tool call ID
+#    tool_call_id = f"call_{uuid.uuid4().hex[:16]}"
+
+    # Create the arguments JSON object, then stringify it for the tool call
+    arguments_obj = {
+        'jsxContent': entry['code']
+    }
+    arguments_json = json.dumps(arguments_obj, ensure_ascii=False)
+
+    return [
+        {'role': 'user', 'content': entry['prompt']},
+        {
+            'role': 'assistant',
+            'content': '',
+            'tool_calls': [
+                {
+#                    'id': tool_call_id,
+                    'type': 'function',
+                    'function': {
+                        'name': 'WriteUbersichtWidgetToFileSystem',
+                        'arguments': arguments_json
+                    }
+                }
+            ]
+        }
+    ]
+
+
+def build_system_message(system_prompt, tools):
+    """System message carrying the system prompt and the tool definitions."""
+    return {
+        'role': 'system',
+        'content': system_prompt,
+        'tools': tools
+    }
+
+
+def build_conversation(system_message, entries):
+    """
+    One JSONL line: the system message followed by the turns of each entry.
+
+    A single entry gives the usual system/user/assistant example; a packed
+    sequence holds several examples as consecutive user/assistant turns that
+    share the system message.
+    """
+    messages = [system_message]
+    for entry in entries:
+        messages.extend(build_example_turns(entry))
+    return messages
+
+
+class ConversationWriter:
+    """
+    Serializes conversations to JSONL lines without re-encoding constant parts.
+
+    The system message (system prompt and tools) is serialized once as a line
+    prefix, and the user/assistant turns are split into constant fragments
+    around the prompt and the stringified jsxContent arguments. Per example
+    only those two values are encoded. Lines are byte-identical to
+    json.dumps(build_conversation(...), ensure_ascii=False).
+    """
+    PROMPT_SENTINEL = '@@USER_PROMPT@@'
+    CODE_SENTINEL = '@@WIDGET_CODE@@'
+
+    def __init__(self, system_message):
+        self.system_message = system_message
+        # '[' + system message, without the closing ']'
+        self.prefix = json.dumps([system_message], ensure_ascii=False)[:-1]
+
+        sentinel_entry = {'prompt': self.PROMPT_SENTINEL, 'code': self.CODE_SENTINEL}
+        turns = json.dumps(build_example_turns(sentinel_entry), ensure_ascii=False)[1:-1]
+        before_prompt, rest = turns.split(json.dumps(self.PROMPT_SENTINEL, ensure_ascii=False))
+        arguments = json.dumps(json.dumps({'jsxContent': self.CODE_SENTINEL}, ensure_ascii=False), ensure_ascii=False)
+        between, after_code = rest.split(arguments)
+        self.turn_fragments = (', ' + before_prompt, between, after_code)
+
+        # The constant fragments are validated once: a two-example line built
+        # from them must parse back to the conversation it stands for.
+        entries = [sentinel_entry, sentinel_entry]
+        if json.loads(self.line(entries)) != build_conversation(system_message, entries):
+            raise ValueError('Pre-serialized conversation fragments do not round-trip')
+
+    def encode_entry(self, entry):
+        """Encoded (prompt, arguments) values of one entry."""
+        arguments_json = '{"jsxContent": ' + json.dumps(entry['code'], ensure_ascii=False) + '}'
+        # json.dumps output has no raw control characters, so encoding it again
+        # as a string only has to escape backslashes and quotes
+        arguments_string = '"' + arguments_json.replace('\\', '\\\\').replace('"', '\\"') + '"'
+        return json.dumps(entry['prompt'], ensure_ascii=False), arguments_string
+
+    def line(self, entries, encoded=None):
+        """Serialized JSONL line (without newline) for a sequence of entries."""
+        if encoded is None:
+            encoded = [self.encode_entry(entry) for entry in entries]
+        before_prompt, between, after_code = self.turn_fragments
+        parts = [self.prefix]
+        for prompt_json, arguments_json in encoded:
+            parts.extend((before_prompt, prompt_json, between, arguments_json, after_code))
+        parts.append(']')
+        return ''.join(parts)
+
+    def validated_line(self, entries):
+        """
+        line() for `entries`, after validating each record in memory.
+
+        The constant fragments were validated when the writer was built, so
+        each record is validated by parsing its encoded prompt and arguments
+        strings back. Raises ValueError for a record that does not round-trip.
+        """
+        encoded = [self.encode_entry(entry) for entry in entries]
+        for entry, (prompt_json, arguments_string) in zip(entries, encoded):
+            if json.loads(prompt_json) != entry['prompt'] or \
+                    not json.loads(arguments_string).startswith('{"jsxContent": "'):
+                raise ValueError('record does not round-trip')
+        return self.line(entries, encoded)
+
+    def write(self, sequences, output_file):
+        """
+        Write sequences of entries to `output_file`, validating each record first.
+
+        A bad record stops the build before it is written, without the file
+        being reopened and re-read.
+        """
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for i, entries in enumerate(sequences, 1):
+                try:
+                    line = self.validated_line(entries)
+                except ValueError as e:
+                    print(f'Error in {output_file}, line {i}: {e}')
+                    sys.exit(1)
+                f.write(line + '\n')
+
+
+class CompactWriter:
+    """
+    Writes compact records that reference the system message by id.
+
+    Has the same write(sequences, output_file) interface as
+    ConversationWriter and remembers every file it wrote, so
+    write_compact_meta() can list them for the expander.
+    """
+
+    def __init__(self, system_id, system_message):
+        self.system_id = system_id
+        self.system_message = system_message
+        self.files = []
+
+    def write(self, sequences, output_file):
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for entries in sequences:
+                record = {'system': self.system_id, 'examples': [[e['prompt'], e['code']] for e in entries]}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.files.append(output_file)
+
+
+def compact_path(jsonl_file):
+    """Compact file name for a chat-format JSONL file (train.jsonl -> train.compact.jsonl)."""
+    return jsonl_file[:-len('.jsonl')] + COMPACT_SUFFIX if jsonl_file.endswith('.jsonl') else jsonl_file + COMPACT_SUFFIX
+
+
+def expanded_path(compact_file):
+    """Chat-format file name for a compact file (train.compact.jsonl -> train.jsonl)."""
+    return compact_file[:-len(COMPACT_SUFFIX)] + '.jsonl'
+
+
+def write_compact_meta(dataset_dir, writers):
+    """Write compact.json with each writer's system message and the files they wrote."""
+    meta = {
+        'format': COMPACT_FORMAT,
+        'version': COMPACT_VERSION,
+        'systems': {w.system_id: w.system_message for w in writers},
+        'files': [os.path.relpath(path, dataset_dir) for w in writers for path in w.files],
+    }
+    meta_file = os.path.join(dataset_dir, COMPACT_META_FILE)
+    with open(meta_file, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta_file
+
+
+def load_compact_meta(dataset_dir):
+    """Read and check compact.json of a compact dataset."""
+    meta_file = os.path.join(dataset_dir, COMPACT_META_FILE)
+    with open(meta_file, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != COMPACT_FORMAT or meta.get('version') != COMPACT_VERSION:
+        raise ValueError(f"Unsupported compact dataset {meta_file}: "
+                         f"{meta.get('format')} version {meta.get('version')}")
+    return meta
+
+
+def _split_file(dataset_dir, split):
+    """Compact file for a split name ('train') or a path relative to the dataset."""
+    name = split if split.endswith(COMPACT_SUFFIX) else split + COMPACT_SUFFIX
+    return os.path.join(dataset_dir, name)
+
+
+def iter_compact_entries(dataset_dir, split):
+    """Yield (system_id, entries) for each line of a compact split, streaming."""
+    with open(_split_file(dataset_dir, split), 'r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            yield record['system'], [{'prompt': p, 'code': c} for p, c in record['examples']]
+
+
+def iter_compact_lines(dataset_dir, split, meta=None):
+    """Yield the chat-format JSONL lines (without newline) create_dataset.py writes for a split."""
+    if meta is None:
+        meta = load_compact_meta(dataset_dir)
+    writers = {}
+    for system_id, entries in iter_compact_entries(dataset_dir, split):
+        if system_id not in writers:
+            writers[system_id] = ConversationWriter(meta['systems'][system_id])
+        yield writers[system_id].line(entries)
+
+
+def iter_compact_records(dataset_dir, split, meta=None):
+    """Yield the chat-format message lists of a split, one training record at a time."""
+    if meta is None:
+        meta = load_compact_meta(dataset_dir)
+    for system_id, entries in iter_compact_entries(dataset_dir, split):
+        yield build_conversation(meta['systems'][system_id], entries)
+
+
+def expand_compact_dataset(dataset_dir, output_dir=None):
+    """
+    Write the chat-format file for every compact file of a dataset.
+
+    Output goes next to the compact files unless `output_dir` is given.
+    Returns the list of files written.
+    """
+    meta = load_compact_meta(dataset_dir)
+    output_dir = output_dir or dataset_dir
+    written = []
+    for relpath in meta['files']:
+        output_file = os.path.join(output_dir, expanded_path(relpath))
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for line in iter_compact_lines(dataset_dir, relpath, meta):
+                f.write(line + '\n')
+        written.append(output_file)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Expand a compact dataset into chat-format JSONL files')
+    parser.add_argument('dataset', help='Compact dataset folder (contains compact.json)')
+    parser.add_argument('--output', default=None,
+                        help='Folder to write train.jsonl etc. to (default: the dataset folder)')
+    args = parser.parse_args()
+
+    for output_file in expand_compact_dataset(args.dataset, args.output):
+        print(f"Wrote {output_file}")
+
+
+if __name__ == '__main__':
+    main()
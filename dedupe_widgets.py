@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Find near-duplicate widgets (forks and near-copies) before building a dataset.
+
+Each JSX widget's concatenated code (the jsxContent create_dataset.py would
+train on) is split into token shingles and summarized by a MinHash
+signature. Locality-sensitive hashing over bands of the signature finds
+candidate pairs without comparing every pair of widgets; candidates whose
+estimated Jaccard similarity reaches the threshold are merged into clusters
+with union-find.
+
+Output (widget_clusters.json):
+    {
+      "threshold": 0.8, "num_perm": 128, "bands": 16, "rows": 8, "candidate_recall": 0.9468,
+      "shingle_size": 5,
+      "widgets": {"<OS_widget_id>": {"cluster": "<representative id>", "representative": true}},
+      "clusters": [{"representative": "<id>", "members": ["<id>", ...],
+                    "pairs": [["<id>", "<id>", 0.93], ...]}]
+    }
+
+Every clustered widget belongs to the cluster of its representative, the
+member listed first in the CSV. Widgets without near-duplicates are their own
+representative and are not listed under "clusters".
+
+Usage:
+    python dedupe_widgets.py --csv widget_processing_results.csv
+    python create_dataset.py --csv widget_processing_results.csv --set v1 --clusters widget_clusters.json
+"""
+
+import argparse
+import hashlib
+import json
+import re
+from collections import defaultdict
+
+from analyze_widget_sizes import load_jsx_widgets
+from widget_corpus import open_corpus, parallel_map
+
+DEFAULT_CLUSTERS_FILE = 'widget_clusters.json'
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 5
+
+# LSH band/row choice: a missed duplicate weighs 9x more than an extra candidate check
+LSH_FALSE_POSITIVE_WEIGHT = 0.1
+LSH_FALSE_NEGATIVE_WEIGHT = 0.9
+# Lowest acceptable chance that a pair at exactly the threshold becomes a candidate
+MIN_CANDIDATE_RECALL = 0.9
+
+TOKEN_REGEX = re.compile(r'\w+|[^\w\s]')
+
+
+def code_shingles(code, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """Set of `shingle_size`-token shingles of the code (the whole code if it is shorter)."""
+    tokens = TOKEN_REGEX.findall(code)
+    if len(tokens) <= shingle_size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+
+
+def minhash_signature(shingles, num_perm=DEFAULT_NUM_PERM):
+    """
+    MinHash signature of a shingle set as a tuple of `num_perm` integers.
+
+    Uses one-permutation hashing: each shingle is hashed once (BLAKE2b, 64
+    bits); the hash picks one of `num_perm` slots and the slot keeps the
+    smallest remaining hash bits seen. Empty slots (sets with few shingles)
+    are filled from the next non-empty slot with an offset, so two sets agree
+    in a slot with probability equal to their Jaccard similarity, as with
+    `num_perm` independent permutations but with one hash per shingle.
+    Deterministic across runs and processes.
+    """
+    empty = 1 << 64
+    signature = [empty] * num_perm
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+        slot, value = h % num_perm, h // num_perm
+        if value < signature[slot]:
+            signature[slot] = value
+    if empty in signature and len(set(signature)) > 1:
+        # Rotation densification: borrow from the nearest non-empty slot to the right
+        filled = list(signature)
+        for slot in range(num_perm):
+            distance = 0
+            while filled[(slot + distance) % num_perm] == empty:
+                distance += 1
+            signature[slot] = filled[(slot + distance) % num_perm] + distance * empty
+    return tuple(signature)
+
+
+def estimated_similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity: the fraction of signature positions that agree."""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+
+def candidate_probability(similarity, bands, rows):
+    """Probability that a pair with Jaccard `similarity` shares at least one band."""
+    return 1 - (1 - similarity ** rows) ** bands
+
+
+def _integrate(func, low, high, steps=200):
+    """Midpoint-rule integral of func over [low, high]."""
+    width = (high - low) / steps
+    return sum(func(low + (i + 0.5) * width) for i in range(steps)) * width
+
+
+def lsh_parameters(threshold, num_perm=DEFAULT_NUM_PERM):
+    """
+    (bands, rows) with bands * rows == num_perm for finding pairs at `threshold`.
+
+    Pairs with similarity s become candidates with probability
+    1 - (1 - s**rows)**bands, an S-curve around (1 / bands) ** (1 / rows).
+    Every candidate is checked against the MinHash estimate, so a false
+    positive only costs a comparison while a false negative loses a
+    duplicate: the choice minimizes the weighted areas under the curve below
+    the threshold (false positives) and above it (false negatives), among
+    the options whose recall at the threshold is at least
+    MIN_CANDIDATE_RECALL. For 0.8 and 128 permutations this is 16 bands of
+    8 rows (S-curve at ~0.71, recall ~0.95 at 0.8).
+    """
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+
+    def weighted_error(br):
+        bands, rows = br
+        false_positives = _integrate(lambda s: candidate_probability(s, bands, rows), 0.0, threshold)
+        false_negatives = _integrate(lambda s: 1 - candidate_probability(s, bands, rows), threshold, 1.0)
+        return LSH_FALSE_POSITIVE_WEIGHT * false_positives + LSH_FALSE_NEGATIVE_WEIGHT * false_negatives
+
+    recalled = [br for br in options if candidate_probability(threshold, *br) >= MIN_CANDIDATE_RECALL]
+    return min(recalled or options, key=weighted_error)
+
+
+def candidate_pairs(signatures, bands, rows):
+    """Index pairs that share at least one identical band of their signatures."""
+    pairs = set()
+    for band in range(bands):
+        buckets = defaultdict(list)
+        for i, signature in enumerate(signatures):
+            buckets[signature[band * rows:(band + 1) * rows]].append(i)
+        for members in buckets.values():
+            for x in range(len(members)):
+                for y in range(x + 1, len(members)):
+                    pairs.add((members[x], members[y]))
+    return pairs
+
+
+def cluster_pairs(count, pairs):
+    """Union-find over `pairs`; returns the root index of each item (the smallest index in its cluster)."""
+    parent = list(range(count))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return [find(i) for i in range(count)]
+
+
+def widget_signature(context, widget):
+    """MinHash signature of one widget's code, or None if it has no readable JSX."""
+    corpus, num_perm, shingle_size = context
+    if not corpus.has_widget(widget['folder']):
+        return None
+    code = corpus.widget_code(widget['folder'])
+    if code is None:
+        return None
+    shingles = code_shingles(code, shingle_size)
+    return minhash_signature(shingles, num_perm) if shingles else None
+
+
+def find_near_duplicates(widgets, corpus, threshold=DEFAULT_THRESHOLD, num_perm=DEFAULT_NUM_PERM,
+                         shingle_size=DEFAULT_SHINGLE_SIZE, jobs=1):
+    """
+    Cluster `widgets` ([{'id', 'folder'}] in CSV order) by near-duplicate code.
+
+    Returns the widget_clusters.json structure described in the module docstring.
+    """
+    context = (corpus, num_perm, shingle_size)
+    signatures = parallel_map(widget_signature, widgets, jobs, context=context)
+    ids = []
+    kept = []
+    kept_ids = set()
+    for widget, signature in zip(widgets, signatures):
+        # The same widget can be listed twice; cluster each ID once
+        if signature is not None and widget['id'] not in kept_ids:
+            ids.append(widget['id'])
+            kept_ids.add(widget['id'])
+            kept.append(signature)
+    signatures = kept
+
+    bands, rows = lsh_parameters(threshold, num_perm)
+    matches = []
+    for a, b in sorted(candidate_pairs(signatures, bands, rows)):
+        similarity = estimated_similarity(signatures[a], signatures[b])
+        if similarity >= threshold:
+            matches.append((a, b, similarity))
+    roots = cluster_pairs(len(ids), [(a, b) for a, b, _ in matches])
+
+    members = defaultdict(list)
+    for i, root in enumerate(roots):
+        members[root].append(i)
+    pairs_by_root = defaultdict(list)
+    for a, b, similarity in matches:
+        pairs_by_root[roots[a]].append([ids[a], ids[b], round(similarity, 4)])
+
+    return {
+        'threshold': threshold,
+        'num_perm': num_perm,
+        'bands': bands,
+        'rows': rows,
+        'candidate_recall': round(candidate_probability(threshold, bands, rows), 4),
+        'shingle_size': shingle_size,
+        'widgets': {ids[i]: {'cluster': ids[root], 'representative': i == root} for i, root in enumerate(roots)},
+        'clusters': [
+            {'representative': ids[root], 'members': [ids[i] for i in indices], 'pairs': pairs_by_root[root]}
+            for root, indices in sorted(members.items()) if len(indices) > 1
+        ],
+    }
+
+
+def load_clusters(clusters_file=DEFAULT_CLUSTERS_FILE):
+    """Map of OS_widget_id -> cluster entry from widget_clusters.json."""
+    with open(clusters_file, 'r', encoding='utf-8') as f:
+        return json.load(f)['widgets']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cluster near-duplicate widgets with MinHash and LSH')
+    parser.add_argument('--csv', default='widget_processing_results.csv',
+                        help='Path to widget_processing_results.csv')
+    parser.add_argument('--downloads', default='downloads',
+                        help='Directory containing widget files')
+    parser.add_argument('--index', default=None,
+                        help='Read widget code through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                        help='Read widget code straight from downloads/*.zip instead of extracted folders')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Estimated Jaccard similarity at which widgets are near-duplicates (default: {DEFAULT_THRESHOLD})')
+    parser.add_argument('--num-perm', type=int, default=DEFAULT_NUM_PERM,
+                        help=f'MinHash signature length (default: {DEFAULT_NUM_PERM})')
+    parser.add_argument('--shingle-size', type=int, default=DEFAULT_SHINGLE_SIZE,
+                        help=f'Tokens per shingle (default: {DEFAULT_SHINGLE_SIZE})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of worker processes (default: 1)')
+    parser.add_argument('--output', default=DEFAULT_CLUSTERS_FILE,
+                        help=f'Where to write the clusters (default: {DEFAULT_CLUSTERS_FILE})')
+    args = parser.parse_args()
+
+    corpus = open_corpus(args.downloads, args.index, from_zips=args.from_zips)
+    widgets = load_jsx_widgets(args.csv)
+    print(f"Computing MinHash signatures for {len(widgets)} JSX widgets...")
+    result = find_near_duplicates(widgets, corpus, args.threshold, args.num_perm, args.shingle_size, args.jobs)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    duplicates = sum(len(c['members']) - 1 for c in result['clusters'])
+    print(f"LSH with {result['bands']} bands of {result['rows']} rows, threshold {args.threshold} "
+          f"(candidate recall at threshold: {result['candidate_recall']:.1%})")
+    if result['candidate_recall'] < MIN_CANDIDATE_RECALL:
+        print(f"Warning: fewer than {MIN_CANDIDATE_RECALL:.0%} of pairs at the threshold become candidates; "
+              f"increase --num-perm")
+    print(f"Found {len(result['clusters'])} clusters of near-duplicates ({duplicates} widgets beyond one per cluster)")
+    for cluster in sorted(result['clusters'], key=lambda c: -len(c['members']))[:10]:
+        print(f"  {cluster['representative']:<30} {len(cluster['members'])} widgets")
+    print(f"✓ Clusters saved to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
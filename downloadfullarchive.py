@@ -1,42 +1,912 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DOWNLOADS_DIR = 'downloads'
+DOWNLOAD_STATUS_FILE = 'download_status.json'
+DOWNLOAD_MANIFEST_FILE = 'download_manifest.json'
+# Per-widget results are appended here and folded into the two files above
+# every CHECKPOINT_COMPACT_EVERY widgets or CHECKPOINT_COMPACT_SECONDS
+DOWNLOAD_JOURNAL_FILE = 'download_checkpoint.journal'
+CHECKPOINT_COMPACT_EVERY = 200
+CHECKPOINT_COMPACT_SECONDS = 30
+
+# Every catalog archive is served from raw.githubusercontent.com, so the
+# per-host limit is what actually bounds concurrency for a full sync.
+DEFAULT_JOBS = 1
+DEFAULT_PER_HOST_LIMIT = 8
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+REQUEST_TIMEOUT = 60
+
+# Responses are copied to disk in fixed-size chunks so peak memory does not
+# depend on archive size. With --discard-zip the archive lives in a spooled
+# temp file that only spills to disk past SPOOL_MAX_BYTES.
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Selective extraction only materializes the files downstream scripts read,
+# and refuses archives whose selected members inflate past the cap.
+SOURCE_EXTENSIONS = ('.jsx', '.coffee')
+SKIPPED_DIRECTORIES = ('__MACOSX', 'node_modules')
+DEFAULT_MAX_EXTRACT_BYTES = 50 * 1024 * 1024
+
+# Many catalog entries live in the same GitHub repository (most notably
+# felixhageloh/uebersicht-widgets). Batched mode fetches one tarball per
+# repository and slices each widget's ZIP out of it.
+GITHUB_RAW_HOST = 'raw.githubusercontent.com'
+REPO_TARBALL_URL = 'https://codeload.github.com/{user}/{repo}/tar.gz/{branch}'
+MIN_REPO_BATCH_SIZE = 2
+
+
+class HostLimiter:
+    """Bound the number of in-flight requests per host across worker threads."""
+
+    def __init__(self, per_host_limit):
+        self.per_host_limit = per_host_limit
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        """Return the semaphore guarding the host of the given URL."""
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._semaphores[host]
+
+
+def create_session(pool_size=DEFAULT_PER_HOST_LIMIT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """Create a requests session with pooled connections and retry with backoff."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def archive_filename(widget):
+    """Return the local ZIP filename for a widget's downloadUrl."""
+    parsed_url = urlparse(widget['downloadUrl'])
+    filename = os.path.basename(parsed_url.path)
+    if not filename.endswith('.zip'):
+        filename = f"{widget['id']}.zip"
+    return filename
+
+
+def extract_archive(archive, extract_path, sources_only=False, max_bytes=None):
+    """
+    Extract a widget ZIP (path or seekable file object) and drop the __MACOSX metadata folder.
+
+    With `sources_only`, only widget source files are written (see
+    extract_source_members). `max_bytes` caps the total uncompressed size.
+    """
+    with zipfile.ZipFile(archive, 'r') as zip_ref:
+        if sources_only:
+            extract_source_members(zip_ref, extract_path, max_bytes=max_bytes)
+            return
+        if max_bytes is not None:
+            total = sum(info.file_size for info in zip_ref.infolist())
+            if total > max_bytes:
+                raise ValueError(f"Archive expands to {total} bytes (limit {max_bytes})")
+        zip_ref.extractall(extract_path)
+
+    # Remove __MACOSX folders immediately after extraction
+    macosx_path = os.path.join(extract_path, '__MACOSX')
+    if os.path.exists(macosx_path):
+        shutil.rmtree(macosx_path)
+        print(f"Removed __MACOSX folder from: {os.path.basename(extract_path)}")
+
+
+def is_source_member(info, extensions=SOURCE_EXTENSIONS):
+    """Return True for ZIP members that downstream scripts actually read."""
+    if info.is_dir():
+        return False
+    parts = info.filename.split('/')
+    if any(part in SKIPPED_DIRECTORIES for part in parts):
+        return False
+    # AppleDouble resource forks (._index.jsx) are metadata, not source
+    if parts[-1].startswith('._'):
+        return False
+    return parts[-1].lower().endswith(extensions)
+
+
+def extract_source_members(zip_ref, extract_path, extensions=SOURCE_EXTENSIONS, max_bytes=DEFAULT_MAX_EXTRACT_BYTES):
+    """
+    Extract only widget source files from an open ZipFile.
+
+    __MACOSX, node_modules, screenshots, fonts and other non-source members
+    are never written. The declared size of the selected members is checked
+    against `max_bytes` up front and the bytes actually inflated are counted
+    while copying, so a member that lies about its size cannot exceed it.
+    Returns the number of files written.
+    """
+    members = [info for info in zip_ref.infolist() if is_source_member(info, extensions)]
+    if max_bytes is not None:
+        declared = sum(info.file_size for info in members)
+        if declared > max_bytes:
+            raise ValueError(f"Source files expand to {declared} bytes (limit {max_bytes})")
+
+    root = os.path.realpath(extract_path)
+    os.makedirs(root, exist_ok=True)
+    written = 0
+    for info in members:
+        parts = [part for part in info.filename.split('/') if part not in ('', '.')]
+        target = os.path.realpath(os.path.join(root, *parts))
+        if '..' in parts or not target.startswith(root + os.sep):
+            print(f"Skipping unsafe archive member: {info.filename}")
+            continue
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with zip_ref.open(info) as src, open(target, 'wb') as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                written += len(chunk)
+                if max_bytes is not None and written > max_bytes:
+                    raise ValueError(f"Source files expand past the {max_bytes} byte limit")
+                dst.write(chunk)
+    return len(members)
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """Write JSON to `path` via a temp file and os.replace so readers never see a torn file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, **dump_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_json_dict(path):
+    """Load a JSON object from `path`, or return {} if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not load {path}: {e}")
+        return {}
+
+
+def load_manifest(manifest_file=DOWNLOAD_MANIFEST_FILE):
+    """
+    Load the incremental sync manifest.
+
+    Maps widget id to the modifiedAt, ETag, Last-Modified and sha256 of the
+    archive that is currently extracted under downloads/.
+    """
+    return load_json_dict(manifest_file)
+
+
+def save_manifest(manifest, manifest_file=DOWNLOAD_MANIFEST_FILE):
+    """Write the incremental sync manifest."""
+    write_json_atomic(manifest_file, manifest, indent=2, sort_keys=True)
+
+
+class SyncCheckpoint:
+    """
+    Record per-widget results as they finish.
+
+    Each result is appended as one JSON line to a journal, which costs the
+    same however many widgets are done. Every CHECKPOINT_COMPACT_EVERY
+    results or CHECKPOINT_COMPACT_SECONDS, and at the end of a sync,
+    download_status.json and download_manifest.json are rewritten atomically
+    and the journal is emptied. After an interrupted sync, replay_journal()
+    recovers the results that had not been compacted yet.
+    """
+
+    def __init__(self, status=None, manifest=None,
+                 status_file=DOWNLOAD_STATUS_FILE, manifest_file=DOWNLOAD_MANIFEST_FILE,
+                 journal_file=DOWNLOAD_JOURNAL_FILE):
+        self.status = status if status is not None else {}
+        self.manifest = manifest if manifest is not None else {}
+        self.status_file = status_file
+        self.manifest_file = manifest_file
+        self.journal_file = journal_file
+        self._lock = threading.Lock()
+        self._journal = None
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def replay_journal(self, include_status=True):
+        """
+        Apply results left in the journal by an interrupted sync, then compact.
+
+        Manifest entries are always applied (they describe what is extracted
+        under downloads/); statuses only with `include_status`. A torn last
+        line is ignored. Returns the number of results replayed.
+        """
+        if not os.path.exists(self.journal_file):
+            return 0
+        replayed = 0
+        with open(self.journal_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if include_status:
+                    self.status[record['id']] = record['status']
+                if record.get('entry') is not None:
+                    self.manifest[record['id']] = record['entry']
+                replayed += 1
+        self.flush()
+        return replayed
+
+    def record(self, widget_id, success, entry):
+        """Store one widget's outcome in the journal, compacting now and then."""
+        with self._lock:
+            self.status[widget_id] = "success" if success else "failed"
+            if entry is not None:
+                self.manifest[widget_id] = entry
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a')
+            self._journal.write(json.dumps({'id': widget_id, 'status': self.status[widget_id], 'entry': entry}) + '\n')
+            self._journal.flush()
+            self._pending += 1
+            if (self._pending >= CHECKPOINT_COMPACT_EVERY
+                    or time.monotonic() - self._last_flush >= CHECKPOINT_COMPACT_SECONDS):
+                self._flush_locked()
+
+    def flush(self):
+        """Write the status and manifest files and empty the journal."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        write_json_atomic(self.status_file, self.status, indent=2)
+        save_manifest(self.manifest, self.manifest_file)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+
+def stream_to_file(response, fileobj, hasher=None, chunk_size=CHUNK_SIZE):
+    """Copy a streamed response body into an open binary file in chunks."""
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if chunk:
+            fileobj.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+
+
+def conditional_headers(entry):
+    """Build If-None-Match / If-Modified-Since headers from a manifest entry."""
+    headers = {}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def widget_paths(widget, downloads_dir=DOWNLOADS_DIR):
+    """Return (filename, folder_name, extract_path) for a widget under downloads/."""
+    filename = archive_filename(widget)
+    # Create folder name (remove .zip extension)
+    folder_name = filename[:-4] if filename.endswith('.zip') else filename
+    return filename, folder_name, os.path.join(downloads_dir, folder_name)
+
+
+def is_unchanged(widget, previous, extract_path):
+    """True when the manifest entry says the extracted widget matches the catalog's modifiedAt."""
+    return (
+        previous is not None
+        and previous.get('modifiedAt') == widget.get('modifiedAt')
+        and os.path.isdir(extract_path)
+    )
+
+
+def install_archive(archive, entry, extract_path, previous=None, incremental=False,
+                    sources_only=False, max_extract_bytes=None):
+    """
+    Extract a fetched archive for one widget. Returns True on success.
+
+    With `incremental`, extraction is skipped when the archive hash matches
+    the previous manifest entry, and a changed widget is re-extracted into a
+    clean folder so files removed upstream do not linger.
+    """
+    folder_name = os.path.basename(extract_path)
+    if incremental and previous is not None and previous.get('sha256') == entry['sha256'] \
+            and os.path.isdir(extract_path):
+        print(f"Content unchanged, skipping extraction: {folder_name}")
+        return True
+
+    # Unzip the file immediately after download
+    try:
+        if incremental and previous is not None and os.path.isdir(extract_path):
+            shutil.rmtree(extract_path)
+        extract_archive(archive, extract_path, sources_only=sources_only, max_bytes=max_extract_bytes)
+        print(f"Extracted: {folder_name}")
+        return True
+    except Exception as e:
+        print(f"Failed to extract {entry['filename']}: {e}")
+        return False
+
+
+def part_validator_path(partial_path):
+    """Where the validators of a `.part` file's response are kept (`<file>.part.json`)."""
+    return partial_path + '.json'
+
+
+def save_part_validators(partial_path, response_headers):
+    """Remember the ETag and Last-Modified of the response a `.part` file is being filled from."""
+    write_json_atomic(part_validator_path(partial_path), {
+        'etag': response_headers.get('ETag'),
+        'last_modified': response_headers.get('Last-Modified'),
+    })
+
+
+def load_part_validator(partial_path):
+    """
+    If-Range value for resuming a `.part` file, or None if it cannot be resumed safely.
+
+    Uses the strong ETag, else the Last-Modified date, recorded when the
+    transfer started; weak ETags are not allowed in If-Range.
+    """
+    validators = load_json_dict(part_validator_path(partial_path))
+    etag = validators.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return validators.get('last_modified')
+
+
+def remove_partial(partial_path):
+    """Delete a `.part` file and its validators."""
+    for path in (partial_path, part_validator_path(partial_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def download_widget(session, widget, downloads_dir=DOWNLOADS_DIR, limiter=None, keep_zip=True,
+                    previous=None, incremental=False, resume=False, sources_only=False,
+                    max_extract_bytes=None):
+    """
+    Download and extract a single widget archive.
+
+    The response is streamed to `downloads/<name>.zip` (via a `.part` file that
+    is renamed once complete) or, when `keep_zip` is False, to a spooled temp
+    file that is discarded after extraction.
+
+    `previous` is the widget's manifest entry from the last sync. With
+    `incremental`, the widget is skipped if its modifiedAt is unchanged,
+    otherwise it is fetched with conditional headers and only re-extracted if
+    the archive content hash differs.
+
+    With `resume`, a leftover `.part` file from an interrupted run is
+    continued with an HTTP Range request instead of being downloaded again.
+    The Range is guarded by If-Range on the validators saved next to the
+    `.part` file when its transfer started; without them the download
+    restarts from byte 0.
+
+    `sources_only` and `max_extract_bytes` are passed to extract_archive.
+
+    Returns (success, manifest_entry); manifest_entry is None on failure.
+    """
+    download_url = widget['downloadUrl']
+    widget_id = widget['id']
+
+    filename, folder_name, extract_path = widget_paths(widget, downloads_dir)
+    file_path = os.path.join(downloads_dir, filename)
+    partial_path = file_path + '.part'
+
+    headers = {}
+    if incremental and previous is not None and os.path.isdir(extract_path):
+        if is_unchanged(widget, previous, extract_path):
+            print(f"Unchanged: {widget_id}")
+            return True, previous
+        headers = conditional_headers(previous)
+
+    resume_from = 0
+    if resume and keep_zip and os.path.exists(partial_path):
+        validator = load_part_validator(partial_path)
+        if validator and os.path.getsize(partial_path):
+            resume_from = os.path.getsize(partial_path)
+            headers = dict(headers, Range=f'bytes={resume_from}-')
+            headers['If-Range'] = validator
+        else:
+            # No record of which version the partial file holds; start over
+            remove_partial(partial_path)
+
+    hasher = hashlib.sha256()
+    archive = None
+    try:
+        # Download the ZIP file
+        try:
+            if limiter is not None:
+                with limiter.for_url(download_url):
+                    archive, response_headers = _fetch_archive(
+                        session, download_url, partial_path, keep_zip, headers, hasher, resume_from
+                    )
+            else:
+                archive, response_headers = _fetch_archive(
+                    session, download_url, partial_path, keep_zip, headers, hasher, resume_from
+                )
+        except Exception as e:
+            print(f"Failed to download {widget_id}: {e}")
+            return False, None
+
+        entry = {
+            'modifiedAt': widget.get('modifiedAt'),
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'sha256': None,
+            'filename': filename,
+            'folder': folder_name,
+        }
+
+        if archive is None:
+            # 304 Not Modified: keep the existing extraction and hash
+            remove_partial(partial_path)
+            entry['etag'] = entry['etag'] or previous.get('etag')
+            entry['last_modified'] = entry['last_modified'] or previous.get('last_modified')
+            entry['sha256'] = previous.get('sha256')
+            print(f"Not modified: {widget_id}")
+            return True, entry
+
+        entry['sha256'] = hasher.hexdigest()
+        if keep_zip:
+            try:
+                os.replace(partial_path, file_path)
+            except OSError as e:
+                print(f"Failed to save {widget_id}: {e}")
+                remove_partial(partial_path)
+                return False, None
+            remove_partial(partial_path)
+            archive = file_path
+        print(f"Downloaded: {filename}")
+
+        if install_archive(archive, entry, extract_path, previous, incremental,
+                           sources_only=sources_only, max_extract_bytes=max_extract_bytes):
+            return True, entry
+        if resume_from and keep_zip:
+            # A resumed transfer may have stitched two different versions
+            # together; drop it so the next run starts from scratch.
+            os.remove(file_path)
+        return False, None
+    finally:
+        if archive is not None and not isinstance(archive, str):
+            archive.close()
+
+
+def _fetch_archive(session, download_url, partial_path, keep_zip, headers, hasher, resume_from=0):
+    """
+    Stream one archive to `partial_path`, or to a spooled temp file when not keeping ZIPs.
+
+    When `resume_from` is non-zero and the server answers 206, the body is
+    appended to the existing partial file; any other 2xx restarts it.
+
+    Returns (archive, response_headers); archive is None for a 304 response.
+    """
+    response = session.get(download_url, timeout=REQUEST_TIMEOUT, stream=True, headers=headers)
+    try:
+        if response.status_code == 304:
+            return None, response.headers
+        if response.status_code == 416 and resume_from:
+            # Partial file is not a prefix of the current archive; start over
+            remove_partial(partial_path)
+            headers = {k: v for k, v in headers.items() if k not in ('Range', 'If-Range')}
+            response.close()
+            return _fetch_archive(session, download_url, partial_path, keep_zip, headers, hasher)
+        response.raise_for_status()
+        if keep_zip:
+            if resume_from and response.status_code == 206:
+                with open(partial_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                        hasher.update(chunk)
+                mode = 'ab'
+                print(f"Resuming {os.path.basename(partial_path)} at {resume_from} bytes")
+            else:
+                mode = 'wb'
+                # Record which version this file holds, for If-Range on resume
+                save_part_validators(partial_path, response.headers)
+            with open(partial_path, mode) as f:
+                stream_to_file(response, f, hasher)
+            return partial_path, response.headers
+
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        try:
+            stream_to_file(response, spool, hasher)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        return spool, response.headers
+    finally:
+        response.close()
+
+
+def repo_location(widget):
+    """
+    Split a raw.githubusercontent.com downloadUrl into its repository and path.
+
+    Returns ((user, repo, branch), member_path), or None for URLs that are not
+    served from a GitHub repository.
+    """
+    parsed_url = urlparse(widget['downloadUrl'])
+    if parsed_url.netloc != GITHUB_RAW_HOST:
+        return None
+    parts = parsed_url.path.strip('/').split('/')
+    if len(parts) < 4:
+        return None
+    user, repo, branch = parts[:3]
+    member_path = posixpath.normpath('/'.join(parts[3:]))
+    if member_path.startswith('..'):
+        return None
+    return (user, repo, branch), member_path
+
+
+def group_by_repo(widgets, min_size=MIN_REPO_BATCH_SIZE):
+    """
+    Group widgets that share a GitHub repository.
+
+    Returns (groups, remaining): groups maps (user, repo, branch) to a list of
+    (widget, member_path) for repositories with at least `min_size` widgets;
+    every other widget is returned in `remaining` for per-widget download.
+    """
+    by_repo = {}
+    remaining = []
+    for widget in widgets:
+        location = repo_location(widget)
+        if location is None:
+            remaining.append(widget)
+            continue
+        key, member_path = location
+        by_repo.setdefault(key, []).append((widget, member_path))
+
+    groups = {}
+    for key, members in by_repo.items():
+        if len(members) >= min_size:
+            groups[key] = members
+        else:
+            remaining.extend(widget for widget, _ in members)
+    # Keep per-widget downloads in catalog order
+    order = {widget['id']: index for index, widget in enumerate(widgets)}
+    remaining.sort(key=lambda widget: order[widget['id']])
+    return groups, remaining
+
+
+class RepoArchive:
+    """
+    Read files out of one repository snapshot.
+
+    `source` is either a directory holding a checkout of the repository or a
+    tarball as served by codeload.github.com (a single top-level
+    `<repo>-<branch>/` directory is stripped from member names).
+    """
+
+    def __init__(self, source):
+        self.source = source
+
+    def iter_members(self, member_paths):
+        """
+        Yield (member_path, file) for each of `member_paths` found in the snapshot.
+
+        Tarballs are read in a single streaming pass ('r|*') and members are
+        yielded in archive order, so a compressed tarball is decompressed
+        once however many widgets it holds. Each file is a seekable spool
+        that is closed when the next member is requested. Directory
+        snapshots yield in the order given. Paths not found are not yielded.
+        """
+        wanted = set(member_paths)
+        if os.path.isdir(self.source):
+            for member_path in dict.fromkeys(member_paths):
+                path = os.path.join(self.source, *member_path.split('/'))
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        yield member_path, f
+            return
+
+        with tarfile.open(self.source, 'r|*') as tar:
+            for info in tar:
+                if not wanted:
+                    break
+                if not info.isfile():
+                    continue
+                name = info.name.split('/', 1)[1] if '/' in info.name else info.name
+                if name not in wanted:
+                    continue
+                wanted.discard(name)
+                spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+                try:
+                    with tar.extractfile(info) as src:
+                        shutil.copyfileobj(src, spool, CHUNK_SIZE)
+                    spool.seek(0)
+                    yield name, spool
+                finally:
+                    spool.close()
+
+
+def local_repo_archive(archives_dir, user, repo, branch):
+    """Find a local stand-in for a repository: `<dir>/<user>/<repo>/` or `<dir>/<user>-<repo>[-<branch>].tar[.gz]`."""
+    if not archives_dir:
+        return None
+    candidates = [
+        os.path.join(archives_dir, user, repo),
+        os.path.join(archives_dir, f'{user}-{repo}-{branch}.tar.gz'),
+        os.path.join(archives_dir, f'{user}-{repo}-{branch}.tar'),
+        os.path.join(archives_dir, f'{user}-{repo}.tar.gz'),
+        os.path.join(archives_dir, f'{user}-{repo}.tar'),
+    ]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def fetch_repo_tarball(session, user, repo, branch):
+    """Stream a repository tarball from GitHub into a temp file and return its path."""
+    url = REPO_TARBALL_URL.format(user=user, repo=repo, branch=branch)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'{user}-{repo}-', suffix='.tar.gz')
+    try:
+        response = session.get(url, timeout=REQUEST_TIMEOUT, stream=True)
+        try:
+            response.raise_for_status()
+            with os.fdopen(fd, 'wb') as f:
+                stream_to_file(response, f)
+        finally:
+            response.close()
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
+
+
+def sync_repo_group(session, key, members, checkpoint, downloads_dir=DOWNLOADS_DIR, keep_zip=True,
+                    incremental=False, sources_only=False, max_extract_bytes=None, archives_dir=None):
+    """
+    Sync every widget of one repository from a single repository snapshot.
+
+    Widgets are sliced out of a local stand-in (see local_repo_archive) or a
+    tarball fetched once from GitHub, then extracted exactly like a
+    per-widget download. Returns the widgets that could not be served from
+    the snapshot so the caller can fall back to their downloadUrl.
+    """
+    user, repo, branch = key
+    manifest = checkpoint.manifest
+
+    todo = []
+    for widget, member_path in members:
+        previous = manifest.get(widget['id'])
+        if incremental and is_unchanged(widget, previous, widget_paths(widget, downloads_dir)[2]):
+            print(f"Unchanged: {widget['id']}")
+            checkpoint.record(widget['id'], True, previous)
+        else:
+            todo.append((widget, member_path))
+    if not todo:
+        return []
+
+    source = local_repo_archive(archives_dir, user, repo, branch)
+    downloaded = None
+    try:
+        if source is None:
+            downloaded = source = fetch_repo_tarball(session, user, repo, branch)
+            print(f"Downloaded repository archive: {user}/{repo} ({len(todo)} widgets)")
+        else:
+            print(f"Using local repository archive: {source} ({len(todo)} widgets)")
+        repo_archive = RepoArchive(source)
+        if not os.path.isdir(source) and not tarfile.is_tarfile(source):
+            raise tarfile.ReadError(f'{source} is not a tar archive')
+    except Exception as e:
+        print(f"Failed to fetch repository archive {user}/{repo}: {e}")
+        if downloaded is not None:
+            os.remove(downloaded)
+        return [widget for widget, _ in todo]
+
+    widgets_by_member = {}
+    for widget, member_path in todo:
+        widgets_by_member.setdefault(member_path, []).append(widget)
+    served = set()
+    try:
+        for member_path, archive in repo_archive.iter_members(widgets_by_member):
+            for widget in widgets_by_member[member_path]:
+                archive.seek(0)
+                filename, folder_name, extract_path = widget_paths(widget, downloads_dir)
+                hasher = hashlib.sha256()
+                for chunk in iter(lambda: archive.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                archive.seek(0)
+                if keep_zip:
+                    file_path = os.path.join(downloads_dir, filename)
+                    partial_path = file_path + '.part'
+                    try:
+                        with open(partial_path, 'wb') as f:
+                            shutil.copyfileobj(archive, f, CHUNK_SIZE)
+                        os.replace(partial_path, file_path)
+                    except OSError as e:
+                        print(f"Failed to save {widget['id']}: {e}")
+                        if os.path.exists(partial_path):
+                            os.remove(partial_path)
+                        checkpoint.record(widget['id'], False, None)
+                        served.add(widget['id'])
+                        continue
+                    archive.seek(0)
+
+                entry = {
+                    'modifiedAt': widget.get('modifiedAt'),
+                    'etag': None,
+                    'last_modified': None,
+                    'sha256': hasher.hexdigest(),
+                    'filename': filename,
+                    'folder': folder_name,
+                }
+                success = install_archive(archive, entry, extract_path, manifest.get(widget['id']),
+                                          incremental, sources_only=sources_only,
+                                          max_extract_bytes=max_extract_bytes)
+                checkpoint.record(widget['id'], success, entry if success else None)
+                # Only widgets with a recorded result are left out of the per-widget fallback
+                served.add(widget['id'])
+    except (tarfile.TarError, OSError) as e:
+        print(f"Failed to read repository archive {user}/{repo}: {e}")
+    finally:
+        if downloaded is not None:
+            os.remove(downloaded)
+    fallback = [widget for widget, _ in todo if widget['id'] not in served]
+
+    if fallback:
+        print(f"{len(fallback)} widgets not found in {user}/{repo} archive, downloading individually")
+    return fallback
+
+
+def download_widgets(widgets, downloads_dir=DOWNLOADS_DIR, jobs=DEFAULT_JOBS,
+                     per_host_limit=DEFAULT_PER_HOST_LIMIT, retries=DEFAULT_RETRIES,
+                     backoff=DEFAULT_BACKOFF, keep_zip=True, checkpoint=None, incremental=False,
+                     resume=False, sources_only=False, max_extract_bytes=None, batch_repos=False,
+                     repo_archives_dir=None):
+    """
+    Download widgets, optionally across a thread pool sharing one pooled session.
+
+    Each result is recorded in `checkpoint` (a SyncCheckpoint) as soon as the
+    widget finishes. With `incremental`, widgets are first checked against
+    their previous manifest entries. With `resume`, widgets already marked
+    successful in the checkpoint are skipped and partial transfers continue.
+    `sources_only` and `max_extract_bytes` control extraction. With
+    `batch_repos`, widgets that share a GitHub repository are served from one
+    repository snapshot (see sync_repo_group) instead of one request each.
+
+    Returns the status dict for `widgets`, keyed by widget id in the same
+    order as `widgets`, regardless of the order in which downloads complete.
+    """
+    if checkpoint is None:
+        checkpoint = SyncCheckpoint()
+    manifest = checkpoint.manifest
+
+    pending = []
+    for widget in widgets:
+        if resume and checkpoint.status.get(widget['id']) == "success":
+            folder_name = archive_filename(widget)[:-4]
+            if os.path.isdir(os.path.join(downloads_dir, folder_name)):
+                continue
+        pending.append(widget)
+    if resume:
+        print(f"Resuming: {len(widgets) - len(pending)} widgets already complete, {len(pending)} to go")
+
+    session = create_session(pool_size=max(jobs, per_host_limit), retries=retries, backoff=backoff)
+    limiter = HostLimiter(per_host_limit)
+
+    def run(widget):
+        success, entry = download_widget(session, widget, downloads_dir, limiter, keep_zip=keep_zip,
+                                         previous=manifest.get(widget['id']), incremental=incremental,
+                                         resume=resume, sources_only=sources_only,
+                                         max_extract_bytes=max_extract_bytes)
+        checkpoint.record(widget['id'], success, entry)
+
+    try:
+        if batch_repos:
+            groups, pending = group_by_repo(pending)
+            for key, members in groups.items():
+                pending.extend(sync_repo_group(
+                    session, key, members, checkpoint, downloads_dir, keep_zip=keep_zip,
+                    incremental=incremental, sources_only=sources_only,
+                    max_extract_bytes=max_extract_bytes, archives_dir=repo_archives_dir,
+                ))
+
+        if jobs <= 1:
+            for widget in pending:
+                run(widget)
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(run, pending))
+    finally:
+        session.close()
+
+    # Workers finish in any order; rewrite the status file in widget_list order
+    download_status = {widget['id']: checkpoint.status[widget['id']] for widget in widgets}
+    checkpoint.status = {**download_status, **checkpoint.status}
+    checkpoint.flush()
+    return download_status
+
+
 def main():
     """Main entry point for the download full archive script."""
-    import json
-    import os
-    import requests
-    import zipfile
     import argparse
-    import sys
-    from urllib.parse import urlparse
-    
+
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Download and extract widget archives')
     parser.add_argument('--widgets', type=str, help='Comma-separated list of widget IDs to download')
     parser.add_argument('--widget-file', type=str, help='File containing widget IDs to download (one per line)')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help=f'Number of concurrent downloads (default: {DEFAULT_JOBS}, serial)')
+    parser.add_argument('--per-host-limit', type=int, default=DEFAULT_PER_HOST_LIMIT,
+                        help=f'Maximum concurrent requests per host (default: {DEFAULT_PER_HOST_LIMIT})')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help=f'Retries per download with exponential backoff (default: {DEFAULT_RETRIES})')
+    parser.add_argument('--discard-zip', action='store_true',
+                        help='Extract from a spooled temp file and do not keep downloads/*.zip')
+    parser.add_argument('--incremental', action='store_true',
+                        help=f'Skip widgets unchanged since the last sync (tracked in {DOWNLOAD_MANIFEST_FILE})')
+    parser.add_argument('--resume', action='store_true',
+                        help=f'Skip widgets already marked success in {DOWNLOAD_STATUS_FILE} and continue partial downloads')
+    parser.add_argument('--sources-only', action='store_true',
+                        help=f'Only extract widget source files ({", ".join(SOURCE_EXTENSIONS)}); '
+                             'skip __MACOSX, node_modules and assets')
+    parser.add_argument('--max-extract-bytes', type=int, default=None,
+                        help='Refuse archives whose extracted files exceed this many bytes '
+                             f'(default with --sources-only: {DEFAULT_MAX_EXTRACT_BYTES})')
+    parser.add_argument('--batch-repos', action='store_true',
+                        help='Fetch one archive per GitHub repository shared by several widgets '
+                             'and slice each widget out of it')
+    parser.add_argument('--repo-archives', type=str, default=None,
+                        help='Directory with local repository stand-ins (<user>/<repo>/ checkouts or '
+                             '<user>-<repo>[-<branch>].tar.gz) used by --batch-repos before downloading')
     args = parser.parse_args()
-    
+
+    if args.jobs < 1 or args.per_host_limit < 1:
+        print("ERROR: --jobs and --per-host-limit must be at least 1")
+        sys.exit(1)
+
     # Create downloads directory if it doesn't exist
-    downloads_dir = 'downloads'
+    downloads_dir = DOWNLOADS_DIR
     if not os.path.exists(downloads_dir):
         os.makedirs(downloads_dir)
-    
+
     # Read the widget list JSON file
     with open('widget_list.json', 'r') as f:
         data = json.load(f)
-    
+
     # Get all widgets
     all_widgets = data['widgets']
-    
-    # Initialize download status tracking
-    download_status = {}
-    
+
     # Validate and filter widgets if specified
     if args.widgets or args.widget_file:
         if args.widgets and args.widget_file:
             print("ERROR: Cannot specify both --widgets and --widget-file")
             sys.exit(1)
-        
+
         if args.widgets:
             specified_ids = [wid.strip() for wid in args.widgets.split(',')]
         else:  # args.widget_file
@@ -46,90 +916,66 @@ def main():
             except FileNotFoundError:
                 print(f"ERROR: Widget file not found: {args.widget_file}")
                 sys.exit(1)
-        
+
         available_ids = {widget['id'] for widget in all_widgets}
         invalid_ids = [wid for wid in specified_ids if wid not in available_ids]
-        
+
         if invalid_ids:
             print(f"ERROR: The following widget IDs were not found in widget_list.json:")
             for wid in invalid_ids:
                 print(f"  - {wid}")
             print(f"Available widget IDs: {len(available_ids)} total")
             sys.exit(1)
-        
+
         # Filter to only specified widgets
         widgets = [w for w in all_widgets if w['id'] in specified_ids]
         print(f"Filtering to {len(widgets)} specified widgets")
     else:
         widgets = all_widgets
         print(f"Processing all {len(widgets)} widgets from widget_list.json")
-    
-    for widget in widgets:
-        download_url = widget['downloadUrl']
-        widget_id = widget['id']
-        
-        # Extract filename from URL
-        parsed_url = urlparse(download_url)
-        filename = os.path.basename(parsed_url.path)
-        if not filename.endswith('.zip'):
-            filename = f"{widget_id}.zip"
-        
-        file_path = os.path.join(downloads_dir, filename)
-        
-        # Download the ZIP file
-        download_success = False
-        try:
-            response = requests.get(download_url)
-            response.raise_for_status()
-            
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            
-            print(f"Downloaded: {filename}")
-            
-            # Unzip the file immediately after download
-            try:
-                # Create folder name (remove .zip extension)
-                folder_name = filename[:-4] if filename.endswith('.zip') else filename
-                extract_path = os.path.join(downloads_dir, folder_name)
-
-                with zipfile.ZipFile(file_path, 'r') as zip_ref:
-                    zip_ref.extractall(extract_path)
-
-                # Remove __MACOSX folders immediately after extraction
-                import shutil
-                macosx_path = os.path.join(extract_path, '__MACOSX')
-                if os.path.exists(macosx_path):
-                    shutil.rmtree(macosx_path)
-                    print(f"Removed __MACOSX folder from: {folder_name}")
-
-                print(f"Extracted: {folder_name}")
-                download_success = True
-                
-            except Exception as e:
-                print(f"Failed to extract {filename}: {e}")
-                download_success = False
-            
-        except Exception as e:
-            print(f"Failed to download {widget_id}: {e}")
-            download_success = False
-        
-        # Record download status
-        download_status[widget_id] = "success" if download_success else "failed"
-    
-    # Save download status to JSON file
-    with open('download_status.json', 'w') as f:
-        json.dump(download_status, f, indent=2)
-    
+
+    if args.jobs > 1:
+        print(f"Downloading with {args.jobs} workers ({args.per_host_limit} per host)")
+
+    manifest = load_manifest()
+    if args.incremental:
+        print(f"Incremental sync: {len(manifest)} widgets in {DOWNLOAD_MANIFEST_FILE}")
+
+    # Status is checkpointed after every widget; --resume picks up where a
+    # previous (possibly interrupted) run left off
+    status = load_json_dict(DOWNLOAD_STATUS_FILE) if args.resume else {}
+    max_extract_bytes = args.max_extract_bytes
+    if max_extract_bytes is None and args.sources_only:
+        max_extract_bytes = DEFAULT_MAX_EXTRACT_BYTES
+    checkpoint = SyncCheckpoint(status=status, manifest=manifest)
+    replayed = checkpoint.replay_journal(include_status=args.resume)
+    if replayed:
+        print(f"Recovered {replayed} results from {DOWNLOAD_JOURNAL_FILE} of an interrupted sync")
+
+    download_status = download_widgets(
+        widgets,
+        downloads_dir,
+        jobs=args.jobs,
+        per_host_limit=args.per_host_limit,
+        retries=args.retries,
+        keep_zip=not args.discard_zip,
+        checkpoint=checkpoint,
+        incremental=args.incremental,
+        resume=args.resume,
+        sources_only=args.sources_only,
+        max_extract_bytes=max_extract_bytes,
+        batch_repos=args.batch_repos,
+        repo_archives_dir=args.repo_archives,
+    )
+
     # Print summary
     success_count = sum(1 for status in download_status.values() if status == "success")
     failed_count = sum(1 for status in download_status.values() if status == "failed")
-    
+
     print(f"Processed {len(widgets)} widgets")
     print(f"Successfully downloaded: {success_count}")
     print(f"Failed to download: {failed_count}")
-    print(f"Download status saved to: download_status.json")
+    print(f"Download status saved to: {DOWNLOAD_STATUS_FILE}")
 
 if __name__ == "__main__":
     main()
-
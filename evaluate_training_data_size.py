@@ -2,20 +2,30 @@
 """
 Evaluate complete training data size including system prompts, user prompts, and widget code.
 Accounts for the full JSON structure that will be generated by create_dataset.py.
-Generates actionable strategy recommendations (training_data_strategy.json) for create_dataset.py.
+Generates actionable strategy recommendations (training_data_strategy.json) for create_dataset.py,
+for --max-tokens and for each of the --seq-lens training lengths.
 """
 
+import hashlib
 import json
 import os
 import csv
-import glob
 import sys
 import uuid
 from pathlib import Path
 
-# Rough token estimation: ~4 chars per token for code/text
+from packed_corpus import PackedCorpus
+from token_counter import (DEFAULT_CACHE_FILE, DEFAULT_TOKENIZER, CachedTokenCounter, CharEstimateCounter,
+                           open_token_counter)
+from widget_corpus import DirectoryCorpus, open_corpus, parallel_map
+
+# Rough token estimation: ~4 chars per token for code/text (default; see --tokenizer)
 CHARS_PER_TOKEN = 4
 DEFAULT_MAX_SEQUENCE_LENGTH = 4095
+# max_sequence_length values the notebooks train with; a strategy is written for each
+DEFAULT_STRATEGY_LENGTHS = (256, 512, 1024, 2048, 4095)
+# Tool call arguments with empty widget code
+ARGUMENTS_WRAPPER = '{"jsxContent":""}'
 
 # Import shared configuration from training_config module
 from training_config import systemPrompt as SYSTEM_PROMPT, TOOL_DEFINITION
@@ -24,27 +34,11 @@ def estimate_tokens(text_length, chars_per_token=CHARS_PER_TOKEN):
     """Estimate token count from character length"""
     return int(text_length / chars_per_token)
 
-def get_widget_code(widget_folder, downloads_dir='downloads'):
+def get_widget_code(widget_folder, downloads_dir='downloads', corpus=None):
     """Read all JSX files for a widget and concatenate them"""
-    widget_path = os.path.join(downloads_dir, widget_folder)
-    
-    if not os.path.exists(widget_path):
-        return None
-    
-    jsx_files = glob.glob(os.path.join(widget_path, '**/*.jsx'), recursive=True)
-    
-    code_parts = []
-    for jsx_file in sorted(jsx_files):
-        try:
-            with open(jsx_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if content:
-                    relative_path = os.path.relpath(jsx_file, widget_path)
-                    code_parts.append(f"// {relative_path}\n{content}")
-        except Exception as e:
-            print(f"Warning: Could not read {jsx_file}: {e}", file=sys.stderr)
-    
-    return '\n\n'.join(code_parts) if code_parts else None
+    if corpus is None:
+        corpus = DirectoryCorpus(downloads_dir)
+    return corpus.widget_code(widget_folder)
 
 def get_user_prompt(widget_id, prompts_dir='prompts'):
     """Read user prompt from prompts folder"""
@@ -60,10 +54,19 @@ def get_user_prompt(widget_id, prompts_dir='prompts'):
         print(f"Warning: Could not read {prompt_file}: {e}", file=sys.stderr)
         return None
 
-def build_training_example_json(system_prompt, tool_definition, user_prompt, widget_code):
+def get_packed_user_prompt(pack, widget_id):
+    """Read a user prompt from a PackedCorpus (same results as get_user_prompt)"""
+    try:
+        return pack.prompt(widget_id)
+    except Exception as e:
+        print(f"Warning: Could not read prompt for {widget_id} from {pack.pack_file}: {e}", file=sys.stderr)
+        return None
+
+def build_training_example_json(system_prompt, tool_definition, user_prompt, widget_code, tool_call_id=None):
     """Build the complete JSON structure that matches create_dataset.py output"""
     # Generate a tool call ID (matching create_dataset.py format)
-    tool_call_id = f"call_{uuid.uuid4().hex[:16]}"
+    if tool_call_id is None:
+        tool_call_id = f"call_{uuid.uuid4().hex[:16]}"
     
     # Create the arguments JSON object, then stringify it for the tool call
     arguments_obj = {
@@ -98,12 +101,111 @@ def build_training_example_json(system_prompt, tool_definition, user_prompt, wid
     ]
     return json.dumps(json_entry, ensure_ascii=False)
 
-def analyze_complete_training_data(csv_file_path, downloads_dir='downloads', prompts_dir='prompts'):
+def load_training_example(context, widget):
+    """
+    Build one complete training example and return its texts for counting.
+    
+    `context` holds the corpus and prompts_dir (or a PackedCorpus as 'pack').
+    Returns None if the widget has no prompt or no readable code. Token
+    counting happens in the parent process so every example can be
+    tokenized in batches and looked up in one token count cache.
+    """
+    widget_id = widget['id']
+    widget_folder = widget['folder']
+    
+    # Get components
+    if context.get('pack') is not None:
+        user_prompt = get_packed_user_prompt(context['pack'], widget_id)
+    else:
+        user_prompt = get_user_prompt(widget_id, context['prompts_dir'])
+    widget_code = get_widget_code(widget_folder, corpus=context['corpus'])
+    
+    if user_prompt is None or widget_code is None:
+        return None
+    
+    # Build complete training example. The tool call ID is derived from the
+    # widget ID (same length as create_dataset.py's random one) so the text,
+    # and therefore its cached token count, is stable between runs.
+    tool_call_id = f"call_{hashlib.sha256(widget_id.encode('utf-8')).hexdigest()[:16]}"
+    complete_json = build_training_example_json(
+        SYSTEM_PROMPT, TOOL_DEFINITION, user_prompt, widget_code, tool_call_id
+    )
+    
+    # Widget code is JSON-stringified in the arguments field
+    arguments_obj = {'jsxContent': widget_code}
+    arguments_json = json.dumps(arguments_obj, ensure_ascii=False)
+    
+    return {
+        'widget_id': widget_id,
+        'widget_folder': widget_folder,
+        'user_prompt': user_prompt,
+        'widget_code': widget_code,
+        'arguments_json': arguments_json,
+        'complete_json': complete_json,
+    }
+
+def measure_training_examples(examples, token_counter, static_tokens):
+    """
+    Size loaded training examples with `token_counter`.
+    
+    All user prompts, widget code, arguments and complete examples are
+    counted in one batch, and the escaping overhead is derived from those
+    counts. `static_tokens` holds the counts shared by every example
+    (system prompt, tool definition, structure overhead).
+    """
+    texts = [ARGUMENTS_WRAPPER]
+    for example in examples:
+        texts.extend((example['user_prompt'], example['widget_code'], example['arguments_json'],
+                      example['complete_json']))
+    counts = iter(token_counter.count_batch(texts))
+    wrapper_tokens = next(counts)
+    
+    results = []
+    for example in examples:
+        user_prompt_tokens, widget_code_tokens = next(counts), next(counts)
+        arguments_tokens, estimated_tokens = next(counts), next(counts)
+        widget_code_chars = len(example['widget_code'])
+        # Escaping overhead = arguments JSON length - raw widget code length - wrapper overhead
+        # Wrapper is '{"jsxContent":""}' = 17 chars when empty
+        json_escaping_overhead = len(example['arguments_json']) - widget_code_chars - len(ARGUMENTS_WRAPPER)
+        
+        results.append({
+            'widget_id': example['widget_id'],
+            'widget_folder': example['widget_folder'],
+            'system_prompt_tokens': static_tokens['system_prompt'],
+            'tool_def_tokens': static_tokens['tool_def'],
+            'user_prompt_chars': len(example['user_prompt']),
+            'user_prompt_tokens': user_prompt_tokens,
+            'widget_code_chars': widget_code_chars,
+            'widget_code_tokens': widget_code_tokens,
+            'json_escaping_overhead_chars': json_escaping_overhead,
+            'json_escaping_overhead_tokens': token_counter.overhead_from_counts(
+                example['arguments_json'], [example['widget_code'], ARGUMENTS_WRAPPER],
+                arguments_tokens, [widget_code_tokens, wrapper_tokens]
+            ),
+            'structure_overhead_tokens': static_tokens['structure_overhead'],
+            'total_chars': len(example['complete_json']),
+            'estimated_total_tokens': estimated_tokens,
+            'exceeds_limit': estimated_tokens > DEFAULT_MAX_SEQUENCE_LENGTH
+        })
+    return results
+
+def analyze_complete_training_data(csv_file_path, downloads_dir='downloads', prompts_dir='prompts', corpus=None,
+                                   jobs=1, pack=None, token_counter=None):
     """
     Analyze complete training examples including all components.
     
+    Widget code is read from `corpus` (default: DirectoryCorpus over downloads_dir).
+    With `pack` (a PackedCorpus), prompts and widget code both come from the pack.
+    With jobs > 1 the examples are read in a process pool; results keep CSV order.
+    Tokens are counted with `token_counter` (default: chars / 4, see token_counter.py).
     Returns list of results with full size analysis.
     """
+    if pack is not None:
+        corpus = pack
+    elif corpus is None:
+        corpus = DirectoryCorpus(downloads_dir)
+
     # Load CSV
     widgets = []
     with open(csv_file_path, 'r', encoding='utf-8') as f:
@@ -117,6 +219,9 @@ def analyze_complete_training_data(csv_file_path, downloads_dir='downloads', pro
     
     print(f"Analyzing {len(widgets)} complete training examples...\n")
     
+    if token_counter is None:
+        token_counter = CharEstimateCounter(CHARS_PER_TOKEN)
+    
     # Calculate static component sizes
     system_prompt_chars = len(SYSTEM_PROMPT)
     tool_def_json = json.dumps(TOOL_DEFINITION, ensure_ascii=False)
@@ -124,71 +229,41 @@ def analyze_complete_training_data(csv_file_path, downloads_dir='downloads', pro
     
     # Build complete JSON to measure structure overhead
     # Note: We use placeholders, but widget code will be JSON-escaped in tool call arguments
+    placeholders = ["USER_PROMPT_PLACEHOLDER", "WIDGET_CODE_PLACEHOLDER"]
     empty_json = build_training_example_json(
-        SYSTEM_PROMPT, TOOL_DEFINITION, "USER_PROMPT_PLACEHOLDER", "WIDGET_CODE_PLACEHOLDER"
+        SYSTEM_PROMPT, TOOL_DEFINITION, *placeholders, tool_call_id=f"call_{'0' * 16}"
     )
     # Structure overhead includes: JSON keys, tool call structure, assistant message with content
     # Note: Widget code placeholder doesn't account for JSON escaping overhead, which will be
     # calculated separately when we process actual widget code
-    structure_overhead = len(empty_json) - len("USER_PROMPT_PLACEHOLDER") - len("WIDGET_CODE_PLACEHOLDER")
+    structure_overhead = len(empty_json) - sum(len(p) for p in placeholders)
+    static_tokens = {
+        'system_prompt': token_counter.count(SYSTEM_PROMPT),
+        'tool_def': token_counter.count(tool_def_json),
+        'structure_overhead': token_counter.count_overhead(empty_json, placeholders),
+    }
     
-    print(f"System prompt: {system_prompt_chars:,} chars (~{estimate_tokens(system_prompt_chars):,} tokens)")
-    print(f"Tool definition: {tool_def_chars:,} chars (~{estimate_tokens(tool_def_chars):,} tokens)")
-    print(f"JSON structure overhead: {structure_overhead:,} chars (~{estimate_tokens(structure_overhead):,} tokens)")
+    print(f"System prompt: {system_prompt_chars:,} chars (~{static_tokens['system_prompt']:,} tokens)")
+    print(f"Tool definition: {tool_def_chars:,} chars (~{static_tokens['tool_def']:,} tokens)")
+    print(f"JSON structure overhead: {structure_overhead:,} chars (~{static_tokens['structure_overhead']:,} tokens)")
     print()
     
-    # Analyze each training example
-    results = []
-    for widget in widgets:
-        widget_id = widget['id']
-        widget_folder = widget['folder']
-        
-        # Get components
-        user_prompt = get_user_prompt(widget_id, prompts_dir)
-        widget_code = get_widget_code(widget_folder, downloads_dir)
-        
-        if user_prompt is None or widget_code is None:
-            continue
-        
-        # Build complete training example
-        complete_json = build_training_example_json(
-            SYSTEM_PROMPT, TOOL_DEFINITION, user_prompt, widget_code
-        )
-        
-        # Calculate sizes
-        total_chars = len(complete_json)
-        estimated_tokens = estimate_tokens(total_chars)
-        
-        # Component breakdown
-        user_prompt_chars = len(user_prompt)
-        widget_code_chars = len(widget_code)
-        
-        # Calculate JSON escaping overhead for widget code in tool call arguments
-        # Widget code is JSON-stringified in the arguments field
-        arguments_obj = {'jsxContent': widget_code}
-        arguments_json = json.dumps(arguments_obj, ensure_ascii=False)
-        arguments_json_length = len(arguments_json)
-        # Escaping overhead = arguments JSON length - raw widget code length - wrapper overhead
-        # Wrapper is '{"jsxContent":""}' = 17 chars when empty
-        wrapper_overhead = 17
-        json_escaping_overhead = arguments_json_length - widget_code_chars - wrapper_overhead
-        
-        results.append({
-            'widget_id': widget_id,
-            'widget_folder': widget_folder,
-            'system_prompt_tokens': estimate_tokens(system_prompt_chars),
-            'tool_def_tokens': estimate_tokens(tool_def_chars),
-            'user_prompt_chars': user_prompt_chars,
-            'user_prompt_tokens': estimate_tokens(user_prompt_chars),
-            'widget_code_chars': widget_code_chars,
-            'widget_code_tokens': estimate_tokens(widget_code_chars),
-            'json_escaping_overhead_chars': json_escaping_overhead,
-            'json_escaping_overhead_tokens': estimate_tokens(json_escaping_overhead),
-            'structure_overhead_tokens': estimate_tokens(structure_overhead),
-            'total_chars': total_chars,
-            'estimated_total_tokens': estimated_tokens,
-            'exceeds_limit': estimated_tokens > DEFAULT_MAX_SEQUENCE_LENGTH
-        })
+    # Read each training example, then count all of them in one batch
+    context = {
+        'corpus': corpus,
+        'prompts_dir': prompts_dir,
+        'pack': pack,
+    }
+    examples = [
+        example for example in parallel_map(load_training_example, widgets, jobs, context=context)
+        if example is not None
+    ]
+    results = measure_training_examples(examples, token_counter, static_tokens)
+    
+    if isinstance(token_counter, CachedTokenCounter):
+        token_counter.save()
+        print(f"Tokenizer {token_counter.name}: {token_counter.hits} counts from {token_counter.cache_file}, "
+              f"{token_counter.misses} texts tokenized\n")
     
     return results
 
@@ -240,7 +315,27 @@ def generate_strategy_recommendations(results, max_sequence_length=DEFAULT_MAX_S
     
     return strategy
 
-def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
+def strategy_summary(strategy):
+    """Keep/exclude counts of a strategy."""
+    return {
+        'keep': sum(1 for s in strategy.values() if s['action'] == 'keep'),
+        'exclude': sum(1 for s in strategy.values() if s['action'] == 'exclude')
+    }
+
+def generate_length_strategies(results, sequence_lengths):
+    """
+    Strategy recommendations for several max_sequence_length values from one set of results.
+    
+    Returns {str(length): {'strategy': ..., 'summary': ...}}, keyed by string
+    so it round-trips through JSON; create_dataset.py --max-seq-len picks one.
+    """
+    strategies = {}
+    for length in sorted(set(sequence_lengths)):
+        strategy = generate_strategy_recommendations(results, length)
+        strategies[str(length)] = {'strategy': strategy, 'summary': strategy_summary(strategy)}
+    return strategies
+
+def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH, sequence_lengths=DEFAULT_STRATEGY_LENGTHS):
     """Print detailed analysis and recommendations"""
     
     results.sort(key=lambda x: x['estimated_total_tokens'], reverse=True)
@@ -385,8 +480,12 @@ def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
     strategy = generate_strategy_recommendations(results, max_sequence_length)
     
     # Count actions
-    exclude_count = sum(1 for s in strategy.values() if s['action'] == 'exclude')
-    keep_count = sum(1 for s in strategy.values() if s['action'] == 'keep')
+    summary = strategy_summary(strategy)
+    exclude_count = summary['exclude']
+    keep_count = summary['keep']
+    
+    # Strategies for every sequence length the notebooks train with
+    strategies = generate_length_strategies(results, list(sequence_lengths) + [max_sequence_length])
     
     print(f"\n{'='*100}")
     print("RECOMMENDED STRATEGY FOR create_dataset.py")
@@ -405,6 +504,14 @@ def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
                 print(f"{widget_id:<30} {action_data['current_total_tokens']:<12} {action_data['over_by']:<12} {action_data['reason']}")
         print()
     
+    print("Strategies by max_sequence_length (create_dataset.py --max-seq-len):")
+    print(f"{'Length':<10} {'Keep':<8} {'Exclude':<8} {'Data loss'}")
+    print("-" * 40)
+    for length, entry in strategies.items():
+        loss = entry['summary']['exclude'] / total * 100 if total else 0.0
+        print(f"{length:<10} {entry['summary']['keep']:<8} {entry['summary']['exclude']:<8} {loss:.1f}%")
+    print()
+    
     # Export results
     output_file = 'training_data_size_analysis.json'
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -425,7 +532,8 @@ def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
             'summary': {
                 'keep': keep_count,
                 'exclude': exclude_count
-            }
+            },
+            'strategies': strategies
         }, f, indent=2)
     
     print(f"✓ Detailed analysis saved to: {output_file}")
@@ -435,6 +543,7 @@ def print_analysis(results, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
     print(f"   The strategy file contains specific actions for each widget:")
     print(f"   - 'keep': Include widget as-is")
     print(f"   - 'exclude': Skip this widget entirely (exceeds token limit)")
+    print(f"   Pick the strategy for another training length with --max-seq-len ({', '.join(strategies)})")
 
 def main():
     import argparse
@@ -448,13 +557,37 @@ def main():
                        help='Directory containing widget files')
     parser.add_argument('--prompts', default='prompts',
                        help='Directory containing prompt files')
+    parser.add_argument('--index', default=None,
+                       help='Read widget code through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                       help='Read widget files straight from downloads/*.zip instead of extracted folders')
     parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_SEQUENCE_LENGTH,
                        help='Maximum sequence length in tokens (default: 4095)')
+    parser.add_argument('--seq-lens', default=','.join(map(str, DEFAULT_STRATEGY_LENGTHS)),
+                       help='Comma-separated max_sequence_length values to write strategies for, alongside '
+                            f'--max-tokens (default: {",".join(map(str, DEFAULT_STRATEGY_LENGTHS))})')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of worker processes (default: 1)')
+    parser.add_argument('--packed', default=None,
+                       help='Read prompts and widget code from a pack built by packed_corpus.py (e.g. widget_pack.bin)')
+    parser.add_argument('--tokenizer', default=DEFAULT_TOKENIZER,
+                       help='Token counter: chars[:N], sentencepiece:<model>, hf:<name-or-path> or tiktoken:<encoding> '
+                            '(default: chars, i.e. chars / 4)')
+    parser.add_argument('--token-cache', default=DEFAULT_CACHE_FILE,
+                       help=f'Token count cache for real tokenizers (default: {DEFAULT_CACHE_FILE}; empty to disable)')
     
     args = parser.parse_args()
+    token_counter = open_token_counter(args.tokenizer, args.token_cache)
     
-    results = analyze_complete_training_data(args.csv, args.downloads, args.prompts)
-    print_analysis(results, args.max_tokens)
+    if args.packed:
+        results = analyze_complete_training_data(args.csv, args.downloads, args.prompts, jobs=args.jobs,
+                                                 pack=PackedCorpus(args.packed), token_counter=token_counter)
+    else:
+        corpus = open_corpus(args.downloads, args.index, from_zips=args.from_zips)
+        results = analyze_complete_training_data(args.csv, args.downloads, args.prompts, corpus=corpus,
+                                                 jobs=args.jobs, token_counter=token_counter)
+    sequence_lengths = [int(length) for length in args.seq_lens.split(',') if length]
+    print_analysis(results, args.max_tokens, sequence_lengths)
 
 if __name__ == '__main__':
     main()
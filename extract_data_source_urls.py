@@ -4,12 +4,14 @@ Extract actual URLs and API endpoints from widget files, grouped by data source
 """
 
 import os
-import glob
 import re
 import json
 from collections import defaultdict
+from functools import lru_cache
 from urllib.parse import urlparse
 
+from widget_corpus import open_corpus, parallel_map
+
 # URL patterns to identify
 URL_PATTERNS = {
     'weather': [
@@ -84,6 +86,30 @@ URL_PATTERNS = {
     ],
 }
 
+# Find all HTTP/HTTPS URLs
+URL_REGEX = re.compile(r'https?://[^\s"\'<>{}|\\^`\[\]]+')
+
+# Enough to hold every distinct URL of a large corpus without growing unbounded
+URL_CACHE_SIZE = 1 << 16
+
+def compile_url_patterns(patterns=URL_PATTERNS):
+    """
+    Combine URL_PATTERNS into one regex that reports the first matching category.
+    
+    Each category becomes an alternative `(?=[\s\S]*?(?:p1|p2|...))(?P<category>)`
+    anchored at the start of the URL. Alternatives are tried in dict order and
+    each lookahead searches the whole URL, so match().lastgroup is exactly the
+    category the old per-pattern loop returned first.
+    """
+    alternatives = []
+    for category, category_patterns in patterns.items():
+        if category_patterns:
+            joined = '|'.join(f'(?:{pattern})' for pattern in category_patterns)
+            alternatives.append(f'(?=[\\s\\S]*?(?:{joined}))(?P<{category}>)')
+    return re.compile('|'.join(alternatives), re.IGNORECASE)
+
+URL_CATEGORY_MATCHER = compile_url_patterns()
+
 def extract_urls_from_file(file_path):
     """Extract URLs from a widget file."""
     try:
@@ -92,26 +118,52 @@ def extract_urls_from_file(file_path):
     except Exception as e:
         return []
     
-    urls = set()
+    return extract_urls_from_content(content)
+
+def extract_urls_from_content(content):
+    """Extract URLs from already-read widget source text."""
+    return list(extract_categorized_urls(content))
+
+def extract_categorized_urls(content):
+    """
+    Extract and categorize URLs in one pass over widget source text.
     
-    # Find all HTTP/HTTPS URLs
-    url_pattern = r'https?://[^\s"\'<>{}|\\^`\[\]]+'
-    found_urls = re.findall(url_pattern, content)
+    Returns {url: category}; categorize_url() is memoized, so URLs repeated
+    across files and widgets are only classified once.
+    """
+    urls = {}
     
-    for url in found_urls:
+    for match in URL_REGEX.finditer(content):
         # Clean up URL (remove trailing punctuation that might not be part of URL)
-        url = url.rstrip('.,;:!?)')
+        url = match.group().rstrip('.,;:!?)')
         # Remove trailing slashes for consistency
         url = url.rstrip('/')
-        if url:
-            urls.add(url)
+        if url and url not in urls:
+            urls[url] = categorize_url(url)
     
-    return list(urls)
+    return urls
 
+@lru_cache(maxsize=URL_CACHE_SIZE)
 def categorize_url(url):
     """Categorize a URL by data source type."""
     url_lower = url.lower()
     
+    match = URL_CATEGORY_MATCHER.match(url_lower)
+    if match:
+        return match.lastgroup
+    
+    # Check for common patterns
+    if 'api.' in url_lower:
+        return 'api'
+    if 'json' in url_lower:
+        return 'json'
+    
+    return 'other'
+
+def categorize_url_legacy(url):
+    """Original per-pattern categorizer (reference for categorize_url)."""
+    url_lower = url.lower()
+    
     for category, patterns in URL_PATTERNS.items():
         for pattern in patterns:
             if re.search(pattern, url_lower, re.IGNORECASE):
@@ -125,6 +177,7 @@ def categorize_url(url):
     
     return 'other'
 
+@lru_cache(maxsize=URL_CACHE_SIZE)
 def normalize_url(url):
     """Normalize URL to base domain/path for grouping."""
     try:
@@ -135,47 +188,41 @@ def normalize_url(url):
     except:
         return url
 
-def main():
-    downloads_dir = 'downloads'
-    
-    if not os.path.exists(downloads_dir):
-        print(f"Error: {downloads_dir} directory not found")
-        return
-    
-    # Find all widget files
-    jsx_files = glob.glob(os.path.join(downloads_dir, '**/*.jsx'), recursive=True)
-    coffee_files = glob.glob(os.path.join(downloads_dir, '**/*.coffee'), recursive=True)
-    all_files = jsx_files + coffee_files
+def extract_corpus_file_urls(corpus, widget_file_key):
+    """Extract categorized URLs from one (folder, relpath); returns (widget_id, {url: category})."""
+    folder, relpath = widget_file_key
+    # Get widget ID
+    widget_id = folder.replace('.widget', '')
     
-    print(f"Scanning {len(all_files)} widget files for URLs...")
+    try:
+        urls = extract_categorized_urls(corpus.read_text(folder, relpath, errors='ignore'))
+    except Exception:
+        urls = {}
+    return widget_id, urls
+
+def group_urls_by_category(file_urls):
+    """
+    Group extracted URLs by data source category.
     
-    # Extract URLs from all files
+    file_urls is an iterable of (widget_id, {url: category}) as returned by
+    extract_categorized_urls(). Returns (result, unique_url_count) where
+    result maps category -> {'urls': [...], 'widget_count': N}.
+    """
     all_urls = set()
     url_to_category = {}
     url_to_widgets = defaultdict(set)
     
-    for widget_file in all_files:
-        # Get widget ID
-        parts = widget_file.split(os.sep)
-        if len(parts) >= 2:
-            widget_id = parts[1].replace('.widget', '')
-        else:
-            widget_id = 'unknown'
-        
-        urls = extract_urls_from_file(widget_file)
-        
-        for url in urls:
+    for widget_id, urls in file_urls:
+        for url, category in urls.items():
             all_urls.add(url)
             url_to_widgets[url].add(widget_id)
-            
-            # Categorize URL
-            category = categorize_url(url)
             url_to_category[url] = category
     
     # Group URLs by category
     urls_by_category = defaultdict(lambda: {'urls': set(), 'widgets': set()})
     
-    for url in all_urls:
+    # Sorted so the category order in the output does not depend on string hashing
+    for url in sorted(all_urls):
         category = url_to_category.get(url, 'other')
         normalized = normalize_url(url)
         urls_by_category[category]['urls'].add(normalized)
@@ -188,13 +235,52 @@ def main():
             'urls': sorted(list(data['urls'])),
             'widget_count': len(data['widgets'])
         }
-    
-    # Save to JSON
-    output_file = 'widget_data_source_urls.json'
+    return result, len(all_urls)
+
+def save_urls_by_category(result, output_file='widget_data_source_urls.json'):
+    """Write widget_data_source_urls.json."""
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(result, f, indent=2, ensure_ascii=False)
+    return output_file
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Extract data source URLs from widget files')
+    parser.add_argument('--downloads', default='downloads',
+                       help='Directory containing widget files')
+    parser.add_argument('--index', default=None,
+                       help='Read widget files through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                       help='Read widget files straight from downloads/*.zip instead of extracted folders')
+    parser.add_argument('--jobs', type=int, default=1,
+                       help='Number of worker processes (default: 1)')
+    args = parser.parse_args()
+    
+    downloads_dir = args.downloads
+    
+    if not os.path.exists(downloads_dir):
+        print(f"Error: {downloads_dir} directory not found")
+        return
+    
+    corpus = open_corpus(downloads_dir, args.index, from_zips=args.from_zips)
+    
+    # Find all widget files
+    jsx_files = list(corpus.iter_files(('.jsx',)))
+    coffee_files = list(corpus.iter_files(('.coffee',)))
+    all_files = jsx_files + coffee_files
+    
+    print(f"Scanning {len(all_files)} widget files for URLs...")
+    
+    # Extract URLs from all files
+    file_urls = parallel_map(extract_corpus_file_urls, all_files, args.jobs, context=corpus)
+    
+    result, url_count = group_urls_by_category(file_urls)
+    
+    # Save to JSON
+    output_file = save_urls_by_category(result)
     
-    print(f"\nFound URLs in {len(all_urls)} unique URLs")
+    print(f"\nFound URLs in {url_count} unique URLs")
     print(f"Grouped into {len(result)} categories")
     print(f"Results saved to: {output_file}")
     
@@ -18,7 +18,6 @@ def is_complex_coffee(folder_path):
     """Check if CoffeeScript files contain complex patterns (conditionals, loops, complex interpolation)."""
     import glob
     import os
-    import re
     
     # Find all .coffee files, excluding __MACOSX directories
     coffee_pattern = os.path.join(folder_path, '**', '*.coffee')
@@ -30,6 +29,25 @@ def is_complex_coffee(folder_path):
     if not coffee_files:
         return False
     
+    for coffee_file in coffee_files:
+        try:
+            with open(coffee_file, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+                
+            # Check for complex patterns
+            if is_complex_coffee_content(content):
+                return True
+                    
+        except Exception:
+            # If we can't read the file, assume it's not complex
+            continue
+    
+    return False
+
+def is_complex_coffee_content_legacy(content):
+    """Original regex-based check, kept as the reference for is_complex_coffee_content()."""
+    import re
+    
     # Patterns that indicate complexity
     complex_patterns = [
         r'if\s+.*\s+then',  # if-then statements
@@ -44,22 +62,92 @@ def is_complex_coffee(folder_path):
         r'#\{.*for\s+',     # for loops in interpolation
     ]
     
-    for coffee_file in coffee_files:
-        try:
-            with open(coffee_file, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-                
-            # Check for complex patterns
-            for pattern in complex_patterns:
-                if re.search(pattern, content, re.MULTILINE | re.DOTALL):
-                    return True
-                    
-        except Exception:
-            # If we can't read the file, assume it's not complex
-            continue
+    for pattern in complex_patterns:
+        if re.search(pattern, content, re.MULTILINE | re.DOTALL):
+            return True
+    
+    return False
+
+def _find_keyword(content, keyword, start=0, space_after=False):
+    """
+    Index of the first `keyword` at or after `start`, or -1.
+    
+    With space_after, the keyword must be followed by whitespace (`keyword\\s+`).
+    """
+    index = content.find(keyword, start)
+    while index != -1:
+        end = index + len(keyword)
+        if not space_after or (end < len(content) and content[end].isspace()):
+            return index
+        index = content.find(keyword, index + 1)
+    return -1
+
+def _find_call(content, name, start=0):
+    """Index of the first `name\\s*\\(` at or after `start`, or -1."""
+    index = content.find(name, start)
+    while index != -1:
+        end = index + len(name)
+        while end < len(content) and content[end].isspace():
+            end += 1
+        if end < len(content) and content[end] == '(':
+            return index
+        index = content.find(name, index + 1)
+    return -1
+
+def _has_block_keyword(content, opener, closer):
+    """
+    Linear check for `opener\\s+.*\\s+closer` with DOTALL.
     
+    The earliest `opener` followed by whitespace leaves the most room, so it
+    is enough to look for a whitespace-preceded `closer` that starts at least
+    two characters after it (one for each `\\s+`).
+    """
+    index = _find_keyword(content, opener, space_after=True)
+    if index == -1:
+        return False
+    position = content.find(closer, index + len(opener) + 2)
+    while position != -1:
+        if content[position - 1].isspace():
+            return True
+        position = content.find(closer, position + 1)
     return False
 
+def is_complex_coffee_content(content):
+    """
+    Check CoffeeScript source text for complex patterns (conditionals, loops, complex interpolation).
+    
+    Same answer as is_complex_coffee_content_legacy(), but every check is a
+    forward scan with str.find, so large minified files cannot trigger the
+    regex backtracking of patterns like `#\\{.*\\?.*:.*\\}`.
+    """
+    # if-then statements, for loops
+    if _has_block_keyword(content, 'if', 'then') or _has_block_keyword(content, 'for', 'in'):
+        return True
+    
+    # while loops, when statements
+    if _find_keyword(content, 'while', space_after=True) != -1 or _find_keyword(content, 'when', space_after=True) != -1:
+        return True
+    
+    # Everything else must appear after the first interpolation opener
+    interpolation = content.find('#{')
+    if interpolation == -1:
+        return False
+    rest = interpolation + 2
+    
+    # ternary operators in interpolation: #{ ... ? ... : ... }
+    question = content.find('?', rest)
+    if question != -1:
+        colon = content.find(':', question + 1)
+        if colon != -1 and content.find('}', colon + 1) != -1:
+            return True
+    
+    # forEach / map / filter / if / for in interpolation
+    return (content.find('forEach', rest) != -1
+            or _find_call(content, 'map', rest) != -1
+            or _find_call(content, 'filter', rest) != -1
+            or _find_keyword(content, 'if', rest, space_after=True) != -1
+            or _find_keyword(content, 'for', rest, space_after=True) != -1)
+
 def has_jsx_files(folder_path):
     """Check if any JSX files exist in the given folder (recursively)."""
     import glob
@@ -74,13 +162,92 @@ def has_jsx_files(folder_path):
     
     return len(jsx_files) > 0
 
+def scan_widget_folder(folder_path):
+    """
+    Return (has_coffee, complex_coffee, has_jsx) with a single os.scandir walk.
+    
+    Matches has_coffee_files/is_complex_coffee/has_jsx_files: like
+    glob('**/*.ext', recursive=True) it skips hidden entries, follows
+    directory symlinks and ignores anything under __MACOSX. CoffeeScript
+    files are only read until one is found to be complex, and the walk stops
+    once nothing can change the answer.
+    """
+    import os
+    
+    has_coffee = False
+    complex_coffee = False
+    has_jsx = False
+    pending = [folder_path]
+    
+    while pending and not (complex_coffee and has_jsx):
+        try:
+            with os.scandir(pending.pop()) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.name.endswith('.coffee') and '__MACOSX' not in entry.path:
+                has_coffee = True
+                if not complex_coffee and entry.is_file():
+                    try:
+                        with open(entry.path, 'r', encoding='utf-8', errors='ignore') as f:
+                            complex_coffee = is_complex_coffee_content(f.read())
+                    except Exception:
+                        # If we can't read the file, assume it's not complex
+                        pass
+            elif entry.name.endswith('.jsx') and '__MACOSX' not in entry.path:
+                has_jsx = True
+            try:
+                if entry.is_dir():
+                    pending.append(entry.path)
+            except OSError:
+                continue
+    
+    return has_coffee, complex_coffee, has_jsx
+
+def widget_flags_from_corpus(corpus, folder):
+    """Return (has_coffee, complex_coffee, has_jsx) for a widget folder read through a corpus."""
+    coffee_files = [f for f in corpus.source_files(folder, ('.coffee',)) if '__MACOSX' not in f]
+    jsx_files = [f for f in corpus.source_files(folder, ('.jsx',)) if '__MACOSX' not in f]
+    
+    complex_coffee = False
+    for coffee_file in coffee_files:
+        try:
+            if is_complex_coffee_content(corpus.read_text(folder, coffee_file, errors='ignore')):
+                complex_coffee = True
+                break
+        except Exception:
+            # If we can't read the file, assume it's not complex
+            continue
+    
+    return bool(coffee_files), complex_coffee, bool(jsx_files)
+
 def main():
     """Generate a comprehensive CSV report from widget data, categories, and coffee detection results."""
+    import argparse
     import json
     import csv
     import os
     import glob
     from urllib.parse import urlparse
+    from widget_corpus import open_corpus
+    
+    parser = argparse.ArgumentParser(description='Generate widget_processing_results.csv from widget_list.json and downloads/')
+    parser.add_argument('--index', default=None,
+                        help='Read widget files through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                        help='Inspect downloads/*.zip directly instead of the extracted folders')
+    parser.add_argument('--flags', default=None,
+                        help='Use coffee/JSX flags precomputed by scan_corpus.py (e.g. widget_report_flags.json)')
+    args = parser.parse_args()
+    
+    report_flags = None
+    if args.flags:
+        with open(args.flags, 'r', encoding='utf-8') as f:
+            report_flags = json.load(f)
+        print(f"Loaded precomputed flags for {len(report_flags)} widget folders")
     
     # Read the widget list JSON file
     with open('widget_list.json', 'r') as f:
@@ -106,6 +273,11 @@ def main():
     if not os.path.exists(downloads_dir):
         print(f"Warning: Downloads directory not found at {downloads_dir}")
         print("Coffee detection will be set to 'Unknown'")
+        corpus = None
+    elif args.index or args.from_zips:
+        corpus = open_corpus(downloads_dir, args.index, from_zips=args.from_zips)
+    else:
+        corpus = None
     
     # Prepare CSV output file
     csv_filename = 'widget_processing_results.csv'
@@ -148,17 +320,33 @@ def main():
                     folder_name = filename[:-4] if filename.endswith('.zip') else filename
                     extract_path = os.path.join(downloads_dir, folder_name)
                     
-                    if os.path.exists(extract_path):
+                    if args.from_zips:
+                        # The archive stands in for the extracted folder
+                        extracted = corpus.has_widget(folder_name)
+                    else:
+                        extracted = os.path.exists(extract_path)
+                    
+                    if extracted:
+                        if report_flags is not None and folder_name in report_flags:
+                            flags = report_flags[folder_name]
+                            has_coffee = flags['has_coffee']
+                            complex_flag = flags['complex_coffee']
+                            has_jsx = flags['has_jsx']
+                        elif corpus is not None:
+                            has_coffee, complex_flag, has_jsx = widget_flags_from_corpus(corpus, folder_name)
+                        else:
+                            has_coffee, complex_flag, has_jsx = scan_widget_folder(extract_path)
+                        
                         # Check for CoffeeScript files
-                        if has_coffee_files(extract_path):
+                        if has_coffee:
                             iscoffee = 'Y'
-                            complexcoffee = is_complex_coffee(extract_path)
+                            complexcoffee = complex_flag
                             print(f"Found .coffee files in: {folder_name} (Complex: {complexcoffee})")
                         else:
                             iscoffee = 'N'
                         
                         # Check for JSX files (independent of CoffeeScript)
-                        if has_jsx_files(extract_path):
+                        if has_jsx:
                             isjsx = 'Y'
                             print(f"Found .jsx files in: {folder_name}")
                         else:
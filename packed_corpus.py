@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Packed, memory-mapped store of prompts and widget code.
+
+Building a dataset opens every prompts/<id>.prompt file and every JSX file
+of every widget. This module packs everything create_dataset.py and
+evaluate_training_data_size.py need into two files:
+
+- widget_pack.bin       one blob of UTF-8 text (prompts and concatenated JSX)
+- widget_pack.bin.json  offset index keyed by OS_widget_id
+
+The blob is opened with mmap, so reading a prompt or a widget's code is a
+slice of the mapped file instead of an open()/read() per file. Identical
+code (the same widget listed twice) is stored once.
+
+Usage:
+    python packed_corpus.py --csv widget_processing_results.csv
+    python create_dataset.py --csv widget_processing_results.csv --set v1 --packed widget_pack.bin
+
+Rebuild the pack after prompts or downloads change.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+
+from widget_corpus import SOURCE_EXTENSIONS, BaseCorpus, open_corpus
+
+PACK_VERSION = 1
+DEFAULT_PACK_FILE = 'widget_pack.bin'
+
+
+def pack_index_path(pack_file):
+    """Path of the JSON offset index that accompanies a pack blob."""
+    return pack_file + '.json'
+
+
+def read_prompt_file(prompt_file):
+    """Read and strip a prompt file the way create_dataset.py does; returns None if missing."""
+    if not os.path.exists(prompt_file):
+        return None
+    with open(prompt_file, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def build_pack(csv_file_path, pack_file=DEFAULT_PACK_FILE, corpus=None, prompts_dir='prompts'):
+    """
+    Pack prompts and widget code for every JSX widget in the CSV.
+
+    Each index entry records the widget folder, its source file listing and
+    [offset, length] spans into the blob for the prompt and the code (null
+    when missing). Unreadable prompts keep their error message so readers can
+    report them exactly as before. Returns the number of widgets packed.
+    """
+    if corpus is None:
+        corpus = open_corpus()
+
+    with open(csv_file_path, 'r', encoding='utf-8') as f:
+        rows = [row for row in csv.DictReader(f) if row.get('PS_isJSX') == 'Y']
+
+    widgets = {}
+    spans = {}
+    pack_dir = os.path.dirname(os.path.abspath(pack_file))
+    fd, tmp_blob = tempfile.mkstemp(dir=pack_dir, prefix='.widget_pack.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as blob:
+            def append(text):
+                data = text.encode('utf-8')
+                key = hashlib.sha256(data).digest()
+                if key not in spans:
+                    spans[key] = [blob.tell(), len(data)]
+                    blob.write(data)
+                return spans[key]
+
+            for row in rows:
+                widget_id = row['OS_widget_id']
+                folder = row['PS_widgetfoldername']
+                entry = {'folder': folder, 'has_folder': corpus.has_widget(folder), 'files': [],
+                         'prompt': None, 'code': None}
+
+                prompt_file = os.path.join(prompts_dir, f'{widget_id}.prompt')
+                try:
+                    prompt = read_prompt_file(prompt_file)
+                    if prompt is not None:
+                        entry['prompt'] = append(prompt)
+                except Exception as e:
+                    entry['prompt_error'] = str(e)
+
+                if entry['has_folder']:
+                    entry['files'] = corpus.source_files(folder, SOURCE_EXTENSIONS)
+                    code = corpus.widget_code(folder)
+                    if code is not None:
+                        entry['code'] = append(code)
+                widgets[widget_id] = entry
+
+            blob.flush()
+            os.fsync(blob.fileno())
+        os.replace(tmp_blob, pack_file)
+    except BaseException:
+        if os.path.exists(tmp_blob):
+            os.unlink(tmp_blob)
+        raise
+
+    index = {
+        'version': PACK_VERSION,
+        'blob': os.path.basename(pack_file),
+        'downloads_dir': corpus.downloads_dir,
+        'widgets': widgets,
+    }
+    fd, tmp_index = tempfile.mkstemp(dir=pack_dir, prefix='.widget_pack.', suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_index, pack_index_path(pack_file))
+    return len(widgets)
+
+
+class PackedCorpus(BaseCorpus):
+    """
+    Read-only view of a pack built by build_pack().
+
+    Answers the corpus questions create_dataset.py and
+    evaluate_training_data_size.py ask (has_widget, source_files,
+    widget_code) plus prompt lookups by OS_widget_id.
+    """
+
+    def __init__(self, pack_file=DEFAULT_PACK_FILE):
+        self.pack_file = pack_file
+        with open(pack_index_path(pack_file), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') != PACK_VERSION:
+            raise ValueError(f"Unsupported pack version {index.get('version')} in {pack_index_path(pack_file)}")
+        # Used for log messages, which name the folders the pack was built from
+        self.downloads_dir = index['downloads_dir']
+        self.widgets = index['widgets']
+        self.folders = {}
+        for widget_id, entry in self.widgets.items():
+            self.folders.setdefault(entry['folder'], entry)
+
+        self._file = open(pack_file, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap cannot map an empty file; an empty pack has nothing to slice
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __getstate__(self):
+        # Maps and file handles cannot be pickled; worker processes map the pack again
+        return {'pack_file': self.pack_file}
+
+    def __setstate__(self, state):
+        self.__init__(state['pack_file'])
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _text(self, span):
+        if span is None:
+            return None
+        offset, length = span
+        return str(memoryview(self._map)[offset:offset + length], 'utf-8')
+
+    def prompt(self, widget_id):
+        """
+        Stripped prompt text for a widget, or None if it had no prompt file.
+
+        Raises ValueError if the prompt file could not be read when the pack was built.
+        """
+        entry = self.widgets.get(widget_id)
+        if entry is None:
+            return None
+        if 'prompt_error' in entry:
+            raise ValueError(entry['prompt_error'])
+        return self._text(entry['prompt'])
+
+    def widget_folders(self):
+        return sorted(folder for folder, entry in self.folders.items() if entry['has_folder'])
+
+    def has_widget(self, folder):
+        entry = self.folders.get(folder)
+        return entry is not None and entry['has_folder']
+
+    def source_files(self, folder, extensions=SOURCE_EXTENSIONS):
+        entry = self.folders.get(folder)
+        if entry is None:
+            return []
+        return [relpath for relpath in entry['files'] if relpath.endswith(extensions)]
+
+    def widget_code(self, folder):
+        entry = self.folders.get(folder)
+        return self._text(entry['code']) if entry is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack prompts and widget code into one memory-mapped file')
+    parser.add_argument('--csv', default='widget_processing_results.csv',
+                        help='Path to widget_processing_results.csv')
+    parser.add_argument('--prompts', default='prompts',
+                        help='Directory containing prompt files')
+    parser.add_argument('--downloads', default='downloads',
+                        help='Directory containing widget files')
+    parser.add_argument('--index', default=None,
+                        help='Read widget code through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                        help='Read widget code straight from downloads/*.zip instead of extracted folders')
+    parser.add_argument('--output', default=DEFAULT_PACK_FILE,
+                        help=f'Pack file to write (default: {DEFAULT_PACK_FILE}, index next to it)')
+    args = parser.parse_args()
+
+    corpus = open_corpus(args.downloads, args.index, from_zips=args.from_zips)
+    count = build_pack(args.csv, args.output, corpus=corpus, prompts_dir=args.prompts)
+    print(f"Packed {count} widgets into {args.output} ({os.path.getsize(args.output):,} bytes)")
+    print(f"Index written to: {pack_index_path(args.output)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Scan the widget corpus once and write every per-file report.
+
+analyze_widget_sizes.py, analyze_widget_data_sources.py,
+extract_data_source_urls.py and generate_widget_report.py each walk
+downloads/ and read every source file again. This script reads each file
+once, decodes it once and feeds the same text to all of their analyzers,
+then writes the same output files they do:
+
+- widget_size_analysis.json    (analyze_widget_sizes.py)
+- widget_data_sources.json     (analyze_widget_data_sources.py)
+- widget_data_source_urls.json (extract_data_source_urls.py)
+- widget_report_flags.json     (coffee/JSX flags for generate_widget_report.py --flags)
+
+Usage:
+    python scan_corpus.py
+    python scan_corpus.py --index corpus_index.sqlite --jobs 4
+"""
+
+import argparse
+import json
+import os
+
+from analyze_widget_data_sources import analyze_widget_content, save_data_sources, summarize_data_sources
+from analyze_widget_sizes import DEFAULT_MAX_SEQUENCE_LENGTH, load_jsx_widgets, save_size_analysis, widget_size_entry
+from extract_data_source_urls import extract_categorized_urls, group_urls_by_category, save_urls_by_category
+from generate_widget_report import is_complex_coffee_content
+from widget_corpus import decode_source, open_corpus, parallel_map
+
+DEFAULT_FLAGS_FILE = 'widget_report_flags.json'
+
+
+def scan_file(corpus, folder, relpath):
+    """
+    Read one source file and run every analyzer on it.
+
+    Returns a dict with the file's size metrics (or the strict-decode error
+    analyze_widget_sizes.py would report), its data-source result and its URLs.
+    """
+    widget_file = corpus.display_path(folder, relpath)
+    record = {'relpath': relpath, 'file': widget_file}
+    try:
+        data = corpus.read_bytes(folder, relpath)
+    except Exception as e:
+        record['size_error'] = str(e)
+        record['sources'] = {'error': str(e)}
+        record['urls'] = {}
+        record['text'] = None
+        return record
+
+    # Size analysis reads strictly; the other analyzers ignore bad bytes.
+    try:
+        text = decode_source(data)
+        lenient_text = text
+        record['chars'] = len(text)
+        record['lines'] = text.count('\n')
+    except UnicodeDecodeError as e:
+        record['size_error'] = str(e)
+        lenient_text = decode_source(data, errors='ignore')
+
+    record['sources'] = analyze_widget_content(lenient_text, widget_file)
+    record['urls'] = extract_categorized_urls(lenient_text)
+    record['text'] = lenient_text
+    return record
+
+
+def scan_widget(corpus, folder):
+    """Scan every source file of one widget folder; returns (folder, jsx_records, coffee_records, flags)."""
+    jsx_records = [scan_file(corpus, folder, relpath) for relpath in corpus.source_files(folder, ('.jsx',))]
+    coffee_records = [scan_file(corpus, folder, relpath) for relpath in corpus.source_files(folder, ('.coffee',))]
+
+    # Same rules as generate_widget_report.widget_flags_from_corpus()
+    coffee = [r for r in coffee_records if '__MACOSX' not in r['relpath']]
+    flags = {
+        'has_coffee': bool(coffee),
+        'complex_coffee': any(r['text'] is not None and is_complex_coffee_content(r['text']) for r in coffee),
+        'has_jsx': any('__MACOSX' not in r['relpath'] for r in jsx_records),
+    }
+
+    # Drop the text before it is sent back to the parent process
+    for record in jsx_records + coffee_records:
+        del record['text']
+    return folder, jsx_records, coffee_records, flags
+
+
+def scan_corpus(corpus, jobs=1):
+    """Scan all widget folders, in folder order, optionally across `jobs` processes."""
+    return parallel_map(scan_widget, corpus.widget_folders(), jobs, context=corpus)
+
+
+def build_size_results(scanned, csv_file_path):
+    """Rebuild analyze_widget_sizes.analyze_widget_files() results from scan records."""
+    by_folder = {folder: jsx_records for folder, jsx_records, _, _ in scanned}
+    widgets = load_jsx_widgets(csv_file_path)
+    print(f"Analyzing {len(widgets)} JSX widgets...")
+
+    results = []
+    for widget in widgets:
+        jsx_records = by_folder.get(widget['folder'])
+        if jsx_records is None:
+            continue
+        file_sizes = []
+        for record in jsx_records:
+            if 'size_error' in record:
+                print(f"Warning: Could not read {record['file']}: {record['size_error']}")
+                continue
+            file_sizes.append({'file': record['relpath'], 'chars': record['chars'], 'lines': record['lines']})
+        results.append(widget_size_entry(widget, len(jsx_records), file_sizes))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan widget sources once and write all per-file reports')
+    parser.add_argument('--downloads', default='downloads',
+                        help='Directory containing widget files')
+    parser.add_argument('--index', default=None,
+                        help='Read widget files through a persistent corpus index (e.g. corpus_index.sqlite)')
+    parser.add_argument('--from-zips', action='store_true',
+                        help='Read widget files straight from downloads/*.zip instead of extracted folders')
+    parser.add_argument('--csv', default='widget_processing_results.csv',
+                        help='CSV used for the size analysis (skipped if missing)')
+    parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_SEQUENCE_LENGTH,
+                        help='Maximum sequence length recorded in widget_size_analysis.json (default: 4095)')
+    parser.add_argument('--flags-output', default=DEFAULT_FLAGS_FILE,
+                        help=f'Where to write coffee/JSX flags (default: {DEFAULT_FLAGS_FILE})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of worker processes (default: 1)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.downloads):
+        print(f"Error: {args.downloads} directory not found")
+        return
+
+    corpus = open_corpus(args.downloads, args.index, from_zips=args.from_zips)
+    scanned = scan_corpus(corpus, args.jobs)
+    file_count = sum(len(jsx) + len(coffee) for _, jsx, coffee, _ in scanned)
+    print(f"Scanned {file_count} widget files in {len(scanned)} widget folders")
+
+    # Size analysis (JSX widgets from the CSV)
+    if os.path.exists(args.csv):
+        size_results = build_size_results(scanned, args.csv)
+        output_file = save_size_analysis(size_results, args.max_tokens)
+        print(f"✓ Size analysis for {len(size_results)} widgets saved to: {output_file}")
+    else:
+        print(f"Skipping size analysis: {args.csv} not found")
+
+    # Data sources and URLs, in the order the standalone scripts visit files:
+    # every JSX file first, then every CoffeeScript file.
+    jsx_records = [(folder, r) for folder, jsx, _, _ in scanned for r in jsx]
+    coffee_records = [(folder, r) for folder, _, coffee, _ in scanned for r in coffee]
+    ordered = jsx_records + coffee_records
+
+    data_sources = summarize_data_sources(
+        (folder.replace('.widget', ''), r['file'], r['sources']) for folder, r in ordered
+    )
+    output_file = save_data_sources(data_sources)
+    print(f"✓ Data sources for {len(data_sources)} widgets saved to: {output_file}")
+
+    urls_by_category, url_count = group_urls_by_category(
+        (folder.replace('.widget', ''), r['urls']) for folder, r in ordered
+    )
+    output_file = save_urls_by_category(urls_by_category)
+    print(f"✓ {url_count} unique URLs in {len(urls_by_category)} categories saved to: {output_file}")
+
+    flags = {folder: widget_flags for folder, _, _, widget_flags in scanned}
+    with open(args.flags_output, 'w', encoding='utf-8') as f:
+        json.dump(flags, f, indent=2)
+    print(f"✓ Coffee/JSX flags for {len(flags)} widget folders saved to: {args.flags_output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+from create_dataset import SPLIT_NAMES, stratified_hash_split
+
+
+def _entries(count, prefix):
+    return [{'widget_id': f'{prefix}{i}'} for i in range(count)]
+
+
+def test_small_categories_get_valid_and_test():
+    data = _entries(10, 'a') + _entries(40, 'b')
+    categories = {entry['widget_id']: entry['widget_id'][0] for entry in data}
+    splits = stratified_hash_split(data, 'salt', categories, {})
+    for category, size in (('a', 10), ('b', 40)):
+        counts = [sum(categories[e['widget_id']] == category for e in split) for split in splits]
+        assert counts == [round(size * 0.8), round(size * 0.1), round(size * 0.1)]
+
+
+def test_placed_widgets_never_move():
+    data = _entries(60, 'w')
+    categories = {entry['widget_id']: ('x', 'y', 'z')[i % 3] for i, entry in enumerate(data)}
+    assignments = {}
+    stratified_hash_split(data[:30], 'salt', categories, assignments)
+    before = dict(assignments)
+    # More widgets arrive and some of the placed ones change category
+    categories.update({f'w{i}': 'new' for i in range(0, 30, 4)})
+    splits = stratified_hash_split(data, 'salt', categories, assignments)
+    assert {k: assignments[k] for k in before} == before
+    for name, split in zip(SPLIT_NAMES, splits):
+        assert all(assignments[e['widget_id']] == name for e in split)
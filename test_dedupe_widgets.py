@@ -0,0 +1,24 @@
+import random
+
+from dedupe_widgets import (DEFAULT_NUM_PERM, DEFAULT_THRESHOLD, MIN_CANDIDATE_RECALL, candidate_pairs,
+                            candidate_probability, lsh_parameters, minhash_signature)
+
+
+def test_lsh_parameters_recall_at_threshold():
+    bands, rows = lsh_parameters(DEFAULT_THRESHOLD, DEFAULT_NUM_PERM)
+    assert bands * rows == DEFAULT_NUM_PERM
+    assert candidate_probability(DEFAULT_THRESHOLD, bands, rows) >= MIN_CANDIDATE_RECALL
+
+
+def test_pairs_at_threshold_become_candidates():
+    # 200 pairs of 180-shingle sets sharing 160 shingles: Jaccard 160 / 200 = 0.8
+    rng = random.Random(0)
+    bands, rows = lsh_parameters(DEFAULT_THRESHOLD, DEFAULT_NUM_PERM)
+    found = 0
+    for pair in range(200):
+        words = [f'{pair}-{rng.random()}' for _ in range(200)]
+        a = set(words[:180])
+        b = set(words[:160] + words[180:])
+        signatures = [minhash_signature(a), minhash_signature(b)]
+        found += (0, 1) in candidate_pairs(signatures, bands, rows)
+    assert found / 200 >= 0.88
@@ -0,0 +1,21 @@
+import random
+import time
+
+from generate_widget_report import is_complex_coffee_content, is_complex_coffee_content_legacy
+
+
+def test_pathological_interpolation_is_linear():
+    # `#{.*\?.*:.*\}` backtracks cubically on this input; the scan must not
+    content = '#{?:' * 20000
+    start = time.perf_counter()
+    assert is_complex_coffee_content(content) is False
+    assert time.perf_counter() - start < 1.0
+
+
+def test_matches_legacy_regex_on_random_inputs():
+    rng = random.Random(0)
+    alphabet = ['#{', '}', '?', ':', ' ', '\n', 'if', 'then', 'for', 'in', 'while', 'when',
+                'forEach', 'map', 'filter', '(', 'x', 'i', 'f', 'n', 't']
+    for _ in range(20000):
+        content = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+        assert is_complex_coffee_content(content) == is_complex_coffee_content_legacy(content), repr(content)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Pluggable token counting with a content-hash cache.
+
+The size scripts estimate tokens as characters / 4. That misjudges JSX
+with heavy JSON escaping and non-ASCII text, so this module lets them count
+with a real local tokenizer instead, chosen with a spec string:
+
+    chars                  characters / 4 (the original estimate, default)
+    chars:3.5              characters / 3.5
+    sentencepiece:<model>  a SentencePiece .model file (e.g. the adapter toolkit's tokenizer)
+    hf:<name-or-path>      a Hugging Face tokenizer, loaded from local files only
+    tiktoken:<encoding>    a tiktoken encoding such as cl100k_base
+
+Tokenizer libraries are optional. If one is not installed, or the model
+cannot be loaded, a warning is printed and counting falls back to chars/4.
+
+Counts are cached in token_count_cache.json keyed by the tokenizer spec and
+the sha256 of the text, and texts are tokenized in batches, so re-running an
+evaluation only tokenizes examples that changed.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKENIZER = 'chars'
+DEFAULT_CACHE_FILE = 'token_count_cache.json'
+BATCH_SIZE = 64
+
+
+def estimate_tokens(text_length, chars_per_token=CHARS_PER_TOKEN):
+    """Estimate token count from character length"""
+    return int(text_length / chars_per_token)
+
+
+class CharEstimateCounter:
+    """characters / chars_per_token, exactly as estimate_tokens() computes it."""
+
+    def __init__(self, chars_per_token=CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+        self.name = 'chars' if chars_per_token == CHARS_PER_TOKEN else f'chars:{chars_per_token:g}'
+
+    def count(self, text):
+        return estimate_tokens(len(text), self.chars_per_token)
+
+    def count_batch(self, texts):
+        return [self.count(text) for text in texts]
+
+    def count_overhead(self, whole, parts):
+        """Tokens in `whole` that are not in `parts`, estimated from the character difference."""
+        return estimate_tokens(len(whole) - sum(len(part) for part in parts), self.chars_per_token)
+
+    def overhead_from_counts(self, whole, parts, whole_count, part_counts):
+        """count_overhead() for texts already counted in a batch; the estimate ignores the counts."""
+        return self.count_overhead(whole, parts)
+
+
+class TokenizerCounter:
+    """Counts with a real tokenizer; `encode_batch` maps a list of texts to token id lists."""
+
+    def __init__(self, name, encode_batch):
+        self.name = name
+        self._encode_batch = encode_batch
+
+    def count(self, text):
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts):
+        counts = []
+        for start in range(0, len(texts), BATCH_SIZE):
+            counts.extend(len(ids) for ids in self._encode_batch(texts[start:start + BATCH_SIZE]))
+        return counts
+
+    def count_overhead(self, whole, parts):
+        """Tokens in `whole` that are not accounted for by tokenizing `parts` separately."""
+        whole_count, *part_counts = self.count_batch([whole, *parts])
+        return self.overhead_from_counts(whole, parts, whole_count, part_counts)
+
+    def overhead_from_counts(self, whole, parts, whole_count, part_counts):
+        """count_overhead() for texts already counted in a batch."""
+        return whole_count - sum(part_counts)
+
+
+def _sentencepiece_encoder(model_file):
+    import sentencepiece
+
+    processor = sentencepiece.SentencePieceProcessor(model_file=model_file)
+    return lambda texts: processor.encode(list(texts))
+
+
+def _huggingface_encoder(name_or_path):
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(name_or_path, local_files_only=True)
+    return lambda texts: tokenizer(list(texts), add_special_tokens=False)['input_ids']
+
+
+def _tiktoken_encoder(encoding_name):
+    import tiktoken
+
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda texts: encoding.encode_ordinary_batch(list(texts))
+
+
+TOKENIZER_BACKENDS = {
+    'sentencepiece': _sentencepiece_encoder,
+    'spm': _sentencepiece_encoder,
+    'hf': _huggingface_encoder,
+    'tiktoken': _tiktoken_encoder,
+}
+
+
+def load_token_counter(spec=DEFAULT_TOKENIZER):
+    """
+    Build a counter from a spec string (see module docstring).
+
+    Unknown backends raise ValueError; a backend that cannot be imported or
+    loaded falls back to chars/4 with a warning.
+    """
+    spec = spec or DEFAULT_TOKENIZER
+    kind, _, argument = spec.partition(':')
+    if kind == 'chars':
+        return CharEstimateCounter(float(argument) if argument else CHARS_PER_TOKEN)
+    if kind not in TOKENIZER_BACKENDS:
+        available = ', '.join(['chars', *sorted(TOKENIZER_BACKENDS)])
+        raise ValueError(f"Unknown tokenizer '{spec}'. Available: {available}")
+    if not argument:
+        raise ValueError(f"Tokenizer '{kind}' needs a model, e.g. {kind}:<name-or-path>")
+    try:
+        return TokenizerCounter(spec, TOKENIZER_BACKENDS[kind](argument))
+    except Exception as e:
+        print(f"Warning: Could not load tokenizer {spec} ({e}); falling back to {CHARS_PER_TOKEN} chars per token",
+              file=sys.stderr)
+        return CharEstimateCounter()
+
+
+class CachedTokenCounter:
+    """
+    Wraps a counter with a persistent cache keyed by sha256 of the text.
+
+    Each tokenizer spec gets its own section of the cache file, so switching
+    tokenizers never mixes counts. Call save() to persist new entries.
+    """
+
+    def __init__(self, counter, cache_file=DEFAULT_CACHE_FILE):
+        self.counter = counter
+        self.name = counter.name
+        self.cache_file = cache_file
+        self.hits = 0
+        self.misses = 0
+        self._all = {}
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    self._all = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring unreadable token cache {cache_file}: {e}", file=sys.stderr)
+        self._counts = self._all.setdefault(counter.name, {})
+        self._dirty = False
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def count(self, text):
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts):
+        """Counts for `texts`; only texts not seen before are sent to the tokenizer, in one batch."""
+        keys = [self._key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._counts and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        if missing:
+            for key, count in zip(missing, self.counter.count_batch(list(missing.values()))):
+                self._counts[key] = count
+            self._dirty = True
+        return [self._counts[key] for key in keys]
+
+    def count_overhead(self, whole, parts):
+        if isinstance(self.counter, CharEstimateCounter):
+            return self.counter.count_overhead(whole, parts)
+        whole_count, *part_counts = self.count_batch([whole, *parts])
+        return whole_count - sum(part_counts)
+
+    def overhead_from_counts(self, whole, parts, whole_count, part_counts):
+        return self.counter.overhead_from_counts(whole, parts, whole_count, part_counts)
+
+    def save(self):
+        """Write the cache file atomically if anything new was counted."""
+        if not self.cache_file or not self._dirty:
+            return
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.token_cache.', suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._all, f)
+        os.replace(tmp_path, self.cache_file)
+        self._dirty = False
+
+
+def open_token_counter(spec=DEFAULT_TOKENIZER, cache_file=DEFAULT_CACHE_FILE):
+    """
+    Counter a script should use for `spec`.
+
+    The chars estimate is cheaper than a cache lookup, so it is returned
+    uncached; real tokenizers are wrapped in a CachedTokenCounter.
+    """
+    counter = load_token_counter(spec)
+    if isinstance(counter, CharEstimateCounter) or not cache_file:
+        return counter
+    return CachedTokenCounter(counter, cache_file)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Count tokens in files with a pluggable tokenizer')
+    parser.add_argument('files', nargs='+', help='Files to count')
+    parser.add_argument('--tokenizer', default=DEFAULT_TOKENIZER,
+                        help='chars[:N], sentencepiece:<model>, hf:<name-or-path> or tiktoken:<encoding>')
+    parser.add_argument('--cache', default=DEFAULT_CACHE_FILE,
+                        help=f'Token count cache file (default: {DEFAULT_CACHE_FILE}; empty to disable)')
+    args = parser.parse_args()
+
+    counter = open_token_counter(args.tokenizer, args.cache)
+    texts = []
+    for path in args.files:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            texts.append(f.read())
+    for path, text, count in zip(args.files, texts, counter.count_batch(texts)):
+        print(f"{count:>8} tokens  {len(text):>9} chars  {path}")
+    if isinstance(counter, CachedTokenCounter):
+        counter.save()
+        print(f"Tokenizer {counter.name}: {counter.hits} cached, {counter.misses} counted", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,544 @@
+#!/usr/bin/env python3
+"""
+Shared access to widget source files.
+
+Every analysis script reads the same JSX/CoffeeScript files from
+downloads/<widget_folder>/. This module gives them one way to do it:
+
+- DirectoryCorpus reads the extracted tree directly (the original behaviour).
+- ZipCorpus reads the same files straight out of downloads/*.zip, so the
+  archives never have to be extracted.
+- CorpusIndex keeps a persistent SQLite index of every source file (size,
+  mtime, sha256, raw bytes, decoded char and line counts) plus per-widget
+  derived data (concatenated JSX and its metrics). It is refreshed
+  incrementally from file mtimes, so repeated runs only re-read files that
+  changed.
+
+Both expose the same methods (widget_folders, source_files, read_text,
+widget_code, ...), so scripts take a `corpus` and do not care which one
+they were given. parallel_map() fans per-widget work over a process pool
+with either of them; parallel_imap() does the same as a bounded stream.
+"""
+
+import hashlib
+import os
+import posixpath
+import sqlite3
+import sys
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+SOURCE_EXTENSIONS = ('.jsx', '.coffee')
+DEFAULT_DOWNLOADS_DIR = 'downloads'
+DEFAULT_INDEX_FILE = 'corpus_index.sqlite'
+# ZipCorpus keeps this many archives open at once
+ZIP_HANDLE_CACHE_SIZE = 8
+
+
+def decode_source(data, errors='strict'):
+    """
+    Decode source bytes exactly as open(path, 'r', encoding='utf-8') would.
+
+    Text-mode reads translate \\r\\n and \\r to \\n, so bytes served from the
+    index (or any other non-file source) get the same translation.
+    """
+    return data.decode('utf-8', errors=errors).replace('\r\n', '\n').replace('\r', '\n')
+
+
+def text_metrics(data):
+    """
+    (chars, lines, decode_error) of source bytes as read by decode_source.
+
+    chars and lines are None, and decode_error the message, if they do not decode.
+    """
+    try:
+        text = decode_source(data)
+    except UnicodeDecodeError as e:
+        return None, None, str(e)
+    return len(text), text.count('\n'), None
+
+
+def format_widget_code(parts):
+    """
+    Concatenate (relative_path, content) pairs the way create_dataset.py expects.
+
+    Contents are stripped, empty files are dropped and each file is prefixed
+    with a `// <relative_path>` comment. Returns None if nothing is left.
+    """
+    code_parts = []
+    for relative_path, content in parts:
+        content = content.strip()
+        if content:
+            code_parts.append(f"// {relative_path}\n{content}")
+    return '\n\n'.join(code_parts) if code_parts else None
+
+
+class BaseCorpus:
+    """Behaviour shared by every corpus implementation."""
+
+    def iter_files(self, extensions=SOURCE_EXTENSIONS):
+        """Yield (widget_folder, relative_path) for every source file in the corpus."""
+        for folder in self.widget_folders():
+            for relpath in self.source_files(folder, extensions):
+                yield folder, relpath
+
+    def display_path(self, folder, relpath):
+        """Path used in log messages and result files (downloads/<folder>/<relpath>)."""
+        return os.path.join(self.downloads_dir, folder, relpath)
+
+    def widget_code(self, folder):
+        """Read all JSX files for a widget and concatenate them, or return None."""
+        if not self.has_widget(folder):
+            return None
+        parts = []
+        for relpath in self.source_files(folder, ('.jsx',)):
+            try:
+                parts.append((relpath, self.read_text(folder, relpath)))
+            except Exception as e:
+                print(f"Warning: Could not read {self.display_path(folder, relpath)}: {e}", file=sys.stderr)
+        return format_widget_code(parts)
+
+
+class DirectoryCorpus(BaseCorpus):
+    """Widget sources read straight from the extracted downloads/ tree."""
+
+    def __init__(self, downloads_dir=DEFAULT_DOWNLOADS_DIR):
+        self.downloads_dir = downloads_dir
+
+    def widget_folders(self):
+        """Sorted names of the widget folders under downloads/."""
+        if not os.path.isdir(self.downloads_dir):
+            return []
+        return sorted(
+            entry.name for entry in os.scandir(self.downloads_dir)
+            if entry.is_dir() and not entry.name.startswith('.')
+        )
+
+    def has_widget(self, folder):
+        return os.path.isdir(os.path.join(self.downloads_dir, folder))
+
+    def source_files(self, folder, extensions=SOURCE_EXTENSIONS):
+        """
+        Sorted paths (relative to the widget folder) of files with the given extensions.
+
+        Matches `glob('<folder>/**/*<ext>', recursive=True)`: hidden files and
+        directories are skipped.
+        """
+        widget_path = os.path.join(self.downloads_dir, folder)
+        found = []
+        for dirpath, dirnames, filenames in os.walk(widget_path, followlinks=True):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for name in filenames:
+                if not name.startswith('.') and name.endswith(extensions):
+                    found.append(os.path.relpath(os.path.join(dirpath, name), widget_path))
+        return sorted(found)
+
+    def read_bytes(self, folder, relpath):
+        with open(os.path.join(self.downloads_dir, folder, relpath), 'rb') as f:
+            return f.read()
+
+    def read_text(self, folder, relpath, errors='strict'):
+        with open(os.path.join(self.downloads_dir, folder, relpath), 'r', encoding='utf-8', errors=errors) as f:
+            return f.read()
+
+    def file_signature(self, folder, relpath):
+        """(size, mtime_ns) used to detect changed files."""
+        stat = os.stat(os.path.join(self.downloads_dir, folder, relpath))
+        return stat.st_size, stat.st_mtime_ns
+
+
+class ZipCorpus(BaseCorpus):
+    """
+    Widget sources served directly from the downloaded archives.
+
+    downloads/<folder>.zip stands in for downloads/<folder>/: member names
+    are the relative paths, so listings and contents match what extraction
+    would have produced. Like extraction (which drops the top-level __MACOSX
+    folder) and DirectoryCorpus (which skips hidden names), __MACOSX/ members
+    and dotfiles are ignored. Each archive's central directory is parsed once
+    and cached, keyed by the archive's size and mtime.
+    """
+
+    def __init__(self, downloads_dir=DEFAULT_DOWNLOADS_DIR):
+        self.downloads_dir = downloads_dir
+        self._members = {}
+        self._handles = OrderedDict()
+
+    def __getstate__(self):
+        # Open ZipFile handles cannot be pickled; worker processes reopen lazily
+        return {'downloads_dir': self.downloads_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['downloads_dir'])
+
+    def close(self):
+        for handle in self._handles.values():
+            handle.close()
+        self._handles.clear()
+
+    def archive_path(self, folder):
+        return os.path.join(self.downloads_dir, f'{folder}.zip')
+
+    def widget_folders(self):
+        """Sorted names of the archives under downloads/, without .zip."""
+        if not os.path.isdir(self.downloads_dir):
+            return []
+        return sorted(
+            entry.name[:-4] for entry in os.scandir(self.downloads_dir)
+            if entry.name.endswith('.zip') and not entry.name.startswith('.') and entry.is_file()
+        )
+
+    def has_widget(self, folder):
+        return os.path.isfile(self.archive_path(folder))
+
+    def _archive(self, folder):
+        """Open ZipFile for a widget, from a small LRU of handles."""
+        handle = self._handles.pop(folder, None)
+        if handle is None:
+            handle = zipfile.ZipFile(self.archive_path(folder), 'r')
+            if len(self._handles) >= ZIP_HANDLE_CACHE_SIZE:
+                _, oldest = self._handles.popitem(last=False)
+                oldest.close()
+        self._handles[folder] = handle
+        return handle
+
+    def members(self, folder):
+        """Cached {relpath: ZipInfo} for the source-relevant members of a widget archive."""
+        stat = os.stat(self.archive_path(folder))
+        signature = (stat.st_size, stat.st_mtime_ns)
+        cached = self._members.get(folder)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        members = {}
+        for info in self._archive(folder).infolist():
+            if info.is_dir():
+                continue
+            relpath = posixpath.normpath(info.filename)
+            parts = relpath.split('/')
+            if relpath.startswith('/') or '..' in parts or parts[0] == '__MACOSX':
+                continue
+            if any(part.startswith('.') for part in parts):
+                continue
+            members[relpath] = info
+        self._members[folder] = (signature, members)
+        return members
+
+    def source_files(self, folder, extensions=SOURCE_EXTENSIONS):
+        """Sorted member paths with the given extensions."""
+        return sorted(relpath for relpath in self.members(folder) if relpath.endswith(extensions))
+
+    def read_bytes(self, folder, relpath):
+        info = self.members(folder).get(relpath)
+        if info is None:
+            raise FileNotFoundError(self.display_path(folder, relpath))
+        return self._archive(folder).read(info)
+
+    def read_text(self, folder, relpath, errors='strict'):
+        return decode_source(self.read_bytes(folder, relpath), errors)
+
+    def file_signature(self, folder, relpath):
+        """(size, CRC-32) of the member, used to detect changed files."""
+        info = self.members(folder).get(relpath)
+        if info is None:
+            raise FileNotFoundError(self.display_path(folder, relpath))
+        return info.file_size, info.CRC
+
+
+class CorpusIndex(BaseCorpus):
+    """
+    Persistent SQLite index over a source corpus.
+
+    Call refresh() to bring it up to date; only files whose (size, mtime)
+    changed are re-read and only widgets with changed files are re-derived.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            folder TEXT NOT NULL,
+            relpath TEXT NOT NULL,
+            ext TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            content BLOB NOT NULL,
+            chars INTEGER,
+            lines INTEGER,
+            decode_error TEXT,
+            PRIMARY KEY (folder, relpath)
+        );
+        CREATE TABLE IF NOT EXISTS widgets (
+            folder TEXT PRIMARY KEY,
+            jsx_code TEXT,
+            jsx_chars INTEGER NOT NULL,
+            jsx_lines INTEGER NOT NULL,
+            jsx_files INTEGER NOT NULL,
+            coffee_files INTEGER NOT NULL,
+            code_sha256 TEXT
+        );
+    """
+    # Bumped whenever a table changes; older indexes are rebuilt on the next refresh().
+    SCHEMA_VERSION = 3
+
+    def __init__(self, index_file=DEFAULT_INDEX_FILE, downloads_dir=DEFAULT_DOWNLOADS_DIR):
+        self.index_file = index_file
+        self.downloads_dir = downloads_dir
+        self.conn = sqlite3.connect(index_file)
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < self.SCHEMA_VERSION:
+            self.conn.executescript('DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS widgets;')
+            self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __getstate__(self):
+        # sqlite connections cannot be pickled; worker processes reconnect
+        return {'index_file': self.index_file, 'downloads_dir': self.downloads_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['index_file'], state['downloads_dir'])
+
+    def refresh(self, source=None):
+        """
+        Bring the index in line with `source` (default: DirectoryCorpus over downloads_dir;
+        pass a ZipCorpus to index the archives instead).
+
+        Returns a dict with counts of added, updated, removed and unchanged files.
+        """
+        if source is None:
+            source = DirectoryCorpus(self.downloads_dir)
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
+        known = {
+            (folder, relpath): (size, mtime_ns)
+            for folder, relpath, size, mtime_ns in self.conn.execute(
+                'SELECT folder, relpath, size, mtime_ns FROM files'
+            )
+        }
+        known_folders = {row[0] for row in self.conn.execute('SELECT folder FROM widgets')}
+        seen = set()
+        dirty_folders = set()
+
+        with self.conn:
+            for folder in source.widget_folders():
+                seen_folder = False
+                for relpath in source.source_files(folder, SOURCE_EXTENSIONS):
+                    seen_folder = True
+                    key = (folder, relpath)
+                    seen.add(key)
+                    signature = tuple(source.file_signature(folder, relpath))
+                    if known.get(key) == signature:
+                        stats['unchanged'] += 1
+                        continue
+                    data = source.read_bytes(folder, relpath)
+                    self.conn.execute(
+                        'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (folder, relpath, os.path.splitext(relpath)[1], signature[0], signature[1],
+                         hashlib.sha256(data).hexdigest(), data, *text_metrics(data)),
+                    )
+                    stats['updated' if key in known else 'added'] += 1
+                    dirty_folders.add(folder)
+                if not seen_folder or folder not in known_folders:
+                    dirty_folders.add(folder)
+
+            for key in set(known) - seen:
+                self.conn.execute('DELETE FROM files WHERE folder = ? AND relpath = ?', key)
+                stats['removed'] += 1
+                dirty_folders.add(key[0])
+
+            current_folders = set(source.widget_folders())
+            for folder in known_folders - current_folders:
+                self.conn.execute('DELETE FROM widgets WHERE folder = ?', (folder,))
+            for folder in dirty_folders & current_folders:
+                self._derive_widget(folder)
+
+        return stats
+
+    def _derive_widget(self, folder):
+        """Recompute the per-widget row (concatenated JSX and metrics) from indexed files."""
+        jsx_parts = []
+        jsx_chars = jsx_lines = jsx_files = coffee_files = 0
+        for relpath, ext, content, chars, lines, decode_error in self.conn.execute(
+            'SELECT relpath, ext, content, chars, lines, decode_error FROM files WHERE folder = ? ORDER BY relpath',
+            (folder,),
+        ):
+            if ext == '.coffee':
+                coffee_files += 1
+                continue
+            if ext != '.jsx':
+                continue
+            jsx_files += 1
+            if decode_error is not None:
+                print(f"Warning: Could not read {self.display_path(folder, relpath)}: {decode_error}", file=sys.stderr)
+                continue
+            jsx_chars += chars
+            jsx_lines += lines
+            jsx_parts.append((relpath, decode_source(bytes(content))))
+        code = format_widget_code(jsx_parts)
+        code_sha256 = hashlib.sha256(code.encode('utf-8')).hexdigest() if code is not None else None
+        self.conn.execute(
+            'INSERT OR REPLACE INTO widgets VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (folder, code, jsx_chars, jsx_lines, jsx_files, coffee_files, code_sha256),
+        )
+
+    def widget_folders(self):
+        return [row[0] for row in self.conn.execute('SELECT folder FROM widgets ORDER BY folder')]
+
+    def has_widget(self, folder):
+        return self.conn.execute('SELECT 1 FROM widgets WHERE folder = ?', (folder,)).fetchone() is not None
+
+    def source_files(self, folder, extensions=SOURCE_EXTENSIONS):
+        placeholders = ', '.join('?' for _ in extensions)
+        return [
+            row[0] for row in self.conn.execute(
+                f'SELECT relpath FROM files WHERE folder = ? AND ext IN ({placeholders}) ORDER BY relpath',
+                (folder, *extensions),
+            )
+        ]
+
+    def read_bytes(self, folder, relpath):
+        row = self.conn.execute(
+            'SELECT content FROM files WHERE folder = ? AND relpath = ?', (folder, relpath)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(self.display_path(folder, relpath))
+        return bytes(row[0])
+
+    def read_text(self, folder, relpath, errors='strict'):
+        return decode_source(self.read_bytes(folder, relpath), errors)
+
+    def file_signature(self, folder, relpath):
+        row = self.conn.execute(
+            'SELECT size, mtime_ns FROM files WHERE folder = ? AND relpath = ?', (folder, relpath)
+        ).fetchone()
+        if row is None:
+            raise FileNotFoundError(self.display_path(folder, relpath))
+        return row[0], row[1]
+
+    def widget_code(self, folder):
+        row = self.conn.execute('SELECT jsx_code FROM widgets WHERE folder = ?', (folder,)).fetchone()
+        return row[0] if row is not None else None
+
+    def file_metrics(self, folder, extensions=SOURCE_EXTENSIONS):
+        """
+        [(relpath, chars, lines, decode_error)] of the widget's files, in source_files() order.
+
+        chars/lines are those of the strictly decoded text; for files that do not
+        decode they are None and decode_error holds the UnicodeDecodeError message.
+        """
+        placeholders = ', '.join('?' for _ in extensions)
+        return self.conn.execute(
+            f'SELECT relpath, chars, lines, decode_error FROM files '
+            f'WHERE folder = ? AND ext IN ({placeholders}) ORDER BY relpath',
+            (folder, *extensions),
+        ).fetchall()
+
+    def widget_metrics(self, folder):
+        """Derived per-widget metrics, or None if the widget is not indexed."""
+        row = self.conn.execute(
+            'SELECT jsx_chars, jsx_lines, jsx_files, coffee_files, code_sha256 FROM widgets WHERE folder = ?',
+            (folder,),
+        ).fetchone()
+        if row is None:
+            return None
+        keys = ('jsx_chars', 'jsx_lines', 'jsx_files', 'coffee_files', 'code_sha256')
+        return dict(zip(keys, row))
+
+
+def open_corpus(downloads_dir=DEFAULT_DOWNLOADS_DIR, index_file=None, from_zips=False):
+    """
+    Return the corpus a script should read from.
+
+    Without `index_file` this is a DirectoryCorpus, or a ZipCorpus with
+    `from_zips`. With it, the SQLite index is refreshed from that source
+    (re-reading only changed files) and returned instead.
+    """
+    source = ZipCorpus(downloads_dir) if from_zips else DirectoryCorpus(downloads_dir)
+    if not index_file:
+        return source
+    index = CorpusIndex(index_file, downloads_dir)
+    stats = index.refresh(source)
+    print(
+        f"Corpus index {index_file}: {stats['added']} added, {stats['updated']} updated, "
+        f"{stats['removed']} removed, {stats['unchanged']} unchanged",
+        file=sys.stderr,
+    )
+    return index
+
+
+# Context shared by every task in a parallel_map() worker process
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _call_with_context(func, item):
+    return func(_worker_context, item)
+
+
+def parallel_map(func, items, jobs=1, context=None, chunksize=None):
+    """
+    Return [func(context, item) for item in items], optionally across `jobs` processes.
+
+    `func` must be a module-level function and `context` picklable (corpora
+    are); the context is sent once per worker rather than once per item.
+    Results come back in input order, so anything merged from them is
+    identical to a serial run. Workers should return messages instead of
+    printing them, or their output interleaves.
+    """
+    items = list(items)
+    if jobs is None or jobs <= 1 or len(items) < 2:
+        return [func(context, item) for item in items]
+    if chunksize is None:
+        chunksize = max(1, len(items) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(context,)) as executor:
+        return list(executor.map(partial(_call_with_context, func), items, chunksize=chunksize))
+
+
+def parallel_imap(func, items, jobs=1, context=None, buffer_size=256):
+    """
+    Yield func(context, item) for each item in input order, streaming.
+
+    Like parallel_map, but `items` may be any iterable and is consumed lazily:
+    at most `buffer_size` items are in flight at once, so memory does not
+    grow with the number of items.
+    """
+    if jobs is None or jobs <= 1:
+        for item in items:
+            yield func(context, item)
+        return
+    call = partial(_call_with_context, func)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(context,)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(call, item))
+            if len(pending) >= buffer_size:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build or refresh the persistent widget corpus index')
+    parser.add_argument('--downloads', default=DEFAULT_DOWNLOADS_DIR,
+                        help='Directory containing widget files')
+    parser.add_argument('--index', default=DEFAULT_INDEX_FILE,
+                        help=f'SQLite index file (default: {DEFAULT_INDEX_FILE})')
+    parser.add_argument('--from-zips', action='store_true',
+                        help='Index the files inside downloads/*.zip instead of the extracted folders')
+    args = parser.parse_args()
+
+    index = open_corpus(args.downloads, args.index, from_zips=args.from_zips)
+    print(f"Indexed {len(index.widget_folders())} widgets")
+    index.close()
+
+if __name__ == '__main__':
+    main()